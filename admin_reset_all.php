@@ -78,6 +78,10 @@ foreach (array_merge($basetables, $optionaltables) as $table)
     }
 }
 
+// Gradebook statistics from /aggregate are cached per activity
+require_once(__DIR__ . '/aggregate_helpers.php');
+spe_aggregate_invalidate((int)$cm->instance);
+
 // Clear published Graded
 $prefname = 'mod_spe_groupscore_' . $cm->id;
 $DB->delete_records('user_preferences', ['name' => $prefname]);
@@ -0,0 +1,174 @@
+<?php
+defined('MOODLE_INTERNAL') || die();
+
+require_once($CFG->libdir . '/filelib.php');
+require_once(__DIR__ . '/ca_helpers.php');
+
+// Request body for the Sentiment API's /aggregate endpoint: every rating, every analysed
+// comment (with its pair's disparity flag) and the team map of one activity, in three queries
+function spe_aggregate_payload(int $speid): array
+{
+    global $DB;
+    $mgr = $DB->get_manager();
+
+    $ratings = [];
+    $rs = $DB->get_recordset_sql("
+        SELECT r.id, r.raterid, r.rateeid, r.criterion, r.score
+          FROM {spe_rating} r
+         WHERE r.speid = :speid
+    ", ['speid' => $speid]);
+    foreach ($rs as $r)
+    {
+        $ratings[] =
+        [
+            'rater'     => (int)$r->raterid,
+            'ratee'     => (int)$r->rateeid,
+            'criterion' => (string)$r->criterion,
+            'score'     => (int)$r->score
+        ];
+    }
+    $rs->close();
+
+    $comments = [];
+    if ($mgr->table_exists('spe_sentiment'))
+    {
+        $hasdisp = $mgr->table_exists('spe_disparity');
+        $sql = "SELECT s.id, s.raterid, s.rateeid, s.sentiment, s.label" .
+               ($hasdisp ? ", d.isdisparity" : "") . "
+                  FROM {spe_sentiment} s" .
+               ($hasdisp ? "
+             LEFT JOIN (SELECT raterid, rateeid, MAX(isdisparity) AS isdisparity
+                          FROM {spe_disparity}
+                         WHERE speid = :dspeid
+                      GROUP BY raterid, rateeid) d
+                    ON d.raterid = s.raterid AND d.rateeid = s.rateeid" : "") . "
+                 WHERE s.speid = :speid
+                   AND s.status = 'done'
+                   AND s.sentiment IS NOT NULL";
+        $params = $hasdisp ? ['speid' => $speid, 'dspeid' => $speid] : ['speid' => $speid];
+        $rs = $DB->get_recordset_sql($sql, $params);
+        foreach ($rs as $s)
+        {
+            $comments[] =
+            [
+                'rater'     => (int)$s->raterid,
+                'ratee'     => (int)$s->rateeid,
+                'compound'  => (float)$s->sentiment,
+                'label'     => (string)($s->label ?? ''),
+                'disparity' => !empty($s->isdisparity)
+            ];
+        }
+        $rs->close();
+    }
+
+    $teams = [];
+    if ($mgr->table_exists('spe_teammap'))
+    {
+        $seen = [];
+        $rs = $DB->get_recordset('spe_teammap', ['speid' => $speid], 'id', 'id, userid, teamname');
+        foreach ($rs as $t)
+        {
+            // A user belongs to one team per activity; the API refuses overlapping teams
+            if (isset($seen[(int)$t->userid]))
+            {
+                continue;
+            }
+            $seen[(int)$t->userid] = true;
+            $teams[(string)$t->teamname][] = (int)$t->userid;
+        }
+        $rs->close();
+    }
+
+    return ['ratings' => $ratings, 'comments' => $comments, 'teams' => (object)$teams];
+}
+
+// Per-pair, per-ratee and per-team statistics of one activity from the Sentiment API,
+// or null if the API is not configured, unreachable or answers anything but a verified 200.
+// Answers (null included) are kept in the 'aggregate' cache for a few minutes, so report
+// pages call the API at most once per activity in that time
+function spe_aggregate_fetch(int $speid): ?stdClass
+{
+    $apiurl = trim((string)get_config('mod_spe', 'sentiment_url'));
+    if ($apiurl === '')
+    {
+        return null;
+    }
+
+    $cache  = cache::make('mod_spe', 'aggregate');
+    $cached = $cache->get($speid);
+    if ($cached !== false)
+    {
+        return $cached->data;
+    }
+    $data = spe_aggregate_request($apiurl, $speid);
+    $cache->set($speid, (object)['data' => $data]);
+    return $data;
+}
+
+// Forget the cached statistics of one activity after its comments or ratings changed
+function spe_aggregate_invalidate(int $speid): void
+{
+    cache::make('mod_spe', 'aggregate')->delete($speid);
+}
+
+// One signed POST of the activity's rows to /aggregate; null on any failure
+function spe_aggregate_request(string $apiurl, int $speid): ?stdClass
+{
+    $apitoken = trim((string)get_config('mod_spe', 'sentiment_token'));
+    $path = '/aggregate';
+    $url  = preg_replace('#/analyze/?$#', '', rtrim($apiurl, '/')) . $path;
+
+    $payload   = json_encode(spe_aggregate_payload($speid), JSON_UNESCAPED_UNICODE);
+    $caheaders = spe_ca_build_request_headers($path, $payload, 'sha512');
+    $headers   = ['Content-Type: application/json', 'Accept: application/json'];
+    if ($apitoken !== '')
+    {
+        $headers[] = 'X-API-Token: ' . $apitoken;
+    }
+    foreach ($caheaders as $k => $v)
+    {
+        $headers[] = $k . ': ' . $v;
+    }
+
+    try
+    {
+        $curl = new curl();
+        $resp = $curl->post($url, $payload, [
+            'CURLOPT_HTTPHEADER'    => $headers,
+            // Called while a report page renders: give up quickly on an unreachable API
+            'timeout'               => 5,
+            'CURLOPT_TIMEOUT'       => 5,
+            'CURLOPT_CONNECTTIMEOUT' => 2,
+            'RETURNTRANSFER'        => true,
+            'HEADER'                => true,
+        ]);
+        $info        = $curl->get_info();
+        $http        = (int)($info['http_code'] ?? 0);
+        $header_size = (int)($info['header_size'] ?? 0);
+        if ($http !== 200)
+        {
+            return null;
+        }
+
+        $respheaders = [];
+        foreach (preg_split('/\r\n/', substr($resp, 0, $header_size)) as $line)
+        {
+            if (strpos($line, ':') !== false)
+            {
+                [$k, $v] = array_map('trim', explode(':', $line, 2));
+                $respheaders[strtolower($k)][] = $v;
+            }
+        }
+        $body = substr($resp, $header_size);
+        spe_ca_verify_server_response($path, $body, $respheaders);
+    } catch (Exception $e) {
+        return null;
+    }
+
+    $data = json_decode($body);
+    if (!is_object($data) || empty($data->ok) || !isset($data->ratees) || !is_array($data->ratees))
+    {
+        return null;
+    }
+    return $data;
+}
@@ -38,27 +38,97 @@ if (!$pendings)
 // API interaction
 require_once($CFG->libdir . '/filelib.php');
 
-function spe_probe_api(string $apiurl): bool 
+// Signature mode the API accepts ('sha512' or 'raw'), or null if it is not reachable
+function spe_probe_api(string $apiurl): ?string 
 {
     $curl  = new curl();
     $base  = rtrim($apiurl, '/');
-    $probe = preg_replace('#/analyze/?$#', '', $base) . '/openapi.json';
+    $root  = preg_replace('#/analyze/?$#', '', $base);
 
-    try 
+    // /healthz is constant-time and advertises the signature modes; older API builds
+    // only have /openapi.json and only check raw signatures
+    foreach (['/healthz', '/openapi.json'] as $probe)
     {
-        $curl->get($probe, ['timeout' => 5]);
-        $info = $curl->get_info();
-        if (!empty($info['http_code']) && (int)$info['http_code'] === 200) { return true; }
-    } catch (Exception $e) { /* ignore */ }
+        try 
+        {
+            $curl->get($root . $probe, [], ['timeout' => 5]);
+            $info = $curl->get_info();
+            if (!empty($info['http_code']) && (int)$info['http_code'] === 200) 
+            { 
+                return $probe === '/healthz' ? spe_ca_pick_sig_mode((array)$curl->getResponse()) : 'raw'; 
+            }
+        } catch (Exception $e) { /* ignore */ }
+    }
 
     try 
     {
         $curl->options($base, ['timeout' => 5]);
         $info = $curl->get_info();
-        if (!empty($info['http_code']) && (int)$info['http_code'] === 200) { return true; }
+        if (!empty($info['http_code']) && (int)$info['http_code'] === 200) { return 'raw'; }
     } catch (Exception $e) { /* ignore */ }
 
-    return false;
+    return null;
+}
+
+// Response headers as lower-cased name => [values], from a raw header block
+function spe_push_response_headers(string $raw): array 
+{
+    $headers = [];
+    foreach (preg_split('/\r\n/', $raw) as $line) 
+    {
+        if (strpos($line, ':') !== false) 
+        {
+            [$k, $v] = array_map('trim', explode(':', $line, 2));
+            $headers[strtolower($k)][] = $v;
+        }
+    }
+    return $headers;
+}
+
+// Pushes above this many items go through the API's job queue (POST /jobs, then GET /jobs/{id})
+define('SPE_PUSH_JOB_ITEMS', 2000);
+
+// One signed call to the job API: a POST of $body, or a GET when $body is empty. $path is what
+// gets signed (with its query string, for GET). Returns [HTTP status, verified JSON body or null]
+function spe_jobs_call(string $url, string $path, string $body, string $sigmode, string $apitoken): array 
+{
+    $caheaders = spe_ca_build_request_headers($path, $body, $sigmode);
+    $headers   = ['Accept: application/json'];
+    if ($body !== '') 
+    { 
+        $headers[] = 'Content-Type: application/json'; 
+    }
+    if ($apitoken !== '') 
+    { 
+        $headers[] = 'X-API-Token: ' . $apitoken; 
+    }
+    foreach ($caheaders as $k => $v) 
+    { 
+        $headers[] = $k . ': ' . $v; 
+    }
+
+    $curl    = new curl();
+    $options = 
+    [
+        'CURLOPT_HTTPHEADER' => $headers,
+        'timeout'            => 30,
+        'CURLOPT_TIMEOUT'    => 30,
+        'RETURNTRANSFER'     => true,
+        'HEADER'             => true,
+    ];
+    $resp = $body !== '' ? $curl->post($url, $body, $options) : $curl->get($url, [], $options);
+
+    $info        = $curl->get_info();
+    $http        = (int)($info['http_code'] ?? 0);
+    $header_size = (int)($info['header_size'] ?? 0);
+    $respbody    = substr((string)$resp, $header_size);
+    if ($http === 0) 
+    {
+        return [0, null];
+    }
+    spe_ca_verify_server_response($path, $respbody, spe_push_response_headers(substr((string)$resp, 0, $header_size)));
+    $data = json_decode($respbody);
+    return [$http, is_object($data) ? $data : null];
 }
 
 $apiurl   = trim((string)get_config('mod_spe', 'sentiment_url'));
@@ -72,7 +142,9 @@ if (strpos($apiurl, '/analyze') === false)
     $apiurl = rtrim($apiurl, '/') . '/analyze'; 
 }
 
-if (!spe_probe_api($apiurl)) 
+require_once(__DIR__ . '/ca_helpers.php');
+$sigmode = spe_probe_api($apiurl);
+if ($sigmode === null) 
 {
     echo $OUTPUT->notification('Sentiment API is not reachable. Please ensure it is running and the URL is correct.', 'notifyproblem');
     $back = new moodle_url('/mod/spe/instructor.php', ['id' => $cm->id]);
@@ -88,14 +160,24 @@ $SCORE_MAX_DEFAULT = 25;
 $items = [];
 $byid  = []; 
 
+// Score totals of every rater/ratee pair in one grouped query (not one SUM per pending row)
+$pairtotals = [];
+$rs = $DB->get_recordset_sql(
+    "SELECT raterid, rateeid, SUM(score) AS total
+       FROM {spe_rating}
+      WHERE speid = :s
+   GROUP BY raterid, rateeid",
+    ['s' => $cm->instance]
+);
+foreach ($rs as $t) 
+{
+    $pairtotals[$t->raterid . '->' . $t->rateeid] = (int)$t->total;
+}
+$rs->close();
+
 foreach ($pendings as $row) 
 {
-    $scoretotal = (int)$DB->get_field_sql(
-        "SELECT COALESCE(SUM(score),0)
-           FROM {spe_rating}
-          WHERE speid = :s AND raterid = :r AND rateeid = :e",
-        ['s' => $cm->instance, 'r' => $row->raterid, 'e' => $row->rateeid]
-    );
+    $scoretotal = $pairtotals[$row->raterid . '->' . $row->rateeid] ?? 0;
 
     $items[] = 
     [
@@ -113,92 +195,178 @@ foreach ($pendings as $row)
     ];
 }
 
-if (count($items) > 2000) 
-{ 
-    $items = array_slice($items, 0, 2000); 
-}
-
 // Cannonical JSON payload
 $payload = json_encode(['items' => $items], JSON_UNESCAPED_UNICODE);
 
-require_once(__DIR__ . '/ca_helpers.php');
-$path      = '/analyze';
-$caheaders = spe_ca_build_request_headers($path, $payload);
+require_once(__DIR__ . '/columnar_helpers.php');
+$root   = preg_replace('#/analyze/?$#', '', rtrim($apiurl, '/'));
+$jobkey = 'pushjob_' . $cm->instance;
+$jobid  = (string)get_config('mod_spe', $jobkey);
+$back   = new moodle_url('/mod/spe/instructor.php', ['id' => $cm->id]);
 
-// API request
-$curl    = new curl();
-$headers = ['Content-Type: application/json'];
-if ($apitoken !== '') 
-{ 
-    $headers[] = 'X-API-Token: ' . $apitoken; 
-}
-foreach ($caheaders as $k => $v) 
-{ 
-    $headers[] = $k . ': ' . $v; 
-}
+if ($jobid !== '' || count($items) > SPE_PUSH_JOB_ITEMS)
+{
+    // Large pushes go through the API's job queue: submit once, then every visit of this page
+    // saves what the API has finished so far. Pending rows stay pending until their result is saved
+    try 
+    {
+        if ($jobid === '')
+        {
+            [$http, $job] = spe_jobs_call($root . '/jobs', '/jobs', $payload, $sigmode, $apitoken);
+            if ($http !== 202 || empty($job->ok) || empty($job->job->id))
+            {
+                throw new moodle_exception('Sentiment API did not accept the job (HTTP ' . $http . ').');
+            }
+            $jobid = (string)$job->job->id;
+            set_config($jobkey, $jobid, 'mod_spe');
+        }
+
+        $results = [];
+        $start   = 0;
+        do
+        {
+            $signed = '/jobs/' . rawurlencode($jobid) . '?start=' . $start . '&limit=2000';
+            [$http, $page] = spe_jobs_call($root . $signed, $signed, '', $sigmode, $apitoken);
+            if ($http === 404)
+            {
+                // Purged or lost by the API: submit the pending items again on the next push
+                unset_config($jobkey, 'mod_spe');
+                throw new moodle_exception('Sentiment API no longer knows the analysis job; run the analysis again.');
+            }
+            if ($http !== 200 || empty($page->ok) || !isset($page->results) || !is_array($page->results))
+            {
+                throw new moodle_exception('Sentiment API returned HTTP ' . $http . ' for the analysis job.');
+            }
+            foreach ($page->results as $res) 
+            {
+                $results[] = $res;
+            }
+            $start = (int)$page->next;
+        } while (count($page->results) > 0 && $start < (int)$page->job->total);
+    } catch (Exception $e) {
+        echo $OUTPUT->notification('Error contacting Sentiment API: ' . s($e->getMessage()), 'notifyproblem');
+        echo html_writer::div($OUTPUT->single_button($back, '← Back to Instructor', 'get'), 'mt-3');
+        echo $OUTPUT->footer();
+        exit;
+    }
 
-try 
+    $state = (string)$page->job->state;
+    if ($state === 'done' || $state === 'failed' || $state === 'cancelled')
+    {
+        unset_config($jobkey, 'mod_spe');
+    }
+    if ($state === 'failed' || $state === 'cancelled')
+    {
+        echo $OUTPUT->notification('The analysis job ' . $state . (!empty($page->job->error) ? ': ' . s((string)$page->job->error) : '.') .
+            ' Items that were not analyzed remain pending.', 'notifyproblem');
+    }
+    elseif ($state !== 'done')
+    {
+        echo $OUTPUT->notification('Analysis is running in the background: ' . (int)$page->job->done . ' of ' .
+            (int)$page->job->total . ' items done. Run the analysis again later to save the rest.', 'notifyinfo');
+    }
+    if (!$results && $state !== 'done')
+    {
+        echo html_writer::div($OUTPUT->single_button($back, '← Back to Instructor', 'get'), 'mt-3');
+        echo $OUTPUT->footer();
+        exit;
+    }
+    $data = (object)['ok' => true, 'results' => $results];
+}
+else
 {
-    $resp = $curl->post($apiurl, $payload, [
-        'CURLOPT_HTTPHEADER' => $headers,
-        'timeout'            => 60,
-        'CURLOPT_TIMEOUT'    => 60,
-        'RETURNTRANSFER'     => true,
-        'HEADER'             => true,
-    ]);
+    $path      = '/analyze';
+    // Sign a SHA-512 digest of the payload when the API accepts it: signing cost does not grow with the batch
+    $caheaders = spe_ca_build_request_headers($path, $payload, $sigmode);
+
+    // API request: the compact columnar format (version 2 carries the span probabilities)
+    $curl    = new curl();
+    $headers = ['Content-Type: application/json', 'Accept: ' . SPE_COLUMNAR_MEDIA_TYPE . '; version=2'];
+    if ($apitoken !== '') 
+    { 
+        $headers[] = 'X-API-Token: ' . $apitoken; 
+    }
+    foreach ($caheaders as $k => $v) 
+    { 
+        $headers[] = $k . ': ' . $v; 
+    }
 
-    $info        = $curl->get_info();
-    $http        = (int)($info['http_code'] ?? 0);
-    $header_size = (int)($info['header_size'] ?? 0);
-    $raw_headers = substr($resp, 0, $header_size);
-    $body        = substr($resp, $header_size);
+    try 
+    {
+        $resp = $curl->post($apiurl, $payload, [
+            'CURLOPT_HTTPHEADER' => $headers,
+            'timeout'            => 60,
+            'CURLOPT_TIMEOUT'    => 60,
+            'RETURNTRANSFER'     => true,
+            'HEADER'             => true,
+        ]);
+
+        $info        = $curl->get_info();
+        $http        = (int)($info['http_code'] ?? 0);
+        $header_size = (int)($info['header_size'] ?? 0);
+        $body        = substr($resp, $header_size);
 
-    // Verify server response signature
-    $respheaders = [];
-    foreach (preg_split('/\r\n/', $raw_headers) as $line) 
+        // Verify server response signature
+        $respheaders = spe_push_response_headers(substr($resp, 0, $header_size));
+        $iscolumnar  = strpos(strtolower($respheaders['content-type'][0] ?? ''), SPE_COLUMNAR_MEDIA_TYPE) === 0;
+        spe_ca_verify_server_response($path, $body, $respheaders);
+
+        if ($http === 429)
+        {
+            // Admission control: the API is busy with other sites; nothing was analyzed
+            $retry = (int)($respheaders['retry-after'][0] ?? 0);
+            echo $OUTPUT->notification('Sentiment API is busy right now. Please try again' .
+                ($retry > 0 ? ' in about ' . $retry . ' second(s).' : ' shortly.') .
+                ' All items remain pending.', 'notifyproblem');
+            echo html_writer::div($OUTPUT->single_button($back, '← Back to Instructor', 'get'), 'mt-3');
+            echo $OUTPUT->footer();
+            exit;
+        }
+
+        if ($http >= 400 || $http === 0)
+        {
+            echo $OUTPUT->notification('Sentiment API returned HTTP ' . $http . '.', 'notifyproblem');
+            echo html_writer::div($OUTPUT->single_button($back, '← Back to Instructor', 'get'), 'mt-3');
+            echo $OUTPUT->footer();
+            exit;
+        }
+
+        $resp = $body;
+    } catch (Exception $e) {
+        echo $OUTPUT->notification('Error contacting Sentiment API: ' . s($e->getMessage()), 'notifyproblem');
+        echo html_writer::div($OUTPUT->single_button($back, '← Back to Instructor', 'get'), 'mt-3');
+        echo $OUTPUT->footer();
+        exit;
+    }
+
+    // Parse response
+    if ($iscolumnar) 
     {
-        if (strpos($line, ':') !== false) 
+        try 
         {
-            [$k, $v] = array_map('trim', explode(':', $line, 2));
-            $respheaders[strtolower($k)][] = $v;
+            $data = spe_columnar_decode($resp);
+        } catch (Exception $e) {
+            $data = null;
         }
     }
-    spe_ca_verify_server_response($path, $body, $respheaders);
+    else 
+    {
+        $data = json_decode($resp);
+    }
 
-    if ($http >= 400 || $http === 0) 
+    if ($data === null || (!$iscolumnar && json_last_error() !== JSON_ERROR_NONE)) 
     {
-        echo $OUTPUT->notification('Sentiment API returned HTTP ' . $http . '.', 'notifyproblem');
-        $back = new moodle_url('/mod/spe/instructor.php', ['id' => $cm->id]);
+        echo $OUTPUT->notification('Unexpected (non-JSON) response from Sentiment API.', 'notifyproblem');
+        echo html_writer::tag('pre', s(substr($resp, 0, 400)));
         echo html_writer::div($OUTPUT->single_button($back, '← Back to Instructor', 'get'), 'mt-3');
         echo $OUTPUT->footer();
         exit;
     }
-
-    $resp = $body;
-} catch (Exception $e) {
-    echo $OUTPUT->notification('Error contacting Sentiment API: ' . s($e->getMessage()), 'notifyproblem');
-    $back = new moodle_url('/mod/spe/instructor.php', ['id' => $cm->id]);
-    echo html_writer::div($OUTPUT->single_button($back, '← Back to Instructor', 'get'), 'mt-3');
-    echo $OUTPUT->footer();
-    exit;
-}
-
-// Parse response
-$data = json_decode($resp);
-if ($data === null || (json_last_error() !== JSON_ERROR_NONE)) 
-{
-    echo $OUTPUT->notification('Unexpected (non-JSON) response from Sentiment API.', 'notifyproblem');
-    echo html_writer::tag('pre', s(substr($resp, 0, 400)));
-    $back = new moodle_url('/mod/spe/instructor.php', ['id' => $cm->id]);
-    echo html_writer::div($OUTPUT->single_button($back, '← Back to Instructor', 'get'), 'mt-3');
-    echo $OUTPUT->footer();
-    exit;
 }
 
 if (is_object($data) && property_exists($data, 'ok') && $data->ok === false) 
 {
     echo $OUTPUT->notification('Sentiment API rejected the batch (likely token mismatch).', 'notifyproblem');
-    $back = new moodle_url('/mod/spe/instructor.php', ['id' => $cm->id]);
     echo html_writer::div($OUTPUT->single_button($back, '← Back to Instructor', 'get'), 'mt-3');
     echo $OUTPUT->footer();
     exit;
@@ -207,7 +375,6 @@ if (is_object($data) && property_exists($data, 'ok') && $data->ok === false)
 if (!isset($data->results) || !is_array($data->results)) 
 {
     echo $OUTPUT->notification('Unexpected response format from Sentiment API.', 'notifyproblem');
-    $back = new moodle_url('/mod/spe/instructor.php', ['id' => $cm->id]);
     echo html_writer::div($OUTPUT->single_button($back, '← Back to Instructor', 'get'), 'mt-3');
     echo $OUTPUT->footer();
     exit;
@@ -245,6 +412,8 @@ foreach ($data->results as $res)
     $label             = isset($res->label) ? (string)$res->label : '-';
     $row->sentiment    = $compound;
     $row->label        = $label;
+    // Span probabilities, so the results can be re-labelled later without the model (/rescore)
+    $row->vectors      = isset($res->vectors) ? json_encode($res->vectors) : null;
     $row->status       = 'done';
     $row->timemodified = time();
     $DB->update_record('spe_sentiment', $row);
@@ -294,6 +463,10 @@ foreach ($data->results as $res)
 
 }
 
+// Gradebook statistics from /aggregate now include the new results
+require_once(__DIR__ . '/aggregate_helpers.php');
+spe_aggregate_invalidate((int)$cm->instance);
+
 if (!$processedids) 
 {
     echo $OUTPUT->notification('No items were processed.', 'notifyinfo');
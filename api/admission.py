@@ -0,0 +1,184 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import math
+import time
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """SPE_ADMIT_WEIGHTS value ("site-a:2,site-b:0.5") -> {client id: weight}."""
+    out: Dict[str, float] = {}
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        client, _, weight = part.rpartition(":")
+        if not client.strip() or float(weight) <= 0:
+            raise ValueError(f"Bad SPE_ADMIT_WEIGHTS entry {part!r}; expected client:weight with weight > 0.")
+        out[client.strip()] = float(weight)
+    return out
+
+def estimate_tokens(items: List[dict]) -> int:
+    """Admission cost of a batch: roughly the model tokens its spans will take (chars / 4, plus specials)."""
+    return sum(len(str(it.get("text") or "")) // 4 + 2 for it in items if isinstance(it, dict))
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted; `retry_after` is in whole seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Token-budget admission with weighted fair queuing between clients.
+
+    At most `capacity` estimated tokens are in flight. A request that does not fit
+    waits in a queue ordered by self-clocked fair queuing tags: a client's tag grows
+    by cost / weight per request, so a client sending 2000-item batches waits
+    behind the small batches of the others instead of starving them.
+
+    The queue is bounded: each backlogged client may hold its weighted share of
+    `max_queue` tokens, and nobody waits longer than `max_wait` seconds. Past
+    either limit acquire() raises Overloaded with an estimated Retry-After.
+    Everything runs on the event loop; there is no locking.
+    """
+
+    def __init__(self, capacity: int, max_queue: int, max_wait: float = 30.0,
+                 weights: Optional[Dict[str, float]] = None):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.weights = dict(weights or {})
+        self.in_flight = 0
+        self._vtime = 0.0
+        self._last_tag: Dict[str, float] = {}
+        self._heap: List[Tuple[float, int, str, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._active: Dict[str, int] = {}
+        self._queued: Dict[str, int] = {}
+        self._queued_requests: Dict[str, int] = {}
+        self._rate = 0.0  # EWMA of tokens completed per second, for Retry-After
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def weight(self, client: str) -> float:
+        return self.weights.get(client, 1.0)
+
+    def _retry_after(self) -> int:
+        backlog = self.in_flight + sum(self._queued.values())
+        if self._rate <= 0:
+            return 1
+        return max(1, min(60, math.ceil(backlog / self._rate)))
+
+    def _reject(self, reason: str) -> Overloaded:
+        return Overloaded(reason, self._retry_after())
+
+    def _fair_share(self, client: str) -> float:
+        backlogged = set(c for c, n in self._queued.items() if n) | {client}
+        return self.max_queue * self.weight(client) / sum(self.weight(c) for c in backlogged)
+
+    async def acquire(self, client: str, cost: int) -> int:
+        """Wait for room for `cost` tokens; returns the cost actually held (pass it to release)."""
+        if not self.enabled:
+            return 0
+        # A single request bigger than the whole budget runs alone rather than never
+        cost = max(1, min(cost, self.capacity))
+        if not self._heap and self.in_flight + cost <= self.capacity:
+            self._admit(client, cost, max(self._vtime, self._last_tag.get(client, 0.0)) + cost / self.weight(client))
+            return cost
+
+        if self._queued.get(client, 0) + cost > self._fair_share(client):
+            raise self._reject("queue_full")
+
+        tag = max(self._vtime, self._last_tag.get(client, 0.0)) + cost / self.weight(client)
+        self._last_tag[client] = tag
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (tag, next(self._seq), client, cost, fut))
+        self._queued[client] = self._queued.get(client, 0) + cost
+        self._queued_requests[client] = self._queued_requests.get(client, 0) + 1
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.max_wait)
+        except asyncio.TimeoutError:
+            if fut.done():
+                # Admitted in the same tick the wait ran out: keep the slot
+                return cost
+            self._withdraw(client, cost, fut)
+            raise self._reject("timeout")
+        except asyncio.CancelledError:
+            # The client went away; give back a slot it may already have been granted
+            if fut.done():
+                self.release(client, cost, 0.0)
+            else:
+                self._withdraw(client, cost, fut)
+            raise
+        return cost
+
+    def _withdraw(self, client: str, cost: int, fut: asyncio.Future) -> None:
+        """Take a waiting request out of the queue (its heap entry is skipped when it surfaces)."""
+        fut.cancel()
+        self._queued[client] -= cost
+        self._queued_requests[client] -= 1
+        self._dispatch()
+
+    def _admit(self, client: str, cost: int, tag: float) -> None:
+        self.in_flight += cost
+        self._vtime = tag
+        self._last_tag[client] = max(self._last_tag.get(client, 0.0), tag)
+        self._active[client] = self._active.get(client, 0) + 1
+
+    def release(self, client: str, cost: int, seconds: float) -> None:
+        """Return `cost` tokens held for `seconds` and admit waiting requests in tag order."""
+        if not self.enabled or not cost:
+            return
+        self.in_flight -= cost
+        self._active[client] = self._active.get(client, 1) - 1
+        if seconds > 0:
+            rate = cost / seconds
+            self._rate = rate if self._rate <= 0 else 0.8 * self._rate + 0.2 * rate
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._heap:
+            tag, _, client, cost, fut = self._heap[0]
+            if not fut.cancelled() and self.in_flight + cost > self.capacity:
+                return
+            heapq.heappop(self._heap)
+            if fut.cancelled():
+                continue
+            self._queued[client] -= cost
+            self._queued_requests[client] -= 1
+            self._admit(client, cost, tag)
+            fut.set_result(True)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """Per-client in-flight requests, queued requests and queued tokens, for the gauges."""
+        clients = set(self._active) | set(self._queued)
+        return {c: {"in_flight": self._active.get(c, 0),
+                    "queued": self._queued_requests.get(c, 0),
+                    "queued_tokens": self._queued.get(c, 0)} for c in clients}
+
+
+class Admitted:
+    """`async with Admitted(ctrl, client, cost):` holds the tokens for the body of the block."""
+
+    def __init__(self, ctrl: AdmissionController, client: str, cost: int):
+        self.ctrl = ctrl
+        self.client = client
+        self.cost = cost
+        self._held = 0
+        self._t0 = 0.0
+
+    async def __aenter__(self) -> "Admitted":
+        self._held = await self.ctrl.acquire(self.client, self.cost)
+        self._t0 = time.perf_counter()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.ctrl.release(self.client, self._held, time.perf_counter() - self._t0)
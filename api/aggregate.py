@@ -0,0 +1,225 @@
+"""
+Rollups of a whole unit's ratings and analysed comments in one pass (POST /aggregate).
+
+The plugin sends every rating row and every analysed comment of an activity,
+
+    {"ratings":  [{"rater": 12, "ratee": 15, "criterion": "teamwork", "score": 4}, ...],
+     "comments": [{"rater": 12, "ratee": 15, "compound": 0.41, "label": "positive",
+                   "disparity": false}, ...],
+     "teams":    {"Team 1": [12, 15, 18], ...}}
+
+and gets back per-pair, per-ratee and per-team statistics. A row whose rater
+is its ratee is a self row; everything else is a peer row. Rows are grouped
+with NumPy (bincount / minimum.at over integer group codes), so the cost is a
+few array passes whatever the number of pairs.
+"""
+from __future__ import annotations
+from typing import Dict, Hashable, List, Optional, Tuple
+import math
+
+import numpy as np
+
+from rescore import LABELS
+
+
+# Input
+def _user(v, what: str) -> Hashable:
+    if isinstance(v, bool) or not isinstance(v, (int, str)):
+        raise ValueError(f"{what} must be a user id (integer or string).")
+    return v
+
+def _number(v, what: str) -> float:
+    if isinstance(v, bool):
+        raise ValueError(f"{what} must be a number.")
+    try:
+        x = float(v)
+    except (TypeError, ValueError):
+        raise ValueError(f"{what} must be a number.")
+    if not math.isfinite(x):
+        raise ValueError(f"{what} must be finite.")
+    return x
+
+def _rows(rows, kind: str, fields) -> List[tuple]:
+    if rows is None:
+        return []
+    if not isinstance(rows, list):
+        raise ValueError(f"{kind}s must be a list.")
+    out = []
+    for i, r in enumerate(rows):
+        if not isinstance(r, dict):
+            raise ValueError(f"{kind.capitalize()} {i}: not an object.")
+        try:
+            out.append(tuple(f(r) for f in fields))
+        except ValueError as e:
+            raise ValueError(f"{kind.capitalize()} {i}: {e}") from e
+    return out
+
+def _team_of(teams) -> Dict[Hashable, Hashable]:
+    if teams is None:
+        return {}
+    if not isinstance(teams, dict):
+        raise ValueError("teams must be an object of team name -> member ids.")
+    team_of: Dict[Hashable, Hashable] = {}
+    for name, members in teams.items():
+        if not isinstance(members, list):
+            raise ValueError(f"Team {name!r}: members must be a list.")
+        for m in members:
+            m = _user(m, f"Team {name!r} member")
+            if m in team_of and team_of[m] != name:
+                raise ValueError(f"User {m!r} is in both team {team_of[m]!r} and team {name!r}.")
+            team_of[m] = name
+    return team_of
+
+
+# Grouping
+class _Codes:
+    """Dense integer codes for hashable keys, in first-seen order."""
+
+    def __init__(self):
+        self.keys: List[Hashable] = []
+        self._index: Dict[Hashable, int] = {}
+
+    def code(self, key: Hashable) -> int:
+        c = self._index.get(key)
+        if c is None:
+            c = self._index[key] = len(self.keys)
+            self.keys.append(key)
+        return c
+
+    def get(self, key: Hashable) -> int:
+        return self._index.get(key, -1)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+def _stats(n: int, r_group: np.ndarray, r_rater: np.ndarray, r_score: np.ndarray,
+           c_group: np.ndarray, c_compound: np.ndarray, c_label: np.ndarray,
+           c_disp: np.ndarray) -> List[dict]:
+    """One statistics block per group 0..n-1; rows with group -1 are left out."""
+    rm = r_group >= 0
+    rg, rr, rs = r_group[rm], r_rater[rm], r_score[rm]
+    cm = c_group >= 0
+    cg, cc, cl, cd = c_group[cm], c_compound[cm], c_label[cm], c_disp[cm]
+
+    n_ratings = np.bincount(rg, minlength=n)
+    score_total = np.bincount(rg, weights=rs, minlength=n)
+    # Distinct raters per group: unique (group, rater) pairs
+    raters = np.bincount(np.unique(np.stack([rg, rr]), axis=1)[0], minlength=n) if rg.size else np.zeros(n, int)
+
+    n_comments = np.bincount(cg, minlength=n)
+    compound_sum = np.bincount(cg, weights=cc, minlength=n)
+    compound_min = np.full(n, np.inf)
+    np.minimum.at(compound_min, cg, cc)
+    known = cl >= 0
+    hist = np.bincount(cg[known] * len(LABELS) + cl[known], minlength=n * len(LABELS)).reshape(n, len(LABELS))
+    disparities = np.bincount(cg, weights=cd, minlength=n)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        score_mean = score_total / n_ratings
+        score_per_rater = score_total / raters
+        compound_mean = compound_sum / n_comments
+
+    def val(a: np.ndarray, i: int) -> Optional[float]:
+        x = float(a[i])
+        return x if math.isfinite(x) else None
+
+    return [{
+        "ratings": int(n_ratings[i]), "raters": int(raters[i]),
+        "score_total": float(score_total[i]), "score_mean": val(score_mean, i),
+        "score_per_rater": val(score_per_rater, i),
+        "comments": int(n_comments[i]),
+        "compound_mean": val(compound_mean, i), "compound_min": val(compound_min, i),
+        "labels": dict(zip(LABELS, hist[i].tolist())),
+        "disparities": int(disparities[i]),
+    } for i in range(n)]
+
+def _gap(self_block: dict, peer_block: dict) -> Dict[str, Optional[float]]:
+    """Self minus peer: score per rater and mean compound (None where either side is missing)."""
+    def diff(a, b):
+        return a - b if a is not None and b is not None else None
+    return {"score": diff(self_block["score_per_rater"], peer_block["score_per_rater"]),
+            "compound": diff(self_block["compound_mean"], peer_block["compound_mean"])}
+
+
+# Aggregation
+def aggregate(ratings, comments, teams=None) -> Dict[str, List[dict]]:
+    """
+    {"pairs", "ratees", "teams"} statistics for the rows given (see the module
+    docstring). Raises ValueError naming the first malformed row.
+    """
+    rows_r = _rows(ratings, "rating", (
+        lambda r: _user(r.get("rater"), "rater"),
+        lambda r: _user(r.get("ratee"), "ratee"),
+        lambda r: _number(r.get("score"), "score"),
+    ))
+    rows_c = _rows(comments, "comment", (
+        lambda r: _user(r.get("rater"), "rater"),
+        lambda r: _user(r.get("ratee"), "ratee"),
+        lambda r: _number(r.get("compound"), "compound"),
+        lambda r: LABELS.index(r["label"]) if r.get("label") in LABELS else -1,
+        lambda r: 1.0 if r.get("disparity") else 0.0,
+    ))
+    team_of = _team_of(teams)
+
+    users, pairs = _Codes(), _Codes()
+
+    def columns(rows: List[tuple]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        rater = np.fromiter((users.code(r[0]) for r in rows), dtype=np.int64, count=len(rows))
+        ratee = np.fromiter((users.code(r[1]) for r in rows), dtype=np.int64, count=len(rows))
+        pair = np.fromiter((pairs.code((r[0], r[1])) for r in rows), dtype=np.int64, count=len(rows))
+        return rater, ratee, pair
+
+    r_rater, r_ratee, r_pair = columns(rows_r)
+    c_rater, c_ratee, c_pair = columns(rows_c)
+    r_score = np.fromiter((r[2] for r in rows_r), dtype=float, count=len(rows_r))
+    c_compound = np.fromiter((r[2] for r in rows_c), dtype=float, count=len(rows_c))
+    c_label = np.fromiter((r[3] for r in rows_c), dtype=np.int64, count=len(rows_c))
+    c_disp = np.fromiter((r[4] for r in rows_c), dtype=float, count=len(rows_c))
+    r_self = r_rater == r_ratee
+    c_self = c_rater == c_ratee
+
+    def blocks(n: int, r_group: np.ndarray, c_group: np.ndarray) -> List[dict]:
+        return _stats(n, r_group, r_rater, r_score, c_group, c_compound, c_label, c_disp)
+
+    # Pairs
+    pair_stats = blocks(len(pairs), r_pair, c_pair)
+    out_pairs = [dict(rater=rater, ratee=ratee, self=rater == ratee, **st)
+                 for (rater, ratee), st in zip(pairs.keys, pair_stats)]
+
+    # Ratees: peer rows and self rows they received
+    ratee_codes = _Codes()
+    for key in [users.keys[c] for c in np.concatenate([r_ratee, c_ratee]).tolist()]:
+        ratee_codes.code(key)
+    remap = np.array([ratee_codes.get(k) for k in users.keys], dtype=np.int64)
+    r_ratee_g, c_ratee_g = remap[r_ratee], remap[c_ratee]
+    nr = len(ratee_codes)
+    peer = blocks(nr, np.where(r_self, -1, r_ratee_g), np.where(c_self, -1, c_ratee_g))
+    self_ = blocks(nr, np.where(r_self, r_ratee_g, -1), np.where(c_self, c_ratee_g, -1))
+    out_ratees = [{"ratee": key, "team": team_of.get(key), "peer": p, "self": s, "gap": _gap(s, p)}
+                  for key, p, s in zip(ratee_codes.keys, peer, self_)]
+
+    # Teams: rows received by their members; the gap is the mean of the members' gaps
+    team_codes = _Codes()
+    for name in (teams or {}):
+        team_codes.code(name)
+    tmap = np.array([team_codes.get(team_of[k]) if k in team_of else -1 for k in users.keys], dtype=np.int64)
+    r_team, c_team = tmap[r_ratee], tmap[c_ratee]
+    nt = len(team_codes)
+    t_peer = blocks(nt, np.where(r_self, -1, r_team), np.where(c_self, -1, c_team))
+    t_self = blocks(nt, np.where(r_self, r_team, -1), np.where(c_self, c_team, -1))
+    rated: Dict[Hashable, List[dict]] = {}
+    for r in out_ratees:
+        if r["team"] is not None:
+            rated.setdefault(r["team"], []).append(r)
+    out_teams = []
+    for i, name in enumerate(team_codes.keys):
+        members = rated.get(name, [])
+        gap = {}
+        for k in ("score", "compound"):
+            vals = [m["gap"][k] for m in members if m["gap"][k] is not None]
+            gap[k] = sum(vals) / len(vals) if vals else None
+        out_teams.append({"team": name, "members": len(set(teams[name])), "rated_members": len(members),
+                          "peer": t_peer[i], "self": t_self[i], "gap": gap})
+
+    return {"pairs": out_pairs, "ratees": out_ratees, "teams": out_teams}
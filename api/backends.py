@@ -0,0 +1,336 @@
+"""
+Inference backends for the sentiment model, selected with SPE_HF_BACKEND.
+
+    transformers  the fp32 transformers pipeline (default)
+    onnx          an ONNX Runtime session over a model exported by `export` below
+    int8          the torch model with dynamically INT8-quantized Linear layers (CPU)
+
+Every backend is called like the transformers pipeline -- backend(texts, batch_size=n)
+-- and returns one list of {"label", "score"} dicts per text, so callers do not
+care which one is loaded. backend.call_ids(batch) does the same for token-id
+sequences the caller already cut from one encoding.
+
+One-shot commands (run from api/):
+
+    python backends.py export --out onnx-model            # export HF_MODEL_NAME to ONNX
+    python backends.py parity --backend onnx --backend int8 [--texts items.jsonl]
+"""
+from __future__ import annotations
+from typing import Dict, List, Optional
+import abc
+import argparse
+import importlib.util
+import json
+import logging
+import math
+import os
+import sys
+import time
+
+BACKENDS = ("transformers", "onnx", "int8")
+
+# from_pretrained options: with accelerate installed, weights go straight into the model (no
+# random init + copy); without it most transformers versions refuse low_cpu_mem_usage, so it is
+# left off. Safetensors checkpoints, which transformers prefers when present, are memory-mapped.
+PRETRAINED_KWARGS = {"low_cpu_mem_usage": True} if importlib.util.find_spec("accelerate") else {}
+
+
+# Outputs
+def norm_label(lbl: str) -> str:
+    """negative / neutral / positive for a model label ("LABEL_2", "Positive", ...)."""
+    l = lbl.lower()
+    if "pos" in l or l.endswith("_2"): return "positive"
+    if "neg" in l or l.endswith("_0"): return "negative"
+    return "neutral"
+
+def probs_from_output(res) -> Dict[str, float]:
+    """Turn one backend or pipeline output (list of label/score dicts) into normalized probabilities."""
+    if isinstance(res, dict):
+        res = [res]
+    probs = {norm_label(r["label"]): float(r["score"]) for r in res}
+    for k in ("negative", "neutral", "positive"):
+        probs.setdefault(k, 0.0)
+
+    s = sum(probs.values())
+    if s > 0:
+        for k in probs:
+            probs[k] /= s
+    return probs
+
+def _softmax_rows(rows) -> List[List[float]]:
+    out = []
+    for row in rows:
+        row = [float(x) for x in row]
+        m = max(row)
+        exps = [math.exp(x - m) for x in row]
+        s = sum(exps)
+        out.append([e / s for e in exps])
+    return out
+
+
+def encode_ids(tokenizer, batch_ids) -> dict:
+    """Pad pre-tokenized id sequences (no special tokens yet) into one numpy batch."""
+    rows = [tokenizer.build_inputs_with_special_tokens(list(ids)) for ids in batch_ids]
+    return tokenizer.pad({"input_ids": rows}, padding=True, return_tensors="np")
+
+
+class _LogitsBackend(abc.ABC):
+    """Tokenize a padded batch, run it, softmax the logits into pipeline-shaped output."""
+
+    name = ""
+
+    def __init__(self, tokenizer, id2label: Dict[int, str], max_len: int):
+        self.tokenizer = tokenizer
+        self.id2label = {int(k): v for k, v in id2label.items()}
+        self.max_len = max_len
+
+    @abc.abstractmethod
+    def logits(self, enc) -> list:
+        """Raw logits, one row per sequence of the tokenized batch `enc`."""
+
+    def _shaped(self, logits) -> list:
+        return [[{"label": self.id2label[j], "score": p} for j, p in enumerate(probs)]
+                for probs in _softmax_rows(logits)]
+
+    def __call__(self, texts, batch_size: Optional[int] = None):
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        out = []
+        step = batch_size or len(batch) or 1
+        for i in range(0, len(batch), step):
+            enc = self.tokenizer(batch[i:i + step], padding=True, truncation=True,
+                                 max_length=self.max_len, return_tensors="np")
+            out.extend(self._shaped(self.logits(enc)))
+        return [out[0]] if single else out
+
+    def call_ids(self, batch_ids) -> list:
+        """Score token-id sequences that were already cut and truncated by the caller."""
+        return self._shaped(self.logits(encode_ids(self.tokenizer, batch_ids)))
+
+
+class PipelineBackend(_LogitsBackend):
+    """The transformers text-classification pipeline, as the API always used it."""
+
+    name = "transformers"
+
+    def __init__(self, model_name: str, device: str, max_len: int):
+        import torch
+        from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
+
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_name, **PRETRAINED_KWARGS)
+        self._torch = torch
+        super().__init__(tokenizer, self.model.config.id2label, max_len)
+        self._pipe = pipeline(
+            "sentiment-analysis",
+            model=self.model,
+            tokenizer=tokenizer,
+            device=0 if device == "cuda" else -1,
+            truncation=True,
+            max_length=max_len,
+            top_k=None,
+            return_all_scores=True,
+        )
+
+    def __call__(self, texts, batch_size: Optional[int] = None):
+        if batch_size:
+            return self._pipe(texts, batch_size=batch_size)
+        return self._pipe(texts)
+
+    def logits(self, enc) -> list:
+        torch = self._torch
+        device = next(self.model.parameters()).device
+        with torch.inference_mode():
+            feed = {k: torch.from_numpy(v).to(device) for k, v in enc.items()}
+            return self.model(**feed).logits.float().cpu().numpy()
+
+
+class OnnxBackend(_LogitsBackend):
+    name = "onnx"
+
+    def __init__(self, onnx_dir: str, max_len: int, threads: int = 0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer, AutoConfig
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            os.path.join(onnx_dir, "model.onnx"), opts, providers=["CPUExecutionProvider"]
+        )
+        self._inputs = {i.name for i in self.session.get_inputs()}
+        config = AutoConfig.from_pretrained(onnx_dir)
+        super().__init__(AutoTokenizer.from_pretrained(onnx_dir), config.id2label, max_len)
+
+    def logits(self, enc) -> list:
+        feed = {k: v.astype("int64") for k, v in enc.items() if k in self._inputs}
+        return self.session.run(None, feed)[0]
+
+
+class Int8Backend(_LogitsBackend):
+    name = "int8"
+
+    def __init__(self, model_name: str, max_len: int):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+        model = AutoModelForSequenceClassification.from_pretrained(model_name, **PRETRAINED_KWARGS)
+        model.eval()
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self._torch = torch
+        super().__init__(AutoTokenizer.from_pretrained(model_name), model.config.id2label, max_len)
+
+    def logits(self, enc) -> list:
+        torch = self._torch
+        with torch.inference_mode():
+            feed = {k: torch.from_numpy(v) for k, v in enc.items()}
+            return self.model(**feed).logits.numpy()
+
+
+def load_backend(name: str, model_name: str, device: str, max_len: int,
+                 onnx_dir: Optional[str] = None):
+    """Build the backend named by SPE_HF_BACKEND."""
+    name = (name or "transformers").lower()
+    if name == "transformers":
+        return PipelineBackend(model_name, device, max_len)
+    if device == "cuda":
+        logging.getLogger("uvicorn").warning("SPE_HF_BACKEND=%s runs on CPU; ignoring SPE_HF_DEVICE=cuda.", name)
+    if name == "onnx":
+        if not onnx_dir or not os.path.exists(os.path.join(onnx_dir, "model.onnx")):
+            raise RuntimeError(f"No ONNX export at {onnx_dir!r}; run `python backends.py export --out {onnx_dir}`.")
+        return OnnxBackend(onnx_dir, max_len, threads=int(os.environ.get("SPE_ORT_THREADS", "0")))
+    if name == "int8":
+        return Int8Backend(model_name, max_len)
+    raise ValueError(f"Unknown SPE_HF_BACKEND {name!r}; expected one of {', '.join(BACKENDS)}.")
+
+
+# Export
+def export_onnx(model_name: str, out_dir: str, opset: int = 17) -> str:
+    """Export the model to out_dir/model.onnx with the tokenizer and config next to it."""
+    import torch
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name, **PRETRAINED_KWARGS)
+    model.eval()
+    model.config.return_dict = False
+
+    sample = tokenizer(["a short sample", "a slightly longer sample sentence"],
+                       padding=True, return_tensors="pt")
+    path = os.path.join(out_dir, "model.onnx")
+    with torch.inference_mode():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"},
+            },
+            opset_version=opset,
+        )
+    tokenizer.save_pretrained(out_dir)
+    model.config.return_dict = True
+    model.config.save_pretrained(out_dir)
+    return path
+
+
+# Parity check
+PARITY_TEXTS = [
+    "Good job, really helpful throughout the project.",
+    "He did most of the work for the team.",
+    "She did not contribute at all and was always unavailable.",
+    "Time management could improve, but the reports were solid.",
+    "Never showed up to meetings; the rest of us covered for him.",
+    "Okay.",
+    "I think our group worked well although communication was slow at times.",
+    "Minor misunderstandings, nothing serious.",
+    "Very very helpful and always on time.",
+    "Dominates discussions and rarely listens to others.",
+]
+
+def _probs(output) -> List[Dict[str, float]]:
+    return [probs_from_output(res) for res in output]
+
+def parity(candidates: List[str], model_name: str, max_len: int, onnx_dir: str,
+           texts: List[str], batch_size: int) -> Dict[str, Dict[str, float]]:
+    """Compare each candidate backend against the fp32 pipeline on the same texts."""
+    baseline = load_backend("transformers", model_name, "cpu", max_len)
+    t0 = time.perf_counter()
+    base = _probs(baseline(texts, batch_size=batch_size))
+    base_s = time.perf_counter() - t0
+
+    report: Dict[str, Dict[str, float]] = {"transformers": {"seconds": base_s, "items_per_s": len(texts) / base_s}}
+    for name in candidates:
+        backend = load_backend(name, model_name, "cpu", max_len, onnx_dir=onnx_dir)
+        t0 = time.perf_counter()
+        got = _probs(backend(texts, batch_size=batch_size))
+        secs = time.perf_counter() - t0
+
+        max_prob = max_comp = sum_comp = 0.0
+        agree = 0
+        for a, b in zip(base, got):
+            max_prob = max(max_prob, max(abs(a[k] - b.get(k, 0.0)) for k in a))
+            dc = abs((a["positive"] - a["negative"]) - (b["positive"] - b["negative"]))
+            max_comp = max(max_comp, dc)
+            sum_comp += dc
+            agree += max(a, key=a.get) == max(b, key=b.get)
+        report[name] = {
+            "seconds": secs,
+            "items_per_s": len(texts) / secs,
+            "speedup": base_s / secs,
+            "label_agreement": agree / len(texts),
+            "max_abs_prob_diff": max_prob,
+            "max_abs_compound_diff": max_comp,
+            "mean_abs_compound_diff": sum_comp / len(texts),
+        }
+    return report
+
+
+def _load_texts(path: Optional[str]) -> List[str]:
+    if not path:
+        return PARITY_TEXTS
+    texts = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if line:
+                obj = json.loads(line)
+                texts.append(obj.get("text", "") if isinstance(obj, dict) else str(obj))
+    return texts
+
+def main(argv=None) -> int:
+    model_name = os.environ.get("SPE_HF_MODEL", "cardiffnlp/twitter-roberta-base-sentiment-latest")
+    max_len = int(os.environ.get("SPE_HF_MAXLEN", "256"))
+    onnx_dir = os.environ.get(
+        "SPE_HF_ONNX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx-model")
+    )
+
+    ap = argparse.ArgumentParser(description="SPE inference backends")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export", help="export HF_MODEL_NAME to ONNX")
+    ex.add_argument("--out", default=onnx_dir)
+    ex.add_argument("--opset", type=int, default=17)
+    pa = sub.add_parser("parity", help="compare backends against the fp32 pipeline")
+    pa.add_argument("--backend", action="append", choices=BACKENDS[1:], default=None)
+    pa.add_argument("--texts", help="JSONL file with a 'text' field per line")
+    pa.add_argument("--onnx-dir", default=onnx_dir)
+    pa.add_argument("--batch-size", type=int, default=32)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "export":
+        print("wrote", export_onnx(model_name, args.out, args.opset))
+        return 0
+
+    report = parity(args.backend or ["onnx", "int8"], model_name, max_len, args.onnx_dir,
+                    _load_texts(args.texts), args.batch_size)
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
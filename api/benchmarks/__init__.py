@@ -0,0 +1 @@
+"""Benchmarks for the sentiment API; run them from the api/ directory with python -m."""
@@ -0,0 +1,153 @@
+"""
+End-to-end benchmark of the analyze path with a fake model of fixed latency.
+
+    cd api && python -m benchmarks.analyze [--sizes 1,10,100,500,2000] [--latency-ms 2]
+    cd api && python -m benchmarks.analyze --write-baseline     # record benchmarks/baseline.json
+    cd api && python -m benchmarks.analyze --baseline benchmarks/baseline.json --threshold 0.25
+
+Batch size 1 goes through analyze_text_full, larger sizes through analyze_batch.
+The span cache is memory-only and cleared before every run, so each run pays for
+every span. Reports items/s, p50/p99 latency per call and peak RSS; with a
+baseline, exits 1 if items/s or p50 regress by more than the threshold.
+"""
+from __future__ import annotations
+from typing import Dict, List, Optional
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+# Memory-only span cache and no model load: set before sentiment_api is imported
+os.environ.setdefault("SPE_CACHE_PATH", "")
+os.environ.setdefault("SPE_HF_WARMUP", "false")
+
+from benchmarks.corpus import make_corpus
+from benchmarks.fake_model import FakeModel, installed
+
+DEFAULT_SIZES = (1, 10, 100, 500, 2000)
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+        kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(kb / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+    except ImportError:
+        return None
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def run_scenario(api, size: int, reps: int, seed: int) -> Dict[str, float]:
+    items = make_corpus(size, seed=seed + size)
+    if size == 1:
+        it = items[0]
+        call = lambda: api.analyze_text_full(it["text"], it["score_total"], None, None, it["target"])
+    else:
+        call = lambda: api.analyze_batch(items)
+
+    call()  # compile regexes, fill lazy module state
+    times = []
+    for _ in range(reps):
+        api._span_cache.invalidate()
+        t0 = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - t0)
+    total = sum(times)
+    return {
+        "items": size,
+        "reps": reps,
+        "items_per_s": round(size * reps / total, 1),
+        "p50_ms": round(statistics.median(times) * 1000, 3),
+        "p99_ms": round(_percentile(times, 0.99) * 1000, 3),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, object], threshold: float) -> List[str]:
+    """Regressions beyond `threshold` (a fraction) against the baseline scenarios."""
+    failures = []
+    for size, base in baseline.get("scenarios", {}).items():
+        got = results.get(size)
+        if got is None:
+            continue
+        if got["items_per_s"] < base["items_per_s"] * (1 - threshold):
+            failures.append(f"batch {size}: {got['items_per_s']} items/s < baseline {base['items_per_s']}")
+        if got["p50_ms"] > base["p50_ms"] * (1 + threshold):
+            failures.append(f"batch {size}: p50 {got['p50_ms']} ms > baseline {base['p50_ms']} ms")
+    return failures
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    ap.add_argument("--items-per-size", type=int, default=4000,
+                    help="items scored per scenario; reps = this / batch size (3..200)")
+    ap.add_argument("--latency-ms", type=float, default=2.0, help="fake model latency per forward call")
+    ap.add_argument("--span-latency-ms", type=float, default=0.1, help="fake model latency per span")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--baseline", help="baseline JSON to compare against")
+    ap.add_argument("--threshold", type=float, default=None, help="allowed regression (default: baseline's, else 0.25)")
+    ap.add_argument("--write-baseline", nargs="?", const=DEFAULT_BASELINE, metavar="PATH")
+    ap.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = ap.parse_args(argv)
+
+    import sentiment_api as api
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    model = FakeModel(args.latency_ms / 1000.0, args.span_latency_ms / 1000.0)
+    results: Dict[str, Dict[str, float]] = {}
+    with installed(api, model):
+        for size in sizes:
+            reps = max(3, min(200, args.items_per_size // size))
+            results[str(size)] = run_scenario(api, size, reps, args.seed)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"fake model: {args.latency_ms} ms/call + {args.span_latency_ms} ms/span")
+        print(f"{'batch':>6} {'reps':>5} {'items/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'peak RSS MB':>12}")
+        for size, r in results.items():
+            print(f"{size:>6} {r['reps']:>5} {r['items_per_s']:>10} {r['p50_ms']:>10} "
+                  f"{r['p99_ms']:>10} {str(r['peak_rss_mb']):>12}")
+
+    if args.write_baseline:
+        with open(args.write_baseline, "w", encoding="utf-8") as fh:
+            json.dump({
+                "threshold": args.threshold if args.threshold is not None else 0.25,
+                "fake_model": {"latency_ms": args.latency_ms, "span_latency_ms": args.span_latency_ms},
+                "machine": platform.platform(),
+                "python": platform.python_version(),
+                "scenarios": results,
+            }, fh, indent=2)
+            fh.write("\n")
+        print("wrote", args.write_baseline)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        threshold = args.threshold if args.threshold is not None else float(baseline.get("threshold", 0.25))
+        fake = baseline.get("fake_model", {})
+        if fake and (fake.get("latency_ms"), fake.get("span_latency_ms")) != (args.latency_ms, args.span_latency_ms):
+            print("warning: baseline was recorded with a different fake model latency")
+        failures = compare(results, baseline, threshold)
+        for f in failures:
+            print("REGRESSION", f)
+        if failures:
+            return 1
+        print(f"no regression beyond {threshold:.0%} of baseline")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
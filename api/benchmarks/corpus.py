@@ -0,0 +1,99 @@
+"""
+Synthetic SPE corpus: peer comments and self reflections shaped like the real ones.
+
+Texts mix plain praise/criticism with the cues the pipeline treats specially:
+contrast words (but, however, ...), negations, percentage claims, intensifier
+runs and the occasional toxic word. Everything is driven by one seeded RNG, so
+a given (n, seed) always yields the same items.
+"""
+from __future__ import annotations
+from typing import Dict, List
+import random
+
+OPENERS = [
+    "{name} was", "{name} has been", "Working with {name} was", "Overall {name} was",
+    "I think {name} was", "In my opinion {name} was",
+]
+POSITIVE = [
+    "really helpful", "very reliable", "a great team member", "always on time",
+    "easy to work with", "well organised", "good at coding", "supportive during meetings",
+]
+NEGATIVE = [
+    "always late", "non-responsive most weeks", "hard to contact", "a no-show at two meetings",
+    "always unavailable", "slow to reply", "disorganised", "careless with the report",
+]
+PHRASES = [
+    "good job", "needs improvement", "room for improvement", "did most of the work",
+    "did not do much at all", "did not contribute at all", "time management could improve",
+    "contributed in planning meetings", "minor misunderstandings", "strong opinions",
+    "dominates discussions", "rush through tasks", "delays in completing",
+    "can create challenges", "affects overall progress",
+]
+PERCENT = [
+    "only {p}% done", "did only about {p}% of the work", "did {p}% of the tasks",
+    "only {p} % completed",
+]
+CONTRAST = ["but", "however", "although", "though", "yet", "while", "despite"]
+NEGATED = ["not helpful", "never on time", "no effort at all", "rarely joined meetings", "hardly contributed"]
+INTENSIFIERS = ["very", "really", "super", "extremely"]
+TOXIC = ["useless", "lazy and useless", "a total idiot", "garbage work"]
+REFLECTION = [
+    "This semester our group worked on the project and I learned a lot about planning.",
+    "We met every week and shared the tasks between us.",
+    "I was responsible for the database design and the testing plan.",
+    "Communication was slow at the start of the project.",
+    "Our final presentation went well and the client was happy.",
+    "I could have managed my time better near the deadline.",
+]
+NAMES = ["Alex", "Sam", "Jordan", "Taylor", "Priya", "Wei", "Maria", "Tom", "Aisha", "Lee"]
+
+
+def _clause(rng: random.Random) -> str:
+    r = rng.random()
+    if r < 0.30:
+        return rng.choice(POSITIVE)
+    if r < 0.55:
+        return rng.choice(NEGATIVE)
+    if r < 0.75:
+        return rng.choice(PHRASES)
+    if r < 0.85:
+        return rng.choice(PERCENT).format(p=rng.choice([10, 20, 25, 30, 40, 50, 60, 80]))
+    if r < 0.97:
+        return rng.choice(NEGATED)
+    return rng.choice(TOXIC)
+
+def peer_comment(rng: random.Random) -> str:
+    name = rng.choice(NAMES)
+    parts = [rng.choice(OPENERS).format(name=name)]
+    if rng.random() < 0.25:
+        parts.extend([rng.choice(INTENSIFIERS)] * rng.randint(1, 4))
+    parts.append(_clause(rng))
+    if rng.random() < 0.45:
+        parts.append(rng.choice(CONTRAST))
+        parts.append(_clause(rng))
+    text = " ".join(parts) + rng.choice([".", ".", "!", ""])
+    if rng.random() < 0.3:
+        text += " " + rng.choice(["Good job overall.", "Needs improvement.", "Okay.", "Thanks!"])
+    return text
+
+def reflection(rng: random.Random) -> str:
+    sentences = [rng.choice(REFLECTION) for _ in range(rng.randint(3, 10))]
+    for _ in range(rng.randint(1, 3)):
+        i = rng.randrange(len(sentences) + 1)
+        sentences.insert(i, "I " + _clause(rng) + (" " + rng.choice(CONTRAST) + " " + _clause(rng)
+                                                   if rng.random() < 0.4 else "") + ".")
+    return " ".join(sentences)
+
+def make_corpus(n: int, seed: int = 1, reflection_share: float = 0.2) -> List[Dict[str, object]]:
+    """n analyze items ({"id", "text", "score_total", "target"}), about a fifth of them reflections."""
+    rng = random.Random(seed)
+    items = []
+    for i in range(n):
+        is_refl = rng.random() < reflection_share
+        items.append({
+            "id": str(i),
+            "text": reflection(rng) if is_refl else peer_comment(rng),
+            "score_total": rng.randint(5, 25),
+            "target": "self" if is_refl else "peer",
+        })
+    return items
@@ -0,0 +1,50 @@
+"""
+Stand-in for the model: same call convention and output shape as the
+transformers pipeline, deterministic scores, and a fixed latency per forward
+call plus per span, so benchmarks measure the API code around the model.
+"""
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+import hashlib
+import time
+
+
+class FakeModel:
+    def __init__(self, batch_latency: float = 0.002, span_latency: float = 0.0001):
+        self.batch_latency = batch_latency
+        self.span_latency = span_latency
+        self.tokenizer = None
+        self.calls = 0
+        self.spans = 0
+
+    @staticmethod
+    def scores(text: str) -> List[Dict[str, float]]:
+        h = hashlib.sha256(text.encode()).digest()
+        a, b, c = h[0] + 1, h[1] + 1, h[2] + 1
+        s = a + b + c
+        return [
+            {"label": "negative", "score": a / s},
+            {"label": "neutral", "score": b / s},
+            {"label": "positive", "score": c / s},
+        ]
+
+    def __call__(self, texts, batch_size=None):
+        batch = [texts] if isinstance(texts, str) else list(texts)
+        self.calls += 1
+        self.spans += len(batch)
+        delay = self.batch_latency + self.span_latency * len(batch)
+        if delay > 0:
+            time.sleep(delay)
+        return [self.scores(t) for t in batch]
+
+
+@contextmanager
+def installed(api, model: FakeModel) -> Iterator[FakeModel]:
+    """Put `model` in place of api._roberta (and its tokenizer) for the duration."""
+    saved = api._roberta, api._tokenizer
+    api._roberta, api._tokenizer = model, model.tokenizer
+    try:
+        yield model
+    finally:
+        api._roberta, api._tokenizer = saved
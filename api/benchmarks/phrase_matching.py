@@ -0,0 +1,83 @@
+"""
+Microbenchmark: sequential PHRASE_PATTERNS re.sub loop vs the compiled PhraseMatcher.
+
+    cd api && python -m benchmarks.phrase_matching [--items 200] [--words 400] [--repeat 5]
+
+Both paths run over the same synthetic long reflections; outputs are checked
+for parity before any timing is reported.
+"""
+from __future__ import annotations
+import argparse
+import random
+import time
+
+from phrases import (
+    preprocess_phrases, preprocess_phrases_sequential, matched_tokens_sequential,
+)
+
+FILLER = (
+    "this semester our team worked on the project and i learned a lot about planning "
+    "communication testing and deadlines we met every week and shared the tasks"
+).split()
+
+PHRASES = [
+    "good job", "needs improvement", "room for improvement", "did most of the work",
+    "did not do much at all", "only 30% done", "did only about 20% of the work",
+    "always late", "non-responsive", "no-show", "minor misunderstandings",
+    "time management could improve", "contributed in planning meetings",
+    "strong opinions", "dominates discussions", "always unavailable",
+]
+
+def make_reflection(rng: random.Random, words: int) -> str:
+    out = []
+    while len(out) < words:
+        if rng.random() < 0.08:
+            out.extend(rng.choice(PHRASES).split())
+        else:
+            out.append(rng.choice(FILLER))
+        if rng.random() < 0.06:
+            out[-1] += "."
+    return " ".join(out).capitalize()
+
+def _time(fn, texts, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for t in texts:
+            fn(t)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def _sequential(text: str):
+    out, dyn = preprocess_phrases_sequential(text)
+    return out, matched_tokens_sequential(out, dyn)
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--items", type=int, default=200)
+    ap.add_argument("--words", type=int, default=400)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    texts = [make_reflection(rng, args.words) for _ in range(args.items)]
+
+    for t in texts:
+        a, ma = _sequential(t)
+        b, mb = preprocess_phrases(t)
+        if a != b or set(ma) != set(mb):
+            print("MISMATCH on:", t[:120])
+            return 1
+
+    seq = _time(_sequential, texts, args.repeat)
+    comp = _time(preprocess_phrases, texts, args.repeat)
+    n = len(texts)
+    print(f"{n} reflections x {args.words} words (best of {args.repeat})")
+    print(f"  sequential re.sub loop : {seq / n * 1e6:9.1f} us/item")
+    print(f"  compiled PhraseMatcher : {comp / n * 1e6:9.1f} us/item")
+    print(f"  speedup                : {seq / comp:9.2f}x")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,217 @@
+"""
+Offline bulk scoring of a JSONL file, without HTTP, signing or the 2000-item cap.
+
+    cd api && python -m sentiment_api batch in.jsonl out.jsonl [--workers 4] [--chunk 256]
+
+Each input line is one /analyze item ({"id", "text", "score_total", "score_min",
+"score_max", "target"}); each output line is its result, in input order, scored
+by the same plan_item/finish_item code as analyze_text_full. Blank lines are
+skipped; a line that is not a JSON object gives {"line": n, "error": ...}.
+
+Progress is checkpointed to <out>.ckpt after every chunk written (input byte
+offset, output byte length). Re-running the same command resumes from there,
+dropping any output written after the last checkpoint; --restart starts over.
+"""
+from __future__ import annotations
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from prefork import default_threads
+
+CHECKPOINT_SUFFIX = ".ckpt"
+
+# The sentiment_api module doing the scoring. `python -m sentiment_api batch` runs it as
+# __main__ and passes that module to main(), so it is not imported (models, caches) twice
+api = None
+
+def _bind(module=None) -> None:
+    global api
+    if module is not None:
+        api = module
+    elif api is None:
+        import sentiment_api
+        api = sentiment_api
+
+def _ensure_model() -> None:
+    """Load the model unless it is loaded already or this process is a gateway (which needs none)."""
+    if not api._serving():
+        api._load_model(warmup=False)
+
+
+# Worker side
+def _init_worker(threads: int) -> None:
+    """Cap intra-op threads, reopen the span cache and load the model unless it was inherited."""
+    # Spawned workers start without the parent's module and import their own copy
+    _bind()
+    # Ctrl-C is handled by the parent, which stops the pool and keeps the last checkpoint
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    api._span_cache.reopen()
+    _ensure_model()
+
+def score_lines(first: int, lines: List[bytes]) -> List[str]:
+    """Score one chunk of input lines (line numbers start at `first`); one output line per item."""
+    if not api._serving():
+        raise RuntimeError("RoBERTa model is not loaded.")
+    out: List[Optional[str]] = []
+    items, slots = [], []
+    for n, raw in enumerate(lines, first):
+        if not raw.strip():
+            continue
+        try:
+            item = json.loads(raw)
+            if not isinstance(item, dict):
+                raise ValueError("item is not a JSON object")
+        except ValueError as e:
+            out.append(json.dumps({"line": n, "error": str(e)}, ensure_ascii=False))
+            continue
+        slots.append(len(out))
+        out.append(None)
+        items.append(item)
+    for i, r in zip(slots, api.analyze_batch(items) if items else []):
+        out[i] = json.dumps(r, separators=(',', ':'), ensure_ascii=False)
+    return out
+
+
+# Checkpoints
+def load_checkpoint(path: str, in_path: str) -> Dict[str, int]:
+    with open(path, encoding="utf-8") as fh:
+        ckpt = json.load(fh)
+    if ckpt.get("input") != os.path.abspath(in_path):
+        raise SystemExit(f"{path} belongs to {ckpt.get('input')}; use --restart to start over.")
+    if ckpt["offset"] > os.path.getsize(in_path):
+        raise SystemExit(f"{in_path} is shorter than the checkpoint offset; use --restart to start over.")
+    return ckpt
+
+def save_checkpoint(path: str, ckpt: Dict[str, object]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(ckpt, fh)
+    os.replace(tmp, path)
+
+
+# Input
+def read_chunks(fh, chunk: int, line_no: int) -> Iterator[Tuple[int, List[bytes], int]]:
+    """(first line number, lines, input offset after them) per chunk of input lines."""
+    while True:
+        lines = []
+        for _ in range(chunk):
+            raw = fh.readline()
+            if not raw:
+                break
+            lines.append(raw)
+        if not lines:
+            return
+        yield line_no, lines, fh.tell()
+        line_no += len(lines)
+
+
+# Driver
+class _Ready:
+    """Stand-in for an AsyncResult when scoring in-process."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+def run(in_path: str, out_path: str, workers: int = 1, chunk: int = 256,
+        restart: bool = False, threads: int = 0) -> Dict[str, object]:
+    log = logging.getLogger("uvicorn")
+    _bind()
+    ckpt_path = out_path + CHECKPOINT_SUFFIX
+    ckpt = {"input": os.path.abspath(in_path), "offset": 0, "out_bytes": 0, "lines": 0, "results": 0}
+    if not restart and os.path.exists(ckpt_path):
+        ckpt.update(load_checkpoint(ckpt_path, in_path))
+        if not os.path.exists(out_path) or os.path.getsize(out_path) < ckpt["out_bytes"]:
+            raise SystemExit(f"{out_path} is shorter than its checkpoint; use --restart to start over.")
+        log.info("Resuming %s at line %d.", in_path, ckpt["lines"] + 1)
+
+    threads = threads or default_threads(workers)
+    pool = None
+    if workers > 1:
+        # With fork the weights are loaded once here and shared; with spawn each worker loads its own
+        ctx = multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn")
+        if ctx.get_start_method() == "fork":
+            api.prefork_prepare()
+        pool = ctx.Pool(workers, initializer=_init_worker, initargs=(threads,))
+    else:
+        _ensure_model()
+        if not api._serving():
+            raise SystemExit(f"RoBERTa model failed to load ({api._model_state['error']}).")
+
+    t0 = time.perf_counter()
+    done = 0
+    with open(in_path, "rb") as fin, open(out_path, "ab" if ckpt["out_bytes"] else "wb") as fout:
+        # Drop anything written after the last checkpoint
+        fout.truncate(ckpt["out_bytes"])
+        fin.seek(ckpt["offset"])
+        chunks = read_chunks(fin, chunk, ckpt["lines"] + 1)
+        pending: deque = deque()
+        try:
+            while True:
+                # Keep a bounded window of chunks in flight; results are taken in input order
+                while len(pending) < max(2, 2 * workers):
+                    nxt = next(chunks, None)
+                    if nxt is None:
+                        break
+                    first, lines, end = nxt
+                    res = (pool.apply_async(score_lines, (first, lines)) if pool
+                           else _Ready(score_lines(first, lines)))
+                    pending.append((res, len(lines), end))
+                if not pending:
+                    break
+                res, n_lines, end = pending.popleft()
+                out = res.get()
+                if out:
+                    fout.write(("\n".join(out) + "\n").encode("utf-8"))
+                fout.flush()
+                os.fsync(fout.fileno())
+                done += len(out)
+                ckpt.update(offset=end, out_bytes=fout.tell(), lines=ckpt["lines"] + n_lines,
+                            results=ckpt["results"] + len(out))
+                save_checkpoint(ckpt_path, ckpt)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    os.remove(ckpt_path)
+    elapsed = time.perf_counter() - t0
+    return {"lines": ckpt["lines"], "results": ckpt["results"], "this_run": done,
+            "seconds": round(elapsed, 1), "items_per_s": round(done / elapsed, 1) if elapsed else 0.0}
+
+
+# CLI (python -m sentiment_api batch ...)
+def add_parser(sub) -> None:
+    p = sub.add_parser("batch", help="score a JSONL file offline", description=__doc__.strip().splitlines()[0])
+    p.add_argument("input", help="JSONL file, one /analyze item per line")
+    p.add_argument("output", help="JSONL results, one per item, in input order")
+    p.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                   help="scoring processes (default: half the cores)")
+    p.add_argument("--threads", type=int, default=0, help="torch threads per worker (default: cores / workers)")
+    p.add_argument("--chunk", type=int, default=256, help="input lines per task and per checkpoint")
+    p.add_argument("--restart", action="store_true", help="ignore an existing checkpoint and start over")
+
+def main(args, module=None) -> int:
+    """`module` is the already imported sentiment_api (its __main__ when run as a script)."""
+    _bind(module)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.input == args.output:
+        raise SystemExit("Input and output must be different files.")
+    stats = run(args.input, args.output, workers=max(1, args.workers), chunk=max(1, args.chunk),
+                restart=args.restart, threads=args.threads)
+    print(json.dumps(stats), file=sys.stderr)
+    return 0
@@ -1,6 +1,6 @@
-
-import base64, json, time
-from typing import Dict, Any, Mapping
+import base64, hashlib, json, threading, time
+from collections import OrderedDict
+from typing import Dict, Any, Mapping, Optional, Tuple, Union
 from cryptography.hazmat.primitives.asymmetric.ed25519 import (
     Ed25519PrivateKey, Ed25519PublicKey
 )
@@ -11,6 +11,8 @@ CA_PUB_B64       = "iuEnM_VNd8OJn9Mxcz4aEp97gIJMAG41nk2CWxj0XhU"
 SERVER_PRIV_B64  = "2SWSDhQL-Pw1ayFGcnwJbaOE52-HYQlEIC9dvRL_IUU"
 SERVER_CERT_JSON = '{"id":"spe-api","pubkey":"avOww2r53iLjDacbHGoybcqO10eHw4MUOOaTapiCePA","exp":1793700137,"iss":"SPE-CA"}'
 SERVER_CERT_SIG  = "0f75Xhupt6gQYc_mULQHK8JdoUYLxm6wt_u01NYMg726E8-eB4kU2SSGejnwFcDmi8DCMKIgCxJTAlhfGHkACQ"
+# Certificate id of an SPE API server (what spe_ca_verify_server_cert checks in PHP)
+SERVER_CERT_ID   = "spe-api"
 
 def b64u_decode(s: str) -> bytes:
     s = s + "=" * (-len(s) % 4)
@@ -19,6 +21,27 @@ def b64u_decode(s: str) -> bytes:
 def b64u_encode(b: bytes) -> str:
     return base64.urlsafe_b64encode(b).rstrip(b"=").decode()
 
+# Signature modes, negotiated with the X-SPE-Sig-Mode header:
+#   raw     sign f"{path}\n{body}" (default; what every existing client sends)
+#   sha512  sign path + "\n" + SHA-512(body bytes), so cost stays flat as bodies grow
+SIG_MODE_HEADER = "X-SPE-Sig-Mode"
+SIG_MODE_RAW = "raw"
+SIG_MODE_SHA512 = "sha512"
+SIG_MODES = (SIG_MODE_RAW, SIG_MODE_SHA512)
+
+CERT_CACHE_SIZE = 256
+
+def _as_bytes(body: Union[str, bytes]) -> bytes:
+    return body.encode() if isinstance(body, str) else body
+
+def signed_message(path: str, body: Union[str, bytes], mode: str = SIG_MODE_RAW) -> bytes:
+    """Canonical signed message for a path and body (bytes are used as-is, never re-encoded)."""
+    if mode == SIG_MODE_SHA512:
+        return path.encode() + b"\n" + hashlib.sha512(_as_bytes(body)).digest()
+    if mode != SIG_MODE_RAW:
+        raise ValueError(f"Unsupported signature mode {mode!r}.")
+    return path.encode() + b"\n" + _as_bytes(body)
+
 def verify_signature(pubkey_b64: str, msg: bytes, sig_b64: str) -> bool:
     try:
         Ed25519PublicKey.from_public_bytes(b64u_decode(pubkey_b64)).verify(
@@ -31,56 +54,172 @@ def verify_signature(pubkey_b64: str, msg: bytes, sig_b64: str) -> bool:
 def _lower_headers(h: Mapping[str, str]) -> Dict[str, str]:
     return {str(k).lower(): v for k, v in h.items()}
 
+
+class CryptoContext:
+    """
+    Key objects built once, plus a bounded cache of verified client certificates.
+
+    A cached certificate skips the CA signature check and JSON parse on later
+    requests, but its `exp` is still checked every time it is used.
+    """
+
+    def __init__(self, ca_pub_b64: str = CA_PUB_B64, server_priv_b64: str = SERVER_PRIV_B64,
+                 cert_cache_size: int = CERT_CACHE_SIZE):
+        self.ca_pub = Ed25519PublicKey.from_public_bytes(b64u_decode(ca_pub_b64))
+        self.server_sk = Ed25519PrivateKey.from_private_bytes(b64u_decode(server_priv_b64))
+        self.cert_cache_size = cert_cache_size
+        self._certs: "OrderedDict[Tuple[str, str], Tuple[Dict[str, Any], Ed25519PublicKey]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def verify_client_cert(self, cert_json: str, cert_sig: str) -> Tuple[Dict[str, Any], Ed25519PublicKey]:
+        key = (cert_json, cert_sig)
+        with self._lock:
+            hit = self._certs.get(key)
+            if hit is not None:
+                self._certs.move_to_end(key)
+        if hit is None:
+            try:
+                self.ca_pub.verify(b64u_decode(cert_sig), cert_json.encode())
+            except InvalidSignature as e:
+                raise ValueError("Invalid client certificate signature.") from e
+            cert = json.loads(cert_json)
+            if cert.get("iss") != "SPE-CA":
+                raise ValueError("Unexpected client certificate issuer.")
+            if not cert.get("pubkey"):
+                raise ValueError("Client certificate missing pubkey.")
+            hit = (cert, Ed25519PublicKey.from_public_bytes(b64u_decode(cert["pubkey"])))
+            with self._lock:
+                self._certs[key] = hit
+                while len(self._certs) > self.cert_cache_size:
+                    self._certs.popitem(last=False)
+
+        if hit[0].get("exp", 0) < int(time.time()):
+            with self._lock:
+                self._certs.pop(key, None)
+            raise ValueError("Client certificate expired.")
+        return hit
+
+    def verify_server_cert(self, cert_json: str, cert_sig: str) -> Tuple[Dict[str, Any], Ed25519PublicKey]:
+        """verify_client_cert, plus the id only the API's own certificate carries."""
+        cert, pub = self.verify_client_cert(cert_json, cert_sig)
+        if cert.get("id") != SERVER_CERT_ID:
+            raise ValueError("Unexpected server certificate id.")
+        return cert, pub
+
+    def verify_request(self, path: str, body: Union[str, bytes], cert_json: str, cert_sig: str,
+                       req_sig: str, mode: str = SIG_MODE_RAW) -> Dict[str, Any]:
+        cert, pub = self.verify_client_cert(cert_json, cert_sig)
+        try:
+            pub.verify(b64u_decode(req_sig), signed_message(path, body, mode))
+        except InvalidSignature as e:
+            raise ValueError("Invalid client request signature.") from e
+        return cert
+
+    def sign(self, msg: bytes) -> str:
+        return b64u_encode(self.server_sk.sign(msg))
+
+_ctx = CryptoContext()
+
 # Verify client certificate signed by CA
 def verify_client_cert(cert_json: str, cert_sig: str) -> Dict[str, Any]:
     """Verify the client (Moodle plugin) certificate using CA public key."""
-    ca_pub = Ed25519PublicKey.from_public_bytes(b64u_decode(CA_PUB_B64))
-    try:
-        ca_pub.verify(b64u_decode(cert_sig), cert_json.encode())
-    except InvalidSignature as e:
-        raise ValueError("Invalid client certificate signature.") from e
-    cert = json.loads(cert_json)
-    now = int(time.time())
-    if cert.get("exp", 0) < now:
-        raise ValueError("Client certificate expired.")
-    if cert.get("iss") != "SPE-CA":
-        raise ValueError("Unexpected client certificate issuer.")
-    if not cert.get("pubkey"):
-        raise ValueError("Client certificate missing pubkey.")
-    return cert
+    return _ctx.verify_client_cert(cert_json, cert_sig)[0]
 
 # Sign server response
-def sign_response(path: str, body: str) -> Dict[str, str]:
+def sign_response(path: str, body: Union[str, bytes], mode: str = SIG_MODE_RAW) -> Dict[str, str]:
     """
-    Sign server response over the canonical message: f"{path}\\n{body}".
+    Sign server response over the canonical message: f"{path}\\n{body}" (see signed_message).
     'path' must be exactly what the client uses when verifying (no trailing slash differences).
     """
-    sk = Ed25519PrivateKey.from_private_bytes(b64u_decode(SERVER_PRIV_B64))
-    msg = f"{path}\n{body}".encode()
-    sig = sk.sign(msg)
+    headers = {
+        "X-SPE-Server-Cert": SERVER_CERT_JSON,
+        "X-SPE-Server-Sig": _ctx.sign(signed_message(path, body, mode)),
+        "X-SPE-Server-CertSig": SERVER_CERT_SIG,
+    }
+    if mode != SIG_MODE_RAW:
+        headers[SIG_MODE_HEADER] = mode
+    return headers
+
+def server_cert_headers() -> Dict[str, str]:
+    """Server certificate headers without a body signature (used by streamed responses)."""
     return {
         "X-SPE-Server-Cert": SERVER_CERT_JSON,
-        "X-SPE-Server-Sig": b64u_encode(sig),
         "X-SPE-Server-CertSig": SERVER_CERT_SIG,
     }
 
+# Sign one chunk of a streamed response
+def sign_stream_chunk(path: str, prev_sig: str, chunk: str) -> str:
+    """
+    Sign one NDJSON chunk over f"{path}\\n{prev_sig}\\n{chunk}".
+    prev_sig is the previous chunk's signature (the client's request signature
+    for the first chunk), so chunks cannot be dropped, reordered or spliced
+    into another response without breaking the chain.
+    """
+    return _ctx.sign(f"{path}\n{prev_sig}\n{chunk}".encode())
+
 # Verify client request
-def verify_client_request(path: str, body: str, headers: Mapping[str, str]) -> None:
+def verify_client_request(path: str, body: Union[str, bytes], headers: Mapping[str, str]) -> str:
     """
     Verify client request signature and cert chain.
     Accepts any mapping; header names are normalized to lowercase.
+    Returns the signature mode the request used, for signing the response the same way.
     """
     h = _lower_headers(headers)
     cert_json = h.get("x-spe-client-cert")
     cert_sig  = h.get("x-spe-client-certsig")
     req_sig   = h.get("x-spe-client-sig")
+    mode      = (h.get("x-spe-sig-mode") or SIG_MODE_RAW).strip().lower()
 
     if not cert_json or not cert_sig or not req_sig:
         raise ValueError("Missing client certificate or signature headers.")
+    if mode not in SIG_MODES:
+        raise ValueError(f"Unsupported signature mode {mode!r}.")
+
+    _ctx.verify_request(path, body, cert_json, cert_sig, req_sig, mode)
+    return mode
+
+# Verify a server response (what the PHP client does; used by the gateway towards its backends)
+def verify_server_response(path: str, body: Union[str, bytes], headers: Mapping[str, str],
+                           ctx: Optional[CryptoContext] = None) -> Dict[str, Any]:
+    """
+    Check the server certificate against the CA and the body signature; returns the server cert.
+    `ctx` picks another CA (e.g. a test CA for the load generator); default is this server's.
+    """
+    h = _lower_headers(headers)
+    cert_json = h.get("x-spe-server-cert")
+    cert_sig  = h.get("x-spe-server-certsig")
+    body_sig  = h.get("x-spe-server-sig")
+    mode      = (h.get("x-spe-sig-mode") or SIG_MODE_RAW).strip().lower()
+
+    if not cert_json or not cert_sig or not body_sig:
+        raise ValueError("Missing server certificate or signature headers.")
+    if mode not in SIG_MODES:
+        raise ValueError(f"Unsupported signature mode {mode!r}.")
+    # Server certificates are issued by the same CA as client ones; only the id tells them apart
+    cert, pub = (ctx or _ctx).verify_server_cert(cert_json, cert_sig)
+    try:
+        pub.verify(b64u_decode(body_sig), signed_message(path, body, mode))
+    except InvalidSignature as e:
+        raise ValueError("Invalid server response signature.") from e
+    return cert
+
+
+class ClientIdentity:
+    """A client certificate and its private key, for signing requests to another SPE API."""
 
-    cert = verify_client_cert(cert_json, cert_sig)
+    def __init__(self, cert_json: str, cert_sig: str, priv_b64: str):
+        if not cert_json or not cert_sig or not priv_b64:
+            raise ValueError("Client identity needs a certificate, its CA signature and a private key.")
+        self.cert_json = cert_json
+        self.cert_sig = cert_sig
+        self._sk = Ed25519PrivateKey.from_private_bytes(b64u_decode(priv_b64))
 
-    msg = f"{path}\n{body}".encode()
-    pubkey_b64 = cert["pubkey"]
-    if not verify_signature(pubkey_b64, msg, req_sig):
-        raise ValueError("Invalid client request signature.")
+    def request_headers(self, path: str, body: Union[str, bytes], mode: str = SIG_MODE_RAW) -> Dict[str, str]:
+        headers = {
+            "X-SPE-Client-Cert": self.cert_json,
+            "X-SPE-Client-CertSig": self.cert_sig,
+            "X-SPE-Client-Sig": b64u_encode(self._sk.sign(signed_message(path, body, mode))),
+        }
+        if mode != SIG_MODE_RAW:
+            headers[SIG_MODE_HEADER] = mode
+        return headers
@@ -0,0 +1,118 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Sequence, Tuple
+import hashlib
+import re
+
+Probs = Dict[str, float]
+
+STAGES = ("lexicon", "phrase", "length")
+
+# Phrase tokens (see phrases.PHRASE_PATTERNS) whose polarity is not in doubt on their own
+POSITIVE_TOKENS = frozenset((
+    "good_job", "did_most_of_work", "did_a_lot_for_team", "did_most_of_project",
+    "did_most_of_project_coding", "did_most_of_job", "did_most_of_reports",
+    "did_most_of_slides", "contributed_in_meetings",
+))
+NEGATIVE_TOKENS = frozenset((
+    "did_not_do_much", "did_not_contribute_at_all", "absenteeism", "unresponsive",
+    "often_late", "always_unavailable", "always_uncontactable", "always_not_available",
+))
+NEGATIVE_PREFIXES = ("did_only_pct_work_",)
+
+# One-word answers that carry no sentiment
+NEUTRAL_FILLERS = frozenset(("ok", "okay", "fine", "na", "n/a", "nil", "none", "nothing", "no comment", "-"))
+
+_FILLER_STRIP_RE = re.compile(r"[^\w/ -]+")
+
+
+def parse_stages(spec: str) -> Tuple[str, ...]:
+    """SPE_CASCADE value ("lexicon,phrase,length", "all" or empty for off) -> ordered stages."""
+    spec = (spec or "").strip().lower()
+    if spec in ("", "off", "none", "0", "false"):
+        return ()
+    if spec in ("all", "on", "1", "true"):
+        return STAGES
+    stages = tuple(s.strip() for s in spec.split(",") if s.strip())
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        raise ValueError(f"Unknown SPE_CASCADE stage(s) {', '.join(unknown)}; expected {', '.join(STAGES)}.")
+    return stages
+
+def _token_polarity(token: str) -> int:
+    if token in POSITIVE_TOKENS:
+        return 1
+    if token in NEGATIVE_TOKENS or token.startswith(NEGATIVE_PREFIXES):
+        return -1
+    return 0
+
+
+class Cascade:
+    """
+    Cheap stages that can settle an item before it reaches the transformer.
+
+    A settling stage returns synthetic probabilities; the item is then finished
+    by the normal scoring code (toxic override, target bias, disparity), so
+    its result has the usual shape, with engine "cascade:<stage>" and
+    "vectors": null, since those probabilities are not the model's.
+
+        lexicon  a toxic word: the result is forced to toxic anyway
+        phrase   a short text whose only phrase tokens share one clear polarity,
+                 with no contrast cue and no negation
+        length   a one-word filler answer such as "ok" or "n/a"
+
+    `audit_rate` sends that share of settled items (picked by a hash of the
+    text, so runs are repeatable) through the model as well, to measure
+    agreement between the two paths.
+    """
+
+    def __init__(self, stages: Sequence[str], phrase_max_words: int = 8,
+                 phrase_confidence: float = 0.9, audit_rate: float = 0.0):
+        self.stages = tuple(stages)
+        self.phrase_max_words = phrase_max_words
+        self.phrase_confidence = phrase_confidence
+        self.audit_rate = audit_rate
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.stages)
+
+    def _lexicon(self, plan: Dict[str, object]) -> Optional[Probs]:
+        if plan["toxic"]:
+            return {"negative": 1.0, "neutral": 0.0, "positive": 0.0}
+        return None
+
+    def _phrase(self, plan: Dict[str, object]) -> Optional[Probs]:
+        matched: List[str] = plan["matched"]
+        if (not matched or plan["tail"] or plan["negation_used"]
+                or plan["wc"] > self.phrase_max_words):
+            return None
+        polarity = {_token_polarity(t) for t in matched}
+        if polarity not in ({1}, {-1}):
+            return None
+        p = self.phrase_confidence
+        if polarity == {1}:
+            return {"negative": 0.0, "neutral": 1.0 - p, "positive": p}
+        return {"negative": p, "neutral": 1.0 - p, "positive": 0.0}
+
+    def _length(self, plan: Dict[str, object]) -> Optional[Probs]:
+        if plan["wc"] > 2:
+            return None
+        if _FILLER_STRIP_RE.sub("", plan["tx"].lower()).strip() in NEUTRAL_FILLERS:
+            return {"negative": 0.0, "neutral": 1.0, "positive": 0.0}
+        return None
+
+    def settle(self, plan: Dict[str, object]) -> Optional[Tuple[str, Probs]]:
+        """(stage, probs) for the first stage that settles the plan, or None."""
+        for stage in self.stages:
+            probs = getattr(self, "_" + stage)(plan)
+            if probs is not None:
+                return stage, probs
+        return None
+
+    def sampled(self, text: str) -> bool:
+        if self.audit_rate <= 0:
+            return False
+        if self.audit_rate >= 1:
+            return True
+        h = int.from_bytes(hashlib.sha1(text.encode()).digest()[:4], "big")
+        return h / 2 ** 32 < self.audit_rate
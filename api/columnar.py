@@ -0,0 +1,232 @@
+"""
+Columnar binary encoding of an /analyze batch (media type application/vnd.spe.columnar).
+
+All integers and floats are little-endian; floats are IEEE float64, so values
+round-trip exactly as they would through JSON.
+
+    header     "SPC1"  u8 version  u8 ok  u32 n
+    strings    u32 count, then per string: u32 byte length + UTF-8 bytes
+    columns    n entries each, in this order:
+      id                u32 string index (0xFFFFFFFF: item had no id; ids come back as strings)
+      label             u8  LABELS index
+      roberta_label     u8  LABELS index
+      flags             u8  bit 0 toxic, 1 negation_used, 2 disparity, 3 suggest_confirm
+      engine            u32 string index
+      disparity_reason  u32 string index (0xFFFFFFFF: null)
+      word_count        u32
+      char_count        u32
+      sentence_count    u32
+      score, compound, avg_compound, min_compound, roberta_compound    f64 each
+      probs             3 x f64 per item (negative, neutral, positive)
+      matched_count     u16
+    matched tokens    u32 string index, sum(matched_count) entries
+    vectors           version 2 only (see rescore.py):
+      vflags            u8 per item: bit 0 has vectors, 1 contrast split, 2 peer pronoun, 3 self pronoun
+      front, tail       3 x f64 each, for every item with bit 1
+      sentences         3 x f64 per sentence, sentence_count of them for every item with bit 0
+      (the whole-text vector is probs and the toxic fact is the toxic flag)
+
+Labels, reasons, engines, ids and matched tokens go through the string table,
+so a reason repeated for 2000 items is stored once.
+
+Clients ask for version 2 with "Accept: application/vnd.spe.columnar; version=2";
+everyone else gets version 1.
+"""
+from __future__ import annotations
+from typing import Dict, List, Tuple
+import struct
+
+MEDIA_TYPE = "application/vnd.spe.columnar"
+MAGIC = b"SPC1"
+VERSION = 2
+VERSIONS = (1, 2)
+NONE = 0xFFFFFFFF
+
+LABELS = ("negative", "neutral", "positive", "toxic")
+_LABEL_INDEX = {l: i for i, l in enumerate(LABELS)}
+
+F_TOXIC, F_NEGATION, F_DISPARITY, F_CONFIRM = 1, 2, 4, 8
+V_PRESENT, V_CONTRAST, V_PEER, V_SELF = 1, 2, 4, 8
+
+FLOAT_COLUMNS = ("score", "compound", "avg_compound", "min_compound", "roberta_compound")
+
+
+class _Strings:
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.items: List[str] = []
+
+    def __call__(self, s: str) -> int:
+        i = self.index.get(s)
+        if i is None:
+            i = self.index[s] = len(self.items)
+            self.items.append(s)
+        return i
+
+    def encode(self) -> bytes:
+        parts = [struct.pack("<I", len(self.items))]
+        for s in self.items:
+            b = s.encode("utf-8")
+            parts.append(struct.pack("<I", len(b)))
+            parts.append(b)
+        return b"".join(parts)
+
+
+def requested_version(accept: str) -> int:
+    """Columnar version asked for by an Accept header (its version= parameter), 1 by default."""
+    for media_range in accept.split(","):
+        parts = [p.strip() for p in media_range.split(";")]
+        if parts[0] == MEDIA_TYPE:
+            for param in parts[1:]:
+                key, _, value = param.partition("=")
+                if key.strip() == "version" and value.strip().isdigit() and int(value) in VERSIONS:
+                    return int(value)
+    return 1
+
+def encode_results(results: List[dict], ok: bool = True, version: int = 1) -> bytes:
+    n = len(results)
+    strings = _Strings()
+    ids, labels, rlabels, flags, engines, reasons = [], bytearray(), bytearray(), bytearray(), [], []
+    counts: List[int] = []
+    floats: Dict[str, List[float]] = {c: [] for c in FLOAT_COLUMNS}
+    probs: List[float] = []
+    matched_counts: List[int] = []
+    matched: List[int] = []
+
+    for r in results:
+        ids.append(strings(str(r["id"])) if "id" in r else NONE)
+        labels.append(_LABEL_INDEX[r["label"]])
+        rob = r["roberta"]
+        rlabels.append(_LABEL_INDEX[rob["label"]])
+        flags.append((F_TOXIC if r["toxic"] else 0) | (F_NEGATION if r["negation_used"] else 0)
+                     | (F_DISPARITY if r["disparity"] else 0) | (F_CONFIRM if r["suggest_confirm"] else 0))
+        engines.append(strings(r["engine"]))
+        reasons.append(NONE if r["disparity_reason"] is None else strings(r["disparity_reason"]))
+        sent = r["sentences"]
+        counts.extend((r["word_count"], r["char_count"], sent["count"]))
+        floats["score"].append(r["score"])
+        floats["compound"].append(r["compound"])
+        floats["avg_compound"].append(sent["avg_compound"])
+        floats["min_compound"].append(sent["min_compound"])
+        floats["roberta_compound"].append(rob["compound"])
+        p = rob["probs"]
+        probs.extend((p["negative"], p["neutral"], p["positive"]))
+        toks = r["matched_tokens"]
+        matched_counts.append(len(toks))
+        matched.extend(strings(t) for t in toks)
+
+    out = [
+        MAGIC, struct.pack("<BBI", version, 1 if ok else 0, n),
+        strings.encode(),
+        struct.pack(f"<{n}I", *ids), bytes(labels), bytes(rlabels), bytes(flags),
+        struct.pack(f"<{n}I", *engines), struct.pack(f"<{n}I", *reasons),
+        # word/char/sentence counts are stored column by column
+        struct.pack(f"<{n}I", *counts[0::3]), struct.pack(f"<{n}I", *counts[1::3]),
+        struct.pack(f"<{n}I", *counts[2::3]),
+    ]
+    out.extend(struct.pack(f"<{n}d", *floats[c]) for c in FLOAT_COLUMNS)
+    out.append(struct.pack(f"<{3 * n}d", *probs))
+    out.append(struct.pack(f"<{n}H", *matched_counts))
+    out.append(struct.pack(f"<{len(matched)}I", *matched))
+    if version >= 2:
+        out.extend(_encode_vectors(results))
+    return b"".join(out)
+
+def _encode_vectors(results: List[dict]) -> List[bytes]:
+    vflags = bytearray()
+    contrast: List[float] = []
+    sentences: List[float] = []
+    for r in results:
+        v = r.get("vectors")
+        if not v:
+            vflags.append(0)
+            continue
+        vflags.append(V_PRESENT | (V_CONTRAST if v["tail"] is not None else 0)
+                      | (V_PEER if v["peer_pronoun"] else 0) | (V_SELF if v["self_pronoun"] else 0))
+        if v["tail"] is not None:
+            contrast.extend(v["front"])
+            contrast.extend(v["tail"])
+        for row in v["sentences"]:
+            sentences.extend(row)
+    return [bytes(vflags), struct.pack(f"<{len(contrast)}d", *contrast),
+            struct.pack(f"<{len(sentences)}d", *sentences)]
+
+
+def decode_results(data: bytes) -> Tuple[bool, List[dict]]:
+    """Inverse of encode_results; returns (ok, results) shaped like the JSON response."""
+    if data[:4] != MAGIC:
+        raise ValueError("Not a columnar SPE payload.")
+    version, ok, n = struct.unpack_from("<BBI", data, 4)
+    if version not in VERSIONS:
+        raise ValueError(f"Unsupported columnar version {version}.")
+    pos = 10
+
+    (count,) = struct.unpack_from("<I", data, pos)
+    pos += 4
+    strings = []
+    for _ in range(count):
+        (ln,) = struct.unpack_from("<I", data, pos)
+        pos += 4
+        strings.append(data[pos:pos + ln].decode("utf-8"))
+        pos += ln
+
+    def take(fmt: str, k: int):
+        nonlocal pos
+        vals = struct.unpack_from(f"<{k}{fmt}", data, pos)
+        pos += struct.calcsize(f"<{k}{fmt}")
+        return vals
+
+    ids = take("I", n)
+    labels, rlabels, flags = take("B", n), take("B", n), take("B", n)
+    engines, reasons = take("I", n), take("I", n)
+    wcs, ccs, scs = take("I", n), take("I", n), take("I", n)
+    floats = {c: take("d", n) for c in FLOAT_COLUMNS}
+    probs = take("d", 3 * n)
+    mcounts = take("H", n)
+    matched = take("I", sum(mcounts))
+    if version >= 2:
+        vflags = take("B", n)
+        contrast = take("d", 6 * sum(1 for f in vflags if f & V_CONTRAST))
+        sentences = take("d", 3 * sum(scs[i] for i in range(n) if vflags[i] & V_PRESENT))
+        ci = si = 0
+
+    results, m = [], 0
+    for i in range(n):
+        f = flags[i]
+        r = {
+            "label": LABELS[labels[i]],
+            "score": floats["score"][i],
+            "compound": floats["compound"][i],
+            "toxic": bool(f & F_TOXIC),
+            "word_count": wcs[i], "char_count": ccs[i],
+            "sentences": {"count": scs[i], "avg_compound": floats["avg_compound"][i],
+                          "min_compound": floats["min_compound"][i]},
+            "matched_tokens": [strings[j] for j in matched[m:m + mcounts[i]]],
+            "negation_used": bool(f & F_NEGATION),
+            "engine": strings[engines[i]],
+            "roberta": {"compound": floats["roberta_compound"][i], "label": LABELS[rlabels[i]],
+                        "probs": {"negative": probs[3 * i], "neutral": probs[3 * i + 1],
+                                  "positive": probs[3 * i + 2]}},
+            "disparity": bool(f & F_DISPARITY),
+            "disparity_reason": None if reasons[i] == NONE else strings[reasons[i]],
+            "suggest_confirm": bool(f & F_CONFIRM),
+        }
+        if version >= 2:
+            vf = vflags[i]
+            r["vectors"] = None
+            if vf & V_PRESENT:
+                p = r["roberta"]["probs"]
+                front = tail = None
+                if vf & V_CONTRAST:
+                    front, tail = list(contrast[ci:ci + 3]), list(contrast[ci + 3:ci + 6])
+                    ci += 6
+                rows = [list(sentences[si + 3 * j:si + 3 * j + 3]) for j in range(scs[i])]
+                si += 3 * scs[i]
+                r["vectors"] = {"whole": [p["negative"], p["neutral"], p["positive"]], "sentences": rows,
+                                "front": front, "tail": tail, "toxic": r["toxic"],
+                                "peer_pronoun": bool(vf & V_PEER), "self_pronoun": bool(vf & V_SELF)}
+        if ids[i] != NONE:
+            r["id"] = strings[ids[i]]
+        m += mcounts[i]
+        results.append(r)
+    return bool(ok), results
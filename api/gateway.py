@@ -0,0 +1,197 @@
+"""
+Gateway mode: one /analyze batch fanned out across several sentiment_api backends.
+
+The gateway verifies the client as usual, splits the items into shards, posts
+each shard (signed with the gateway's own client identity) to a backend over a
+pooled keep-alive connection, verifies every backend response, and merges the
+results back into input order. A shard that fails on one backend (connection
+error, timeout, 5xx, 429 or a bad signature) is retried on the next one.
+"""
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+import http.client
+import json
+import logging
+import math
+import queue
+import threading
+import time
+
+from ca_helpers import SIG_MODE_SHA512, ClientIdentity, verify_server_response
+
+# Backend answers worth trying elsewhere; anything else (403, 422, ...) fails the batch at once
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+# Seconds a backend that refused or dropped a connection is passed over
+BACKEND_COOLDOWN_S = 5.0
+
+
+class GatewayError(Exception):
+    """A shard could not be scored (by one backend, or by any); `status` is the HTTP status if there was one."""
+
+    def __init__(self, message: str, status: int = 0):
+        super().__init__(message)
+        self.status = status
+
+
+class BackendPool:
+    """Keep-alive HTTP connections to one backend, shared by the gateway's threads."""
+
+    def __init__(self, url: str, size: int = 8, timeout: float = 60.0):
+        parts = urlsplit(url if "://" in url else "http://" + url)
+        self.url = url
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.down_until = 0.0
+        self._idle: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue(maxsize=size)
+
+    def _new(self) -> http.client.HTTPConnection:
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method: str, path: str, body: bytes,
+                headers: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        try:
+            conn, reused = self._idle.get_nowait(), True
+        except queue.Empty:
+            conn, reused = self._new(), False
+        while True:
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                out = (resp.status, {k.lower(): v for k, v in resp.getheaders()}, data)
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if not reused:
+                    raise
+                # The backend closed an idle keep-alive connection: once more on a fresh one
+                conn, reused = self._new(), False
+            except Exception:
+                conn.close()
+                raise
+        if resp.will_close:
+            conn.close()
+        else:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+        return out
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class Gateway:
+    """
+    Shard a batch across `backends` (base URLs such as http://10.0.0.5:8000) and
+    merge the results in order. Shards hold at most `shard_items` items, and a
+    batch is spread over every backend even when it is small. Each shard is
+    tried on up to `attempts` backends, starting from a different one per shard;
+    a backend that just failed to connect is tried last for a few seconds.
+    """
+
+    path = "/analyze"
+
+    def __init__(self, backends: List[str], identity: ClientIdentity, api_token: str = "",
+                 shard_items: int = 250, attempts: int = 3, pool_size: int = 8, timeout: float = 60.0):
+        if not backends:
+            raise ValueError("Gateway mode needs at least one backend URL.")
+        self.pools = [BackendPool(url, size=pool_size, timeout=timeout) for url in backends]
+        self.identity = identity
+        self.api_token = api_token
+        self.shard_items = shard_items
+        self.attempts = max(1, attempts)
+        self._executor = ThreadPoolExecutor(max_workers=len(self.pools) * pool_size,
+                                            thread_name_prefix="spe-gateway")
+        self._next = 0
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"shards": 0, "retries": 0, "failures": 0}
+
+    def shards(self, items: List[dict]) -> List[List[dict]]:
+        if not items:
+            return []
+        size = max(1, min(self.shard_items, math.ceil(len(items) / len(self.pools))))
+        return [items[i:i + size] for i in range(0, len(items), size)]
+
+    def _post(self, pool: BackendPool, shard: List[dict]) -> List[dict]:
+        body = json.dumps({"items": shard}, separators=(',', ':'), ensure_ascii=False).encode()
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        headers.update(self.identity.request_headers(self.path, body, SIG_MODE_SHA512))
+        if self.api_token:
+            headers["X-API-Token"] = self.api_token
+
+        status, resp_headers, data = pool.request("POST", self.path, body, headers)
+        if status != 200:
+            raise GatewayError(f"{pool.url} answered HTTP {status}.", status)
+        verify_server_response(self.path, data, resp_headers)
+        payload = json.loads(data)
+        if not isinstance(payload, dict):
+            raise GatewayError(f"{pool.url} answered a non-object body.")
+        results = payload.get("results")
+        if not payload.get("ok") or not isinstance(results, list) or len(results) != len(shard):
+            raise GatewayError(f"{pool.url} rejected the shard.")
+        return results
+
+    def _order(self, start: int) -> List[BackendPool]:
+        """Backends to try for a shard: rotated by `start`, those cooling down after a failure last."""
+        now = time.monotonic()
+        rotated = self.pools[start % len(self.pools):] + self.pools[:start % len(self.pools)]
+        return [p for p in rotated if p.down_until <= now] + [p for p in rotated if p.down_until > now]
+
+    def _run_shard(self, shard: List[dict], start: int) -> List[dict]:
+        log = logging.getLogger("uvicorn")
+        last: Optional[Exception] = None
+        order = self._order(start)
+        for attempt in range(self.attempts):
+            pool = order[attempt % len(order)]
+            try:
+                return self._post(pool, shard)
+            except GatewayError as e:
+                last = e
+                if e.status and e.status not in RETRYABLE_STATUS:
+                    break
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                # Connection errors, timeouts, malformed or badly signed responses
+                last = e
+                if isinstance(e, OSError):
+                    pool.down_until = time.monotonic() + BACKEND_COOLDOWN_S
+            if attempt + 1 < self.attempts:
+                with self._lock:
+                    self.counters["retries"] += 1
+                log.warning("Shard of %d items failed on %s (%s); retrying elsewhere.",
+                            len(shard), pool.url, str(last))
+        with self._lock:
+            self.counters["failures"] += 1
+        raise GatewayError(f"Shard of {len(shard)} items failed on every backend tried ({last}).")
+
+    def analyze(self, items: List[dict]) -> List[dict]:
+        """Results for `items` in input order, scored by the backends."""
+        shards = self.shards(items)
+        if not shards:
+            return []
+        with self._lock:
+            start = self._next
+            self._next = (self._next + len(shards)) % len(self.pools)
+            self.counters["shards"] += len(shards)
+        futures = [self._executor.submit(self._run_shard, shard, start + i)
+                   for i, shard in enumerate(shards)]
+        results: List[dict] = []
+        for fut in futures:
+            results.extend(fut.result())
+        return results
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        for pool in self.pools:
+            pool.close()
@@ -1,4 +1,4 @@
-import base64, json, time
+import argparse, base64, json, time
 from textwrap import dedent
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
 from cryptography.hazmat.primitives import serialization
@@ -46,41 +46,55 @@ def emit_php_defines(
     """
     print(dedent(php))
 
+def issue_cert(ca_sk: Ed25519PrivateKey, cert_id: str, exp: int):
+    """New keypair plus a CA-signed certificate for it: (private key, seed, cert, cert JSON, cert sig)."""
+    sk, seed, pk = keypair()
+    cert = {"id": cert_id, "pubkey": b64u(pk), "exp": exp, "iss": "SPE-CA"}
+    cert_json, cert_sig = sign_with_ca(ca_sk, cert)
+    return sk, seed, cert, cert_json, cert_sig
+
 # ---------------- Generate keys ----------------------
 
-# Certificate Authority
-ca_sk, ca_seed, ca_pk = keypair()
-ca_pub_b64 = b64u(ca_pk)
-
-# Expiry time
-exp = int(time.time()) + 365 * 24 * 3600
-
-# API
-srv_sk, srv_seed, srv_pk = keypair()
-srv_cert = {"id": "spe-api", "pubkey": b64u(srv_pk), "exp": exp, "iss": "SPE-CA"}
-srv_cert_json, srv_cert_sig = sign_with_ca(ca_sk, srv_cert)
-
-# SPE
-cli_sk, cli_seed, cli_pk = keypair()
-cli_cert = {"id": "spe-plugin", "pubkey": b64u(cli_pk), "exp": exp, "iss": "SPE-CA"}
-cli_cert_json, cli_cert_sig = sign_with_ca(ca_sk, cli_cert)
-
-# Print results
-print("=================== Certificate Authority ===================")
-print("CA_PUB_B64      =", ca_pub_b64)
-
-print("\n\n====================== API ======================")
-print(f'CA_PUB_B64       = "{ca_pub_b64}"')
-print(f'SERVER_PRIV_B64  = "{b64u(srv_seed)}"')
-print(f'SERVER_CERT_JSON = \'{srv_cert_json}\'')
-print(f'SERVER_CERT_SIG  = "{srv_cert_sig}"')
-
-print("\n\n====================== SPE ======================")
-emit_php_defines(
-    ca_pub_b64=ca_pub_b64,
-    client_priv_b64=b64u(cli_seed),
-    client_cert=cli_cert,
-    client_cert_sig_b64=cli_cert_sig,
-    server_cert=srv_cert,
-    server_cert_sig_b64=srv_cert_sig,
-)
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Generate the CA, API and plugin keys and certificates.")
+    ap.add_argument("--show-ca-priv", action="store_true",
+                    help="also print the CA private key (test CAs only, e.g. for loadgen.py --ca-priv)")
+    args = ap.parse_args(argv)
+
+    # Certificate Authority
+    ca_sk, ca_seed, ca_pk = keypair()
+    ca_pub_b64 = b64u(ca_pk)
+
+    # Expiry time
+    exp = int(time.time()) + 365 * 24 * 3600
+
+    # API
+    srv_sk, srv_seed, srv_cert, srv_cert_json, srv_cert_sig = issue_cert(ca_sk, "spe-api", exp)
+
+    # SPE
+    cli_sk, cli_seed, cli_cert, cli_cert_json, cli_cert_sig = issue_cert(ca_sk, "spe-plugin", exp)
+
+    # Print results
+    print("=================== Certificate Authority ===================")
+    print("CA_PUB_B64      =", ca_pub_b64)
+    if args.show_ca_priv:
+        print("CA_PRIV_B64     =", b64u(ca_seed), " (keep offline)")
+
+    print("\n\n====================== API ======================")
+    print(f'CA_PUB_B64       = "{ca_pub_b64}"')
+    print(f'SERVER_PRIV_B64  = "{b64u(srv_seed)}"')
+    print(f'SERVER_CERT_JSON = \'{srv_cert_json}\'')
+    print(f'SERVER_CERT_SIG  = "{srv_cert_sig}"')
+
+    print("\n\n====================== SPE ======================")
+    emit_php_defines(
+        ca_pub_b64=ca_pub_b64,
+        client_priv_b64=b64u(cli_seed),
+        client_cert=cli_cert,
+        client_cert_sig_b64=cli_cert_sig,
+        server_cert=srv_cert,
+        server_cert_sig_b64=srv_cert_sig,
+    )
+
+if __name__ == "__main__":
+    main()
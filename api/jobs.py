@@ -0,0 +1,288 @@
+from __future__ import annotations
+from typing import Callable, Dict, List, Optional, Tuple
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+STATES = ("queued", "running", "done", "failed", "cancelled")
+
+
+def parse_priorities(spec: str) -> Dict[str, int]:
+    """SPE_JOB_PRIORITIES value ("plugin-a:10,plugin-b:-5") -> {client id: priority}."""
+    out: Dict[str, int] = {}
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        client, _, prio = part.rpartition(":")
+        if not client.strip():
+            raise ValueError(f"Bad SPE_JOB_PRIORITIES entry {part!r}; expected client:priority.")
+        out[client.strip()] = int(prio)
+    return out
+
+
+class JobStore:
+    """
+    SQLite store of asynchronous analysis jobs, safe to share between threads and
+    pre-fork workers.
+
+    A job's items are split into chunks of `chunk_items`; workers claim one chunk
+    at a time, so jobs of the same priority take turns and a big job never holds
+    up a small one for long. A claimed chunk that is not finished within `lease`
+    seconds (its worker died) is handed out again.
+    """
+
+    def __init__(self, path: str, chunk_items: int = 256, lease: float = 600.0):
+        self.path = path
+        self.chunk_items = chunk_items
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._connect()
+
+    def _connect(self) -> None:
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, client TEXT NOT NULL, priority INTEGER NOT NULL,"
+            " state TEXT NOT NULL, total INTEGER NOT NULL, done INTEGER NOT NULL,"
+            " created REAL NOT NULL, updated REAL NOT NULL, served REAL NOT NULL, error TEXT)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS job_chunks ("
+            " job_id TEXT NOT NULL, seq INTEGER NOT NULL, first INTEGER NOT NULL,"
+            " items TEXT NOT NULL, results TEXT, claimed REAL,"
+            " PRIMARY KEY (job_id, seq))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_pick ON jobs(state, priority, served)")
+
+    def reopen(self) -> None:
+        """Open a fresh SQLite connection, e.g. in a forked worker (connections must not cross fork)."""
+        self._lock = threading.Lock()
+        self._connect()
+
+    def _row(self, row) -> Optional[Dict[str, object]]:
+        if row is None:
+            return None
+        keys = ("id", "client", "priority", "state", "total", "done", "created", "updated", "error")
+        return dict(zip(keys, row))
+
+    def create(self, client: str, priority: int, items: List[dict]) -> Dict[str, object]:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        n = self.chunk_items
+        chunks = [(job_id, i // n, i, json.dumps(items[i:i + n], separators=(',', ':'), ensure_ascii=False))
+                  for i in range(0, len(items), n)]
+        state = "queued" if items else "done"
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT INTO jobs (id, client, priority, state, total, done, created, updated, served)"
+                    " VALUES (?, ?, ?, ?, ?, 0, ?, ?, 0)",
+                    (job_id, client, priority, state, len(items), now, now),
+                )
+                self._db.executemany(
+                    "INSERT INTO job_chunks (job_id, seq, first, items) VALUES (?, ?, ?, ?)", chunks
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, object]]:
+        with self._lock:
+            return self._row(self._db.execute(
+                "SELECT id, client, priority, state, total, done, created, updated, error"
+                " FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone())
+
+    def claim(self) -> Optional[Tuple[str, int, List[dict]]]:
+        """
+        Next chunk to score as (job id, seq, items): highest priority first, then
+        the job served least recently; None when there is nothing to do.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT c.job_id, c.seq, c.items FROM jobs j JOIN job_chunks c ON c.job_id = j.id"
+                    " WHERE j.state IN ('queued', 'running') AND c.results IS NULL"
+                    "   AND (c.claimed IS NULL OR c.claimed < ?)"
+                    " ORDER BY j.priority DESC, j.served ASC, j.created ASC, c.seq ASC LIMIT 1",
+                    (now - self.lease,),
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE job_chunks SET claimed = ? WHERE job_id = ? AND seq = ?",
+                                     (now, row[0], row[1]))
+                    self._db.execute(
+                        "UPDATE jobs SET state = CASE state WHEN 'queued' THEN 'running' ELSE state END,"
+                        " served = ?, updated = ? WHERE id = ?", (now, now, row[0]))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def complete(self, job_id: str, seq: int, results: List[dict]) -> None:
+        now = time.time()
+        blob = json.dumps(results, separators=(',', ':'), ensure_ascii=False)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                cur = self._db.execute(
+                    "UPDATE job_chunks SET results = ? WHERE job_id = ? AND seq = ? AND results IS NULL",
+                    (blob, job_id, seq),
+                )
+                if cur.rowcount:
+                    self._db.execute("UPDATE jobs SET done = done + ?, updated = ? WHERE id = ?",
+                                     (len(results), now, job_id))
+                    self._db.execute(
+                        "UPDATE jobs SET state = 'done' WHERE id = ? AND state = 'running' AND NOT EXISTS"
+                        " (SELECT 1 FROM job_chunks WHERE job_id = ? AND results IS NULL)",
+                        (job_id, job_id),
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def fail(self, job_id: str, error: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = 'failed', error = ?, updated = ?"
+                " WHERE id = ? AND state IN ('queued', 'running')",
+                (error, time.time(), job_id),
+            )
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, object]]:
+        """Stop a queued or running job; chunks already scored keep their results."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = 'cancelled', updated = ?"
+                " WHERE id = ? AND state IN ('queued', 'running')",
+                (time.time(), job_id),
+            )
+        return self.get(job_id)
+
+    def results(self, job_id: str, start: int = 0, limit: int = 2000) -> Tuple[List[dict], int]:
+        """Finished results in item order from `start`, up to the first chunk still pending; (results, next)."""
+        out: List[dict] = []
+        nxt = start
+        with self._lock:
+            # From the chunk holding `start`, by the boundaries stored at creation
+            # (chunk_items may have changed since the job was split)
+            rows = self._db.execute(
+                "SELECT first, results FROM job_chunks WHERE job_id = ? AND first >="
+                " (SELECT MAX(first) FROM job_chunks WHERE job_id = ? AND first <= ?) ORDER BY seq",
+                (job_id, job_id, start),
+            )
+            for first, blob in rows:
+                if blob is None or len(out) >= limit:
+                    break
+                res = json.loads(blob)[max(0, start - first):]
+                out.extend(res[:limit - len(out)])
+            nxt = start + len(out)
+        return out, nxt
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        out = {s: 0 for s in STATES}
+        out.update(dict(rows))
+        return out
+
+    def purge(self, older_than: float) -> int:
+        """Delete finished jobs last updated more than `older_than` seconds ago."""
+        cutoff = time.time() - older_than
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [r[0] for r in self._db.execute(
+                    "SELECT id FROM jobs WHERE state IN ('done', 'failed', 'cancelled') AND updated < ?",
+                    (cutoff,),
+                )]
+                for job_id in ids:
+                    self._db.execute("DELETE FROM job_chunks WHERE job_id = ?", (job_id,))
+                    self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return len(ids)
+
+
+class JobRunner:
+    """
+    Background threads that claim job chunks and score them with `score(items)`,
+    which returns one result per item. Nothing is claimed while `ready()` is false
+    (e.g. the model is still loading). Finished jobs older than `retention`
+    seconds are purged now and then.
+    """
+
+    def __init__(self, store: JobStore, score: Callable[[List[dict]], List[dict]],
+                 ready: Callable[[], bool], workers: int = 1, poll: float = 0.5,
+                 retention: float = 7 * 86400.0):
+        self.store = store
+        self.score = score
+        self.ready = ready
+        self.workers = workers
+        self.poll = poll
+        self.retention = retention
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._last_purge = 0.0
+
+    def start(self) -> None:
+        if self._threads or self.workers <= 0:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._loop, name=f"spe-job-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def run_once(self) -> bool:
+        """Claim and score one chunk; False when there was nothing to do."""
+        claimed = self.store.claim()
+        if claimed is None:
+            return False
+        job_id, seq, items = claimed
+        try:
+            results = self.score(items)
+        except Exception as e:
+            logging.getLogger("uvicorn").error("Job %s failed (%s).", job_id, str(e))
+            self.store.fail(job_id, str(getattr(e, "detail", "") or e))
+            return True
+        self.store.complete(job_id, seq, results)
+        return True
+
+    def _loop(self) -> None:
+        log = logging.getLogger("uvicorn")
+        while not self._stop.is_set():
+            try:
+                if not self.ready() or not self.run_once():
+                    self._maybe_purge()
+                    self._stop.wait(self.poll)
+            except Exception as e:
+                log.error("Job worker error (%s).", str(e))
+                self._stop.wait(self.poll)
+
+    def _maybe_purge(self) -> None:
+        now = time.time()
+        if now - self._last_purge > 3600:
+            self._last_purge = now
+            self.store.purge(self.retention)
@@ -0,0 +1,347 @@
+"""
+Signed end-to-end load generator for a running sentiment API.
+
+    cd api && python -m loadgen http://127.0.0.1:8000 --rate 20 --duration 60 --concurrency 32
+    cd api && python -m loadgen http://127.0.0.1:8000 --replay recorded.jsonl --rate 5 --accept ndjson
+
+Every request is signed like analyze_push.php signs it, and every response is
+verified: the server certificate against the CA and the body signature, or the
+signature chain of a streamed (NDJSON) response, line by line.
+
+Arrivals are open-loop: requests start on a constant or Poisson schedule at
+--rate per second no matter how fast the server answers, with at most
+--concurrency in flight. Latency is measured from the scheduled start, so time
+spent waiting for a free slot while the server is saturated counts instead of
+being hidden. --rate 0 runs closed-loop instead (each slot sends back to back).
+
+Payloads come from --replay (one request per line: a request body {"items": [...]}
+or a bare item, grouped --batch at a time) or else are synthetic batches of
+--batch items from benchmarks.corpus.
+
+The client identity is minted fresh, as generate_keys.py does, when --ca-priv
+is given (the CA's private key from generate_keys.py --show-ca-priv; test CAs
+only): --clients identities named spe-loadgen-0, -1, ... take turns, which
+exercises per-client admission. Otherwise SPE_LOADGEN_CLIENT_CERT / _CERTSIG /
+_PRIV name an existing one.
+"""
+from __future__ import annotations
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import socket
+import statistics
+import threading
+import time
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+import columnar
+from benchmarks.corpus import make_corpus
+from ca_helpers import (SIG_MODES, SIG_MODE_RAW, ClientIdentity, CryptoContext, b64u_decode,
+                        verify_server_response)
+from gateway import BackendPool
+from generate_keys import b64u, issue_cert
+
+PATH = "/analyze"
+ACCEPT = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "columnar": columnar.MEDIA_TYPE,
+}
+
+
+# Identities
+def mint_identities(ca_priv_b64: str, n: int, prefix: str = "spe-loadgen") -> List[ClientIdentity]:
+    """n fresh client identities certified by the CA whose private key is given."""
+    ca_sk = Ed25519PrivateKey.from_private_bytes(b64u_decode(ca_priv_b64))
+    exp = int(time.time()) + 24 * 3600
+    out = []
+    for i in range(n):
+        _, seed, _, cert_json, cert_sig = issue_cert(ca_sk, f"{prefix}-{i}", exp)
+        out.append(ClientIdentity(cert_json, cert_sig, b64u(seed)))
+    return out
+
+def env_identity() -> ClientIdentity:
+    return ClientIdentity(os.environ.get("SPE_LOADGEN_CLIENT_CERT", ""),
+                          os.environ.get("SPE_LOADGEN_CLIENT_CERTSIG", ""),
+                          os.environ.get("SPE_LOADGEN_CLIENT_PRIV", ""))
+
+
+# Payloads
+def replay_bodies(path: str, batch: int) -> List[bytes]:
+    """Request bodies from a recorded JSONL file; bare items are grouped `batch` at a time."""
+    bodies, loose = [], []
+    with open(path, encoding="utf-8") as fh:
+        for n, line in enumerate(fh, 1):
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            if isinstance(obj, dict) and isinstance(obj.get("items"), list):
+                bodies.append(json.dumps({"items": obj["items"]}, ensure_ascii=False).encode())
+            elif isinstance(obj, dict):
+                loose.append(obj)
+            else:
+                raise SystemExit(f"{path}:{n}: expected a request body or an item object.")
+    for i in range(0, len(loose), batch):
+        bodies.append(json.dumps({"items": loose[i:i + batch]}, ensure_ascii=False).encode())
+    if not bodies:
+        raise SystemExit(f"{path} holds no requests.")
+    return bodies
+
+def synthetic_bodies(batch: int, count: int = 64, seed: int = 1) -> List[bytes]:
+    return [json.dumps({"items": make_corpus(batch, seed=seed + i)}, ensure_ascii=False).encode()
+            for i in range(count)]
+
+
+# Arrivals
+def arrivals(rate: float, kind: str, seed: int) -> Iterator[float]:
+    """Scheduled start offsets in seconds: every 1/rate, or exponential gaps for Poisson."""
+    rng = random.Random(seed)
+    t = 0.0
+    while True:
+        yield t
+        t += rng.expovariate(rate) if kind == "poisson" else 1.0 / rate
+
+
+# One request
+class Failure(Exception):
+    """A request that did not produce a verified, complete answer; `kind` keys the error breakdown."""
+
+    def __init__(self, kind: str, message: str = ""):
+        super().__init__(message or kind)
+        self.kind = kind
+
+def verify_stream(data: bytes, headers: Dict[str, str], anchor: str, ctx: CryptoContext) -> int:
+    """Walk the signature chain of an NDJSON response; returns the result count of its trailer."""
+    try:
+        _, pub = ctx.verify_server_cert(headers.get("x-spe-server-cert", ""), headers.get("x-spe-server-certsig", ""))
+    except ValueError as e:
+        raise Failure("bad_signature", str(e))
+    prev, final = anchor, None
+    for line in data.decode("utf-8").splitlines():
+        cut = line.rfind(',"sig":"')
+        if cut < 0 or not line.endswith('"}'):
+            raise Failure("bad_signature", "stream line without a signature")
+        chunk, sig = line[:cut] + "}", line[cut + 8:-2]
+        try:
+            pub.verify(b64u_decode(sig), f"{PATH}\n{prev}\n{chunk}".encode())
+        except InvalidSignature:
+            raise Failure("bad_signature", "broken stream signature chain")
+        prev, final = sig, json.loads(chunk)
+    if final is None or not final.get("done"):
+        raise Failure("truncated", "stream ended without its trailer")
+    if not final.get("ok"):
+        raise Failure("overloaded" if "retry_after" in final else "stream_error", str(final.get("error")))
+    return int(final.get("count", 0))
+
+def send(pool: BackendPool, identity: ClientIdentity, body: bytes, accept: str, sig_mode: str,
+         token: str, ctx: CryptoContext) -> int:
+    """POST one signed batch and verify the answer; returns the number of results."""
+    headers = {"Content-Type": "application/json", "Accept": ACCEPT[accept]}
+    headers.update(identity.request_headers(PATH, body, sig_mode))
+    if token:
+        headers["X-API-Token"] = token
+    try:
+        status, resp_headers, data = pool.request("POST", PATH, body, headers)
+    except (socket.timeout, TimeoutError):
+        raise Failure("timeout")
+    except (OSError, http.client.HTTPException) as e:
+        raise Failure("connect", str(e))
+
+    if accept == "ndjson" and status == 200:
+        return verify_stream(data, resp_headers, headers["X-SPE-Client-Sig"], ctx)
+    if status != 200:
+        # FastAPI's own errors (403, 422, 503, ...) are not signed; keep their detail for the report
+        raise Failure(f"http_{status}", data[:200].decode("utf-8", "replace"))
+    try:
+        verify_server_response(PATH, data, resp_headers, ctx)
+    except ValueError as e:
+        raise Failure("bad_signature", str(e))
+    if accept == "columnar":
+        ok, results = columnar.decode_results(data)
+    else:
+        payload = json.loads(data)
+        ok, results = payload.get("ok"), payload.get("results")
+    if not ok:
+        raise Failure("not_ok")
+    return len(results)
+
+
+# Driver
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def _latency(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ms = [v * 1000.0 for v in values]
+    return {"p50": round(_percentile(ms, 0.5), 1), "p90": round(_percentile(ms, 0.9), 1),
+            "p99": round(_percentile(ms, 0.99), 1), "max": round(max(ms), 1),
+            "mean": round(statistics.fmean(ms), 1)}
+
+def run(url: str, identities: List[ClientIdentity], bodies: List[bytes], rate: float = 10.0,
+        duration: float = 30.0, requests: int = 0, concurrency: int = 16, arrival: str = "poisson",
+        accept: str = "json", sig_mode: str = SIG_MODE_RAW, token: str = "", timeout: float = 60.0,
+        ctx: Optional[CryptoContext] = None, seed: int = 1) -> Dict[str, object]:
+    ctx = ctx or CryptoContext()
+    pool = BackendPool(url, size=concurrency, timeout=timeout)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="spe-loadgen")
+    lock = threading.Lock()
+    slots = threading.Semaphore(concurrency)
+    lat: Dict[str, List[float]] = defaultdict(list)
+    waits: List[float] = []
+    errors: Counter = Counter()
+    samples: Dict[str, str] = {}
+    items = 0
+
+    def one(n: int, due: float) -> None:
+        nonlocal items
+        started = time.perf_counter()
+        identity = identities[n % len(identities)]
+        client = json.loads(identity.cert_json).get("id", "?")
+        try:
+            count = send(pool, identity, bodies[n % len(bodies)], accept, sig_mode, token, ctx)
+        except Failure as e:
+            with lock:
+                errors[e.kind] += 1
+                samples.setdefault(e.kind, str(e))
+        except ValueError as e:
+            with lock:
+                errors["bad_response"] += 1
+                samples.setdefault("bad_response", str(e))
+        else:
+            done = time.perf_counter()
+            with lock:
+                lat[client].append(done - due)
+                waits.append(started - due)
+                items += count
+        finally:
+            if rate <= 0:
+                slots.release()
+
+    t0 = time.perf_counter()
+    deadline = t0 + duration if duration > 0 else float("inf")
+    sent = 0
+    futures = []
+    schedule = arrivals(rate, arrival, seed) if rate > 0 else itertools.repeat(0.0)
+    try:
+        for offset in schedule:
+            if requests and sent >= requests:
+                break
+            if rate > 0:
+                due = t0 + offset
+                if due >= deadline:
+                    break
+                pause = due - time.perf_counter()
+                if pause > 0:
+                    time.sleep(pause)
+            else:
+                slots.acquire()
+                due = time.perf_counter()
+                if due >= deadline:
+                    slots.release()
+                    break
+            futures.append(executor.submit(one, sent, due))
+            sent += 1
+        for fut in futures:
+            fut.result()
+    except KeyboardInterrupt:
+        executor.shutdown(wait=False, cancel_futures=True)
+    finally:
+        executor.shutdown(wait=True)
+        pool.close()
+    elapsed = time.perf_counter() - t0
+
+    all_lat = [v for vs in lat.values() for v in vs]
+    return {
+        "url": url,
+        "arrival": arrival if rate > 0 else "closed",
+        "offered_rps": rate,
+        "concurrency": concurrency,
+        "accept": accept,
+        "sig_mode": sig_mode,
+        "seconds": round(elapsed, 2),
+        "sent": sent,
+        "ok": len(all_lat),
+        "errors": dict(errors),
+        "error_samples": samples,
+        "requests_per_s": round(len(all_lat) / elapsed, 2) if elapsed else 0.0,
+        "items_per_s": round(items / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": _latency(all_lat),
+        "slot_wait_ms": _latency(waits),
+        "clients": {c: {"ok": len(vs), **_latency(vs)} for c, vs in sorted(lat.items())} if len(lat) > 1 else {},
+    }
+
+
+# CLI (python -m loadgen ...)
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("url", help="base URL of the API, e.g. http://127.0.0.1:8000")
+    ap.add_argument("--rate", type=float, default=10.0, help="requests per second; 0 = closed loop")
+    ap.add_argument("--arrival", choices=("poisson", "constant"), default="poisson")
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds to offer load for (0 = no limit)")
+    ap.add_argument("--requests", type=int, default=0, help="stop after this many requests (0 = no limit)")
+    ap.add_argument("--concurrency", type=int, default=16, help="requests in flight at most")
+    ap.add_argument("--replay", metavar="JSONL", help="recorded request bodies or items to replay")
+    ap.add_argument("--batch", type=int, default=50, help="items per synthetic request, or per group of bare items")
+    ap.add_argument("--accept", choices=sorted(ACCEPT), default="json")
+    ap.add_argument("--sig-mode", choices=SIG_MODES, default=SIG_MODE_RAW)
+    ap.add_argument("--ca-priv", default=os.environ.get("SPE_LOADGEN_CA_PRIV", ""),
+                    help="CA private key (test CAs only) to mint client identities from")
+    ap.add_argument("--ca-pub", default="", help="CA public key to verify the server with (default: ca_helpers')")
+    ap.add_argument("--clients", type=int, default=1, help="identities to mint and rotate with --ca-priv")
+    ap.add_argument("--token", default=os.environ.get("SPE_LOADGEN_TOKEN", ""), help="X-API-Token value")
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = ap.parse_args(argv)
+
+    if args.ca_priv:
+        identities = mint_identities(args.ca_priv, max(1, args.clients))
+        ca_sk = Ed25519PrivateKey.from_private_bytes(b64u_decode(args.ca_priv))
+        ca_pub = args.ca_pub or b64u(ca_sk.public_key().public_bytes(
+            encoding=serialization.Encoding.Raw, format=serialization.PublicFormat.Raw))
+    else:
+        identities = [env_identity()]
+        ca_pub = args.ca_pub
+    ctx = CryptoContext(ca_pub_b64=ca_pub) if ca_pub else CryptoContext()
+    bodies = (replay_bodies(args.replay, max(1, args.batch)) if args.replay
+              else synthetic_bodies(max(1, args.batch), seed=args.seed))
+
+    report = run(args.url, identities, bodies, rate=max(0.0, args.rate), duration=args.duration,
+                 requests=args.requests, concurrency=max(1, args.concurrency), arrival=args.arrival,
+                 accept=args.accept, sig_mode=args.sig_mode, token=args.token, timeout=args.timeout,
+                 ctx=ctx, seed=args.seed)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0 if not report["errors"] else 1
+
+    print(f"{report['url']}  {report['arrival']} @ {report['offered_rps']} req/s, "
+          f"concurrency {report['concurrency']}, {report['accept']}, {report['sig_mode']} signatures")
+    print(f"sent {report['sent']}  ok {report['ok']}  in {report['seconds']} s  "
+          f"-> {report['requests_per_s']} req/s, {report['items_per_s']} items/s")
+    lat = report["latency_ms"]
+    if lat:
+        print(f"latency ms  p50 {lat['p50']}  p90 {lat['p90']}  p99 {lat['p99']}  max {lat['max']}")
+        wait = report["slot_wait_ms"]
+        print(f"waiting for a slot ms  p50 {wait['p50']}  p99 {wait['p99']}")
+    for client, c in report["clients"].items():
+        print(f"  {client:<20} ok {c['ok']:>6}  p50 {c['p50']}  p99 {c['p99']}")
+    for kind, n in sorted(report["errors"].items(), key=lambda kv: -kv[1]):
+        print(f"error {kind:<14} {n:>6}  e.g. {report['error_samples'].get(kind, '')}")
+    return 0 if not report["errors"] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
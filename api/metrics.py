@@ -0,0 +1,162 @@
+from __future__ import annotations
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+import bisect
+import threading
+import time
+
+# Latency buckets (seconds) for stage histograms, and size buckets for batch/item counts
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Optional[Dict[str, str]]) -> LabelKey:
+    return tuple(sorted((labels or {}).items()))
+
+def _fmt_labels(key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, labels: Optional[Dict[str, str]] = None) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        with self._lock:
+            self._values[_label_key(labels)] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        key = _label_key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[i] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, (list(c), t[0])) for k, (c, t) in self._values.items())
+        out = self.header()
+        for key, (counts, total) in items:
+            cum = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cum += n
+                out.append(f"{self.name}_bucket{_fmt_labels(key, [('le', _fmt_value(bound))])} {cum}")
+            out.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_value(total)}")
+            out.append(f"{self.name}_count{_fmt_labels(key)} {cum}")
+        return out
+
+
+class Registry:
+    """A small Prometheus text-format (0.0.4) registry; no client library needed."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _add(self, metric: _Metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._add(Counter(name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self._add(Gauge(name, help))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("spe_stage_seconds", "Time spent per processing stage.")
+REQUESTS = REGISTRY.counter("spe_requests_total", "Requests handled, by endpoint and status code.")
+ITEMS = REGISTRY.counter("spe_items_total", "Items analyzed.")
+SPANS = REGISTRY.counter("spe_spans_total", "Distinct spans submitted for scoring.")
+TOKENS = REGISTRY.counter("spe_tokens_total", "Tokens in spans sent to the model.")
+BATCH_SPANS = REGISTRY.histogram("spe_batch_spans", "Spans per model forward batch.", SIZE_BUCKETS)
+REQUEST_ITEMS = REGISTRY.histogram("spe_request_items", "Items per analyze request.", SIZE_BUCKETS)
+
+
+# Per-request stage breakdown (for the X-SPE-Timing header); None when nobody asked for it
+_request_timing: ContextVar[Optional[Dict[str, float]]] = ContextVar("spe_request_timing", default=None)
+
+def start_request_timing() -> Dict[str, float]:
+    timing: Dict[str, float] = {}
+    _request_timing.set(timing)
+    return timing
+
+def observe_stage(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, {"stage": stage})
+    timing = _request_timing.get()
+    if timing is not None:
+        timing[stage] = timing.get(stage, 0.0) + seconds
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - t0)
+
+def timing_header(timing: Dict[str, float]) -> str:
+    """Server-Timing style breakdown in milliseconds: 'verify;dur=0.21, preprocess;dur=3.40'."""
+    return ", ".join(f"{k};dur={v * 1000:.2f}" for k, v in timing.items())
@@ -0,0 +1,241 @@
+"""
+Near-duplicate reuse: templated comments borrow the span probabilities of a
+representative already scored, instead of going through the model again.
+
+Students often paste the same peer comment for every teammate with only a name
+or a word changed; the exact-match span cache misses every variant. Each
+eligible plan is reduced to the word unigrams and bigrams of its preprocessed
+text (tx2, after phrase rewriting and negation scoping), a MinHash signature of
+those shingles is bucketed by LSH bands, and a candidate is accepted when the
+exact Jaccard similarity of the shingle sets reaches `threshold`.
+
+Reuse is only allowed between texts with the same guard: toxic flag, phrase
+tokens, NOT_ negation marks, sentence count, contrast split and which span
+keys repeat. The reusing
+item maps the representative's probabilities onto its own spans, sentence by
+sentence, and is then finished as usual (target bias, disparity) with engine
+"neardup". Representatives come from the same batch or from recent ones (the
+last `capacity` representatives scored in this process).
+
+`audit_rate` sends that share of reusing items (picked by a hash of the text)
+through the model as well, to measure how often the two labels agree.
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+import hashlib
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from textnorm import NEGATION_MARK_RE
+
+Probs = Dict[str, float]
+
+# MinHash signature length and LSH bands (rows per band = NUM_PERM // BANDS)
+NUM_PERM = 64
+BANDS = 16
+# Universal hashing modulo a Mersenne prime; shingle hashes are 32-bit so a * x fits in uint64
+_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(0x5BE)
+_A = _rng.randint(1, _PRIME, size=NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, _PRIME, size=NUM_PERM).astype(np.uint64)
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text: str) -> FrozenSet[int]:
+    """CRC-32 hashes of the lower-cased word unigrams and bigrams of `text` (stable across processes)."""
+    words = _WORD_RE.findall(text.lower())
+    grams = words + [a + " " + b for a, b in zip(words, words[1:])]
+    return frozenset(map(zlib.crc32, (g.encode() for g in grams)))
+
+def minhash(sh: FrozenSet[int]) -> np.ndarray:
+    x = np.fromiter(sh, dtype=np.uint64, count=len(sh))
+    return ((_A[:, None] * x[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+def jaccard(a: FrozenSet[int], b: FrozenSet[int]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def plan_spans(plan: Dict[str, object]) -> List:
+    """The plan's span keys in stored order: whole, sentences, then front and tail if split."""
+    spans = [plan["k_whole"]] + list(plan["k_sentences"])
+    if plan["k_tail"] is not None:
+        spans += [plan["k_front"], plan["k_tail"]]
+    return spans
+
+def repeat_pattern(spans: List) -> Tuple[int, ...]:
+    """Position of each span key's first occurrence, e.g. a repeated sentence or a one-sentence whole."""
+    first: Dict[object, int] = {}
+    return tuple(first.setdefault(k, i) for i, k in enumerate(spans))
+
+def guard_key(plan: Dict[str, object]) -> Tuple:
+    """Everything that must match exactly before two plans may share probabilities."""
+    # Spans are looked up by key, so repeated keys must sit at the same positions in both plans
+    return (plan["toxic"], tuple(plan["matched"]), tuple(NEGATION_MARK_RE.findall(plan["tx2"])),
+            len(plan["k_sentences"]), plan["k_tail"] is not None, repeat_pattern(plan_spans(plan)))
+
+
+class Entry:
+    """A representative: its shingles, guard and (once scored) probabilities in plan_spans order."""
+
+    __slots__ = ("shingles", "guard", "bands", "probs")
+
+    def __init__(self, sh: FrozenSet[int], guard: Tuple):
+        self.shingles = sh
+        self.guard = guard
+        # LSH bucket keys: band number, guard and that band's rows of the signature
+        sig = minhash(sh).astype(np.uint32).tobytes()
+        g, w = hash(guard), len(sig) // BANDS
+        self.bands: List[Tuple] = [(b, g, sig[b * w:(b + 1) * w]) for b in range(BANDS)]
+        self.probs: Optional[List[Probs]] = None
+
+    def scored_for(self, plan: Dict[str, object]) -> Dict[object, Probs]:
+        """
+        The representative's probabilities keyed by the reusing plan's own spans,
+        position by position; the guard's repeat pattern makes repeated keys agree.
+        """
+        return {k: dict(p) for k, p in zip(plan_spans(plan), self.probs)}
+
+
+class _Buckets:
+    """LSH band buckets over entries, oldest first; `capacity` 0 means unbounded."""
+
+    def __init__(self, capacity: int = 0):
+        self.capacity = capacity
+        self.entries: "OrderedDict[int, Entry]" = OrderedDict()
+        self.buckets: Dict[Tuple, List[int]] = {}
+        self._next = 0
+
+    def find(self, entry: Entry, threshold: float) -> Optional[Entry]:
+        seen = set()
+        best, best_sim = None, threshold
+        for band in entry.bands:
+            for eid in self.buckets.get(band, ()):
+                if eid in seen:
+                    continue
+                seen.add(eid)
+                other = self.entries[eid]
+                if other.guard != entry.guard:
+                    continue
+                sim = jaccard(entry.shingles, other.shingles)
+                if sim >= best_sim:
+                    best, best_sim = eid, sim
+        if best is None:
+            return None
+        self.entries.move_to_end(best)
+        return self.entries[best]
+
+    def add(self, entry: Entry) -> None:
+        eid, self._next = self._next, self._next + 1
+        self.entries[eid] = entry
+        for band in entry.bands:
+            self.buckets.setdefault(band, []).append(eid)
+        while self.capacity and len(self.entries) > self.capacity:
+            old_id, old = self.entries.popitem(last=False)
+            for band in old.bands:
+                ids = self.buckets[band]
+                ids.remove(old_id)
+                if not ids:
+                    del self.buckets[band]
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.buckets.clear()
+
+
+class NearDupIndex:
+    """
+    Decide, per batch of plans, which items reuse a representative's scores.
+
+    assign() runs after planning: a reusing plan gets plan["neardup"] (its
+    Entry) and, unless audited, no spans to score; a new representative gets
+    plan["neardup_rep"]. learn() runs once the spans are scored: it fills the
+    representatives' probabilities and adds them to the shared index.
+    """
+
+    def __init__(self, threshold: float = 0.0, min_words: int = 6, capacity: int = 20000,
+                 audit_rate: float = 0.0):
+        self.threshold = threshold
+        self.min_words = min_words
+        self.audit_rate = audit_rate
+        self._index = _Buckets(capacity)
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"reused": 0, "representatives": 0, "audited": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def _eligible(self, plan: Dict[str, object]) -> bool:
+        return bool(plan["spans"]) and "cascade" not in plan and plan["wc"] >= self.min_words
+
+    def sampled(self, text: str) -> bool:
+        if self.audit_rate <= 0:
+            return False
+        if self.audit_rate >= 1:
+            return True
+        h = int.from_bytes(hashlib.sha1(text.encode()).digest()[:4], "big")
+        return h / 2 ** 32 < self.audit_rate
+
+    def assign(self, plans: List[Dict[str, object]]) -> int:
+        """Mark reusing plans and representatives; returns how many plans reuse scores."""
+        if not self.enabled:
+            return 0
+        batch = _Buckets()
+        reused = reps = audited = 0
+        for plan in plans:
+            if not self._eligible(plan):
+                continue
+            sh = shingles(plan["tx2"])
+            if not sh:
+                # No words to compare (and no MinHash signature of an empty set)
+                continue
+            entry = Entry(sh, guard_key(plan))
+            with self._lock:
+                found = self._index.find(entry, self.threshold)
+            found = found or batch.find(entry, self.threshold)
+            if found is None:
+                batch.add(entry)
+                plan["neardup_rep"] = entry
+                reps += 1
+                continue
+            plan["neardup"] = found
+            reused += 1
+            # Audited items are scored by the model too; the rest skip it
+            plan["audit"] = self.sampled(plan["tx"])
+            if plan["audit"]:
+                audited += 1
+            else:
+                plan["spans"] = []
+        with self._lock:
+            self.counters["reused"] += reused
+            self.counters["representatives"] += reps
+            self.counters["audited"] += audited
+        return reused
+
+    def learn(self, plans: List[Dict[str, object]], scored: Dict[object, Probs]) -> None:
+        """Store the scored probabilities of this batch's representatives for later batches."""
+        fresh = []
+        for plan in plans:
+            entry = plan.get("neardup_rep")
+            if entry is not None and entry.probs is None:
+                entry.probs = [dict(scored[k]) for k in plan_spans(plan)]
+                fresh.append(entry)
+        if fresh:
+            with self._lock:
+                for entry in fresh:
+                    self._index.add(entry)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters, entries=len(self._index.entries))
+
+    def clear(self) -> int:
+        """Forget every representative (e.g. after the model changed); returns how many there were."""
+        with self._lock:
+            n = len(self._index.entries)
+            self._index.clear()
+            return n
@@ -0,0 +1,255 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Sequence, Tuple
+import re
+
+try:
+    from re import _parser as _sre_parse, _constants as _sre_c
+except ImportError:  # Python < 3.11
+    import sre_parse as _sre_parse, sre_constants as _sre_c
+
+# Phrase patterns
+PHRASE_PATTERNS: Dict[str, str] = {
+    r"\b(can\s+)?create\s+challenges\b": "create_challenges",
+    r"\b(dominate|dominates|dominating)\s+discussions?\b": "dominate_discussions",
+    r"\brush\s+through\s+tasks?\b": "rush_through_tasks",
+    r"\bminor\s+misunderstandings?\b": "minor_misunderstandings",
+    r"\b(in)?consistenc(y|ies)\b": "inconsistencies",
+    r"\bstrong\s+opinions\b": "strong_opinions",
+    r"\btime\s+management\s+could\s+improve\b": "time_mgmt_could_improve",
+    r"\bdelays?\s+in\s+completing\b": "delays_in_completing",
+    r"\baffect(s|ed)?\s+overall\s+progress\b": "affects_overall_progress",
+    r"\bneeds?\s+improvement\b": "needs_improvement",
+    r"\broom\s+for\s+improvement\b": "room_for_improvement",
+    r"\bdid\s+most\s+of\s+the\s+work(\s+(for|within)\s+(the\s+)?(team|group))?\b": "did_most_of_work",
+    r"\bi\s+did\s+a\s+lot\s+(for|of)\s+(the\s+)?team\b": "did_a_lot_for_team",
+    r"\bgood\s+job\b": "good_job",
+    r"\bdid\s+not\s+do\s+much(\s+at\s+all)?\b": "did_not_do_much",
+    r"\bdid\s+not\s+contribut(e|ed)\s+at\s+all\b": "did_not_contribute_at_all",
+    r"\b(does|did)\s+most\s+of\s+(?:the\s+)?project\b": "did_most_of_project",
+    r"\b(does|did)\s+most\s+of\s+(?:the\s+)?project\b.*\b(coding|code)\b": "did_most_of_project_coding",
+    r"\b(does|did)\s+most\s+of\s+(?:the\s+)?(?:(?:project|group)\s+)?(?:work|tasks?)\b": "did_most_of_work",
+    r"\b(does|did)\s+most\s+of\s+(?:the\s+)?job\b": "did_most_of_job",
+    r"\b(does|did)\s+most\s+of\s+(?:the\s+)?reports?\b": "did_most_of_reports",
+    r"\b(does|did)\s+most\s+of\s+(?:the\s+)?presentation\s+slides?\b": "did_most_of_slides",
+    r"\b(does|did)\s+only\s+(?:about\s+)?(\d{1,3})\s*%\s+(?:of\s+)?(?:the\s+)?(?:(?:project|group)\s+)?(?:work|tasks?)\b": "did_only_pct_work_\\2",
+    r"\bonly\s+(?:about\s+)?(\d{1,3})\s*%\s+(?:done|completed|work|project|tasks?)\b": "did_only_pct_work_\\1",
+    r"\b(does|did)\s+(?:about\s+)?(\d{1,3})\s*%\s+(?:of\s+)?(?:the\s+)?(?:(?:project|group)\s+)?(?:work|tasks?)\b": "did_pct_work_\\2",
+    r"\balways\s+not\s+available\b": "always_not_available",
+    r"\b(always\s+)?un(contactable|contactable)\b": "always_uncontactable",
+    r"\b(always\s+)?(unavailable|not\s+available)\b": "always_unavailable",
+    r"\b(absent|no[-\s]?show|no\s+shows?)\b": "absenteeism",
+    r"\bnon[-\s]?responsive\b": "unresponsive",
+    r"\b(always|often)\s+late\b": "often_late",
+    r"\bcontribut(?:ed|es|ing)?\s+in\s+(?:planning\s+)?meetings?\b": "contributed_in_meetings",
+}
+
+# Functions for dynamic percentage tokens
+DYN_PCT_RE = re.compile(r"\bdid_only_pct_work_(\d{1,3})\b|\bdid_pct_work_(\d{1,3})\b")
+def _apply_dynamic_pct_tokens(text: str) -> List[str]:
+    matched = []
+    for m in re.finditer(r"\bdid_only_pct_work_(\d{1,3})\b", text):
+        matched.append(m.group(0))
+    for m in re.finditer(r"\bdid_pct_work_(\d{1,3})\b", text):
+        matched.append(m.group(0))
+    return matched
+
+# Reference implementation: one re.sub per rule, in table order
+def preprocess_phrases_sequential(text: str) -> Tuple[str, List[str]]:
+    for pat, token in PHRASE_PATTERNS.items():
+        text = re.sub(pat, token, text, flags=re.IGNORECASE)
+    dyn = _apply_dynamic_pct_tokens(text)
+    return text, dyn
+
+def matched_tokens_sequential(text: str, dyn: List[str]) -> List[str]:
+    """Tokens the old pipeline reported: every rule token or dynamic token found in the text."""
+    return [t for t in set(list(PHRASE_PATTERNS.values()) + dyn) if t in text]
+
+
+def _required_literals(parsed) -> Optional[List[str]]:
+    """
+    Literal strings of which every match of `parsed` must contain at least one
+    (lowercased), or None when no such set can be derived. Picks the most
+    selective candidate, i.e. the one whose shortest literal is longest.
+    """
+    candidates: List[List[str]] = []
+    run: List[str] = []
+
+    def flush():
+        if run:
+            candidates.append(["".join(run)])
+            run.clear()
+
+    for op, av in parsed:
+        if op is _sre_c.LITERAL:
+            run.append(chr(av).lower())
+            continue
+        flush()
+        sub = None
+        if op is _sre_c.SUBPATTERN:
+            sub = _required_literals(av[-1])
+        elif op is _sre_c.BRANCH:
+            parts = [_required_literals(b) for b in av[1]]
+            if all(parts):
+                sub = list(dict.fromkeys(x for part in parts for x in part))
+        elif op in (_sre_c.MAX_REPEAT, _sre_c.MIN_REPEAT) and av[0] >= 1:
+            sub = _required_literals(av[2])
+        if sub:
+            candidates.append(sub)
+    flush()
+
+    if not candidates:
+        return None
+    return max(candidates, key=lambda c: (min(len(x) for x in c), -len(c)))
+
+
+def _first_chars(parsed) -> Optional[set]:
+    """Lowercase characters a match of `parsed` can start with, or None if unbounded."""
+    chars: set = set()
+    for op, av in parsed:
+        if op is _sre_c.AT:
+            continue
+        if op is _sre_c.LITERAL:
+            return chars | {chr(av).lower()}
+        if op is _sre_c.SUBPATTERN:
+            sub = _first_chars(av[-1])
+            optional = False
+        elif op is _sre_c.BRANCH:
+            subs = [_first_chars(b) for b in av[1]]
+            sub = None if any(x is None for x in subs) else set().union(*subs)
+            optional = False
+        elif op in (_sre_c.MAX_REPEAT, _sre_c.MIN_REPEAT):
+            sub = _first_chars(av[2])
+            optional = av[0] == 0
+        else:
+            return None
+        if sub is None:
+            return None
+        chars |= sub
+        if not optional:
+            return chars
+    return None
+
+
+class PhraseMatcher:
+    """
+    All phrase rules compiled into one alternation, applied in a single pass.
+
+    Every rule becomes a named alternative in table order, so where two rules
+    could match at the same position the earlier one wins, as it did when the
+    rules were applied one after another. Rule tokens are word runs bounded by
+    \\b, so a replacement can never create or break a match for a later rule.
+    The callback records each emitted token, which replaces the separate
+    percentage-token rescan and the substring search over the whole table.
+
+    For ASCII text a keyword front filter (plain substring checks on the
+    lowercased text, derived from each rule's mandatory literals) skips the
+    regex engine entirely when no rule can match, and the scan itself runs
+    case-sensitively over the lowercased text behind a first-character gate.
+    """
+
+    def __init__(self, patterns: Dict[str, str]):
+        self._rules: List[Tuple[str, str, Optional[List[str]]]] = []
+        for pat, token in patterns.items():
+            self._rules.append((pat, token, _required_literals(_sre_parse.parse(pat))))
+        everything = tuple(range(len(self._rules)))
+        self._full = self._compile(everything, re.IGNORECASE)
+        # Patterns are lowercase, so the lowercased text can be matched without IGNORECASE;
+        # a first-character lookahead lets the engine skip positions no rule can start at
+        starts = [_first_chars(_sre_parse.parse(pat)) for pat, _, _ in self._rules]
+        gate, strip_b = "", False
+        if all(starts):
+            first = sorted(set().union(*starts))
+            gate = "(?=[" + "".join(re.escape(c) for c in first) + "])"
+            # Every rule opens with \b before a word character: check that once, up front
+            if all(pat.startswith(r"\b") for pat, _, _ in self._rules) and all(c.isalnum() for c in first):
+                gate, strip_b = r"(?<!\w)" + gate, True
+        self._fast = self._compile(everything, 0, prefix=gate, strip_b=strip_b)
+
+        self._all_tokens = list(dict.fromkeys(patterns.values()))
+        self._static_tokens = [t for t in self._all_tokens if "\\" not in t]
+        # Static tokens contained in each emitted token (e.g. did_most_of_project in ..._coding)
+        self._contained = {t: [u for u in self._static_tokens if u in t] for t in self._static_tokens}
+        # Texts that could already contain a token verbatim: any "_" or an underscore-free token
+        bare = [re.escape(t) for t in self._static_tokens if "_" not in t]
+        self._literal_hint = re.compile("_|" + "|".join(bare))
+
+    def _compile(self, active: Sequence[int], flags: int = 0, prefix: str = "", strip_b: bool = False):
+        parts: List[str] = []
+        templates: Dict[str, str] = {}
+        group = 1
+        for i in active:
+            pat, token, _ = self._rules[i]
+            if strip_b:
+                pat = pat[2:]
+            name = f"p{i}"
+            parts.append(f"(?P<{name}>{pat})")
+            offset = group
+            # Rule-local backreferences (\\2) become absolute groups in the combined pattern
+            templates[name] = re.sub(r"\\(\d+)", lambda m: f"\\g<{offset + int(m.group(1))}>", token)
+            group += 1 + re.compile(pat).groups
+        return re.compile(prefix + "(?:" + "|".join(parts) + ")", flags), templates
+
+    def _rewrite(self, text: str, scan: str, regex, templates: Dict[str, str],
+                 emitted: Dict[str, None], spans: List[Tuple[int, int, str]]) -> str:
+        out: List[str] = []
+        pos = 0
+        for m in regex.finditer(scan):
+            token = m.expand(templates[m.lastgroup])
+            emitted[token] = None
+            spans.append((m.start(), m.end(), token))
+            out.append(text[pos:m.start()])
+            out.append(token)
+            pos = m.end()
+        if not out:
+            return text
+        out.append(text[pos:])
+        return "".join(out)
+
+    def apply(self, text: str) -> Tuple[str, List[str]]:
+        """Return the rewritten text and the matched tokens, in first-seen order."""
+        out, matched, _ = self.apply_with_spans(text)
+        return out, matched
+
+    def apply_with_spans(self, text: str) -> Tuple[str, List[str], List[Tuple[int, int, str]]]:
+        """Like apply, plus the (start, end, token) of every replacement in the input text."""
+        emitted: Dict[str, None] = {}
+        spans: List[Tuple[int, int, str]] = []
+
+        if text.isascii():
+            low = text.lower()
+            out = text
+            if any(kws is None or any(k in low for k in kws) for _, _, kws in self._rules):
+                regex, templates = self._fast
+                out = self._rewrite(text, low, regex, templates, emitted, spans)
+        else:
+            # Unicode case folding is wider than str.lower(); use the full case-insensitive pattern
+            regex, templates = self._full
+            out = self._rewrite(text, text, regex, templates, emitted, spans)
+
+        if self._literal_hint.search(text) is not None:
+            # Rare: the input already contains token-like text; report exactly what the old scan did
+            dyn = [m.group(0) for m in DYN_PCT_RE.finditer(out)]
+            found = dict.fromkeys(t for t in emitted if t in out)
+            for t in self._all_tokens + dyn:
+                if t in out:
+                    found[t] = None
+            return out, list(found), spans
+
+        found: Dict[str, None] = {}
+        for t in emitted:
+            for u in self._contained.get(t, (t,)):
+                found[u] = None
+            found[t] = None
+        return out, list(found), spans
+
+
+_matcher = PhraseMatcher(PHRASE_PATTERNS)
+
+# Phrase preprocessing
+def preprocess_phrases(text: str) -> Tuple[str, List[str]]:
+    """Apply every phrase rule in one pass; returns (text, matched tokens)."""
+    return _matcher.apply(text)
+
+def preprocess_phrases_spans(text: str) -> Tuple[str, List[str], List[Tuple[int, int, str]]]:
+    """preprocess_phrases plus the (start, end, token) of each replacement."""
+    return _matcher.apply_with_spans(text)
@@ -0,0 +1,108 @@
+from __future__ import annotations
+from typing import Callable, Dict, Optional
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+
+def default_threads(workers: int) -> int:
+    """Intra-op threads per worker so that workers x threads does not exceed the cores."""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class PreforkServer:
+    """
+    Pre-fork launcher: the parent prepares shared state (the model), binds one
+    listening socket and forks `workers` uvicorn servers that accept on it.
+
+    Everything the parent built before the fork is shared copy-on-write; gc.freeze()
+    keeps the collector from touching (and so copying) those pages in the children.
+    The parent only supervises: it restarts workers that die and forwards
+    SIGINT/SIGTERM to all of them on shutdown.
+    """
+
+    def __init__(self, app, host: str, port: int, workers: int,
+                 after_fork: Optional[Callable[[int], None]] = None,
+                 log_level: str = "info"):
+        if not hasattr(os, "fork"):
+            raise RuntimeError("Pre-fork mode needs os.fork (not available on this platform).")
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.after_fork = after_fork
+        self.log_level = log_level
+        self.log = logging.getLogger("uvicorn")
+        self._children: Dict[int, int] = {}
+        self._stopping = False
+
+    def _spawn(self, sock: socket.socket, index: int) -> int:
+        pid = os.fork()
+        if pid:
+            self._children[pid] = index
+            return pid
+
+        # Child: default signal handling for uvicorn, then serve on the shared socket
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        code = 0
+        try:
+            if self.after_fork is not None:
+                self.after_fork(index)
+            config = uvicorn.Config(self.app, host=self.host, port=self.port,
+                                    access_log=False, log_level=self.log_level)
+            uvicorn.Server(config).run(sockets=[sock])
+        except BaseException as e:
+            self.log.error("Worker %d failed (%s).", index, str(e))
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _stop(self, signum, frame) -> None:
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> None:
+        sock = bind_socket(self.host, self.port)
+        gc.collect()
+        gc.freeze()
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+
+        for i in range(self.workers):
+            self._spawn(sock, i)
+        self.log.info("Pre-fork server on %s:%d with %d workers (parent pid %d).",
+                      self.host, self.port, self.workers, os.getpid())
+
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            index = self._children.pop(pid, None)
+            if index is None or self._stopping:
+                continue
+            self.log.warning("Worker %d (pid %d) exited with status %d; restarting.", index, pid, status)
+            time.sleep(1.0)
+            self._spawn(sock, index)
+        sock.close()
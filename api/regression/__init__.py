@@ -0,0 +1 @@
+"""Regression corpora for the text pipeline; run the checks from the api/ directory with python -m."""
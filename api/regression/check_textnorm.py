@@ -0,0 +1,114 @@
+"""
+Regression check for textnorm.normalize against the recorded corpus.
+
+    cd api && python -m regression.check_textnorm              # check the corpus
+    cd api && python -m regression.check_textnorm --fuzz 20000 # plus random texts vs the reference passes
+    cd api && python -m regression.check_textnorm --regenerate # rebuild the corpus from the reference passes
+
+The expected values in textnorm_corpus.jsonl were produced by the separate
+cap_intensifier_runs / PHRASE_PATTERNS / widen_negation_scope / is_toxic
+passes that normalize() replaces.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import random
+import sys
+
+from textnorm import normalize, normalize_reference
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "textnorm_corpus.jsonl")
+
+EDGE_CASES = [
+    "", "Good job", "good  job!", "GOOD JOB", "not good", "Not at all helpful.",
+    "He never did most of the work for the team.", "no, no, no", "never never never never",
+    "very very very very good", "Very, very very good", "really really really super helpful",
+    "very\tvery\nvery good", "super-super-super", "He is stupid", "stupidity is fine", "hate_speech",
+    "You idiot!", "IDIOT", "he did only 20% of the work", "only about 30 % done", "did 50% of the project work",
+    "does only 5% tasks but good job", "always not available and often late", "Always uncontactable.",
+    "non-responsive, no-show, absent", "noshow", "no shows all week", "minor misunderstandings happened",
+    "inconsistency in reports", "consistencies", "did most of the project and the coding",
+    "does most of presentation slides", "I did a lot for the team", "i did a lot of team work",
+    "contributed in planning meetings; time management could improve", "needs improvement, room for improvement",
+    "Dominates discussions and has strong opinions.", "can create challenges that affect overall progress",
+    "delays in completing tasks affected overall progress", "rush through tasks",
+    "did not do much at all", "did not contribute at all", "did not contributed at all",
+    "good_job already", "NOT_good", "x_NOT_y", "unresponsive", "absenteeism", "did_pct_work_50 typed",
+    "did_only_pct_work_\\2", "He wasn't helpful", "she doesn't reply", "hardly ever barely seldom scarcely rarely",
+    "café good job", "ſtupid", "K is a letter", "tabs\tand\nnewlines\r\nmixed", " nbsp good job",
+    "zero​width", "trailing punctuation...", "!!!", "...", "12345", "100% effort, did 100% of the work",
+    "He did 1234% work", "Not. Good. Job.", "no good job", "never good job never",
+]
+
+WORDS = (
+    "the team he she they i my me good job great work did most of project coding not never no rarely "
+    "very really super extremely but however although though yet while despite stupid hate absent "
+    "no-show non-responsive always often late unavailable uncontactable needs improvement room for time "
+    "management could improve only about 50% 30 % tasks done completed group report presentation slides "
+    "contributed in planning meetings minor misunderstandings inconsistency strong opinions dominate "
+    "discussions rush through create challenges can affects overall progress delays completing much at "
+    "all contribute a lot . ! ? , ; helpful lazy NOT_ _ café"
+).split()
+
+def generated(n: int, seed: int):
+    rng = random.Random(seed)
+    for _ in range(n):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(1, 30))]
+        text = "".join(w + rng.choice((" ", " ", " ", "  ", ", ", "\t", "")) for w in words)
+        if rng.random() < 0.2:
+            text = text.upper()
+        yield text
+
+def _canon(result: dict) -> dict:
+    out = dict(result)
+    out["matched"] = sorted(set(out["matched"]))
+    return out
+
+def expected_for(text: str) -> dict:
+    return _canon(normalize_reference(text.strip()))
+
+def regenerate(path: str) -> int:
+    n = 0
+    with open(path, "w", encoding="utf-8") as fh:
+        for text in list(EDGE_CASES) + list(generated(250, seed=2024)):
+            fh.write(json.dumps({"text": text, "expected": expected_for(text)}, ensure_ascii=False) + "\n")
+            n += 1
+    print(f"wrote {n} cases to {path}")
+    return 0
+
+def check(path: str, fuzz: int) -> int:
+    failures = 0
+    total = 0
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            case = json.loads(line)
+            total += 1
+            got = _canon(normalize(case["text"].strip()))
+            if got != case["expected"]:
+                failures += 1
+                if failures <= 5:
+                    print("MISMATCH", json.dumps(case["text"]), "\n  expected", case["expected"], "\n  got     ", got)
+
+    for text in generated(fuzz, seed=random.randrange(1 << 30)):
+        total += 1
+        if _canon(normalize(text.strip())) != expected_for(text):
+            failures += 1
+            if failures <= 5:
+                print("FUZZ MISMATCH", json.dumps(text))
+
+    print(f"{total - failures}/{total} cases identical")
+    return 1 if failures else 0
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="textnorm regression corpus")
+    ap.add_argument("--corpus", default=CORPUS)
+    ap.add_argument("--fuzz", type=int, default=0, help="also compare N random texts against the reference passes")
+    ap.add_argument("--regenerate", action="store_true")
+    args = ap.parse_args(argv)
+    if args.regenerate:
+        return regenerate(args.corpus)
+    return check(args.corpus, args.fuzz)
+
+if __name__ == "__main__":
+    sys.exit(main())
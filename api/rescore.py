@@ -0,0 +1,229 @@
+"""
+Re-label stored results under a new policy without running the model again.
+
+Every /analyze result carries "vectors": the probabilities of the spans its
+label came from and the text facts the post-processing reads,
+
+    {"whole": [neg, neu, pos], "sentences": [[neg, neu, pos], ...],
+     "front": [...] | null, "tail": [...] | null,
+     "toxic": bool, "peer_pronoun": bool, "self_pronoun": bool}
+
+(null for an empty text, and for an item a cascade stage settled: its
+probabilities were set by a rule, not computed by the model, so there is
+nothing to replay). Items sent back with their "engine" as /analyze returned
+it are reported as not rescorable when it is "cascade:<stage>". rescore() replays finish_item's post-processing
+(contrast rebalance, label thresholds, toxic override, target bias, disparity
+bands) over a whole batch of stored vectors at once with NumPy.
+"""
+from __future__ import annotations
+from typing import Dict, List, Optional, Sequence, Tuple
+import math
+
+import numpy as np
+
+ORDER = ("negative", "neutral", "positive")
+LABELS = ("negative", "neutral", "positive", "toxic")
+NEGATIVE, NEUTRAL, POSITIVE, TOXIC = range(4)
+
+
+def as_vector(probs: Dict[str, float]) -> List[float]:
+    """Span probabilities as a stored vector, in ORDER."""
+    return [probs[k] for k in ORDER]
+
+
+class Policy:
+    """Everything finish_item decides after the model; built from sentiment_api's constants by default."""
+
+    FIELDS = ("pos_thr", "neg_thr", "contrast_front_max", "contrast_front_weight", "contrast_tail_weight",
+              "contrast_tail_cap", "peer_bias", "self_bias", "disparity_low", "disparity_high")
+
+    def __init__(self, pos_thr: float, neg_thr: float, contrast_front_max: float,
+                 contrast_front_weight: float, contrast_tail_weight: float, contrast_tail_cap: float,
+                 peer_bias: float, self_bias: float,
+                 disparity_low: Sequence[float], disparity_high: Sequence[float]):
+        self.pos_thr = float(pos_thr)
+        self.neg_thr = float(neg_thr)
+        self.contrast_front_max = float(contrast_front_max)
+        self.contrast_front_weight = float(contrast_front_weight)
+        self.contrast_tail_weight = float(contrast_tail_weight)
+        self.contrast_tail_cap = float(contrast_tail_cap)
+        self.peer_bias = float(peer_bias)
+        self.self_bias = float(self_bias)
+        self.disparity_low = self._band("disparity_low", disparity_low)
+        self.disparity_high = self._band("disparity_high", disparity_high)
+        if not self.neg_thr < self.pos_thr:
+            raise ValueError("neg_thr must be below pos_thr.")
+
+    @staticmethod
+    def _band(name: str, band: Sequence[float]) -> Tuple[float, float]:
+        if not isinstance(band, (list, tuple)) or len(band) != 2:
+            raise ValueError(f"{name} must be [min, max].")
+        lo, hi = float(band[0]), float(band[1])
+        if lo > hi:
+            raise ValueError(f"{name} must be [min, max] with min <= max.")
+        return lo, hi
+
+    def as_dict(self) -> Dict[str, object]:
+        out = {k: getattr(self, k) for k in self.FIELDS}
+        out["disparity_low"] = list(self.disparity_low)
+        out["disparity_high"] = list(self.disparity_high)
+        return out
+
+    def replace(self, overrides: Optional[Dict[str, object]]) -> "Policy":
+        """This policy with some fields changed; unknown fields or bad values raise ValueError."""
+        if not overrides:
+            return self
+        if not isinstance(overrides, dict):
+            raise ValueError("policy must be an object.")
+        unknown = sorted(set(overrides) - set(self.FIELDS))
+        if unknown:
+            raise ValueError(f"Unknown policy field(s): {', '.join(unknown)}.")
+        try:
+            return Policy(**dict(self.as_dict(), **overrides))
+        except TypeError as e:
+            raise ValueError(str(e)) from e
+
+
+# Input
+def _triple(v, what: str) -> Tuple[float, float, float]:
+    if not isinstance(v, (list, tuple)) or len(v) != 3:
+        raise ValueError(f"{what} must be [negative, neutral, positive].")
+    return float(v[0]), float(v[1]), float(v[2])
+
+def _score_total(value) -> float:
+    """Same parsing as evaluate_disparity; NaN for a missing or unreadable total (never a disparity)."""
+    if value is None:
+        return math.nan
+    try:
+        return float(value)
+    except Exception:
+        return math.nan
+
+
+# Rescoring
+def rescore(items: List[dict], policy: Policy) -> List[dict]:
+    """
+    Policy-dependent fields of each item's result ("label", "score", "compound",
+    "toxic", "sentences", "disparity", "disparity_reason", "suggest_confirm"),
+    from items {"id", "vectors", "score_total", "target", "engine", ...} as stored.
+    Cascade-settled items come back as {"id", "rescorable": false, "engine"}.
+    Raises ValueError naming the first malformed item.
+    """
+    n = len(items)
+    whole = np.zeros((n, 3))
+    front = np.zeros((n, 3))
+    tail = np.zeros((n, 3))
+    has_text = np.zeros(n, dtype=bool)
+    has_tail = np.zeros(n, dtype=bool)
+    toxic = np.zeros(n, dtype=bool)
+    peer = np.zeros(n, dtype=bool)
+    self_ = np.zeros(n, dtype=bool)
+    totals = np.full(n, math.nan)
+    sent_counts = np.zeros(n, dtype=np.int64)
+    settled = np.zeros(n, dtype=bool)
+    sents: List[Tuple[float, float, float]] = []
+
+    for i, it in enumerate(items):
+        try:
+            if not isinstance(it, dict):
+                raise ValueError("item is not an object.")
+            totals[i] = _score_total(it.get("score_total"))
+            target = it.get("target")
+            if str(it.get("engine") or "").startswith("cascade:"):
+                settled[i] = True
+                continue
+            v = it.get("vectors")
+            if v is None:
+                continue
+            if not isinstance(v, dict):
+                raise ValueError("vectors must be an object or null.")
+            has_text[i] = True
+            whole[i] = _triple(v.get("whole"), "whole")
+            if v.get("tail") is not None:
+                has_tail[i] = True
+                front[i] = _triple(v.get("front"), "front")
+                tail[i] = _triple(v.get("tail"), "tail")
+            rows = v.get("sentences") or []
+            sents.extend(_triple(s, "each sentence") for s in rows)
+            sent_counts[i] = len(rows)
+            toxic[i] = bool(v.get("toxic"))
+            peer[i] = target == "peer" and bool(v.get("peer_pronoun"))
+            self_[i] = target == "self" and bool(v.get("self_pronoun"))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Item {i}: {e}") from e
+
+    p = policy
+
+    # Contrast rebalance of the whole-text compound
+    comp = whole[:, 2] - whole[:, 0]
+    cf = front[:, 2] - front[:, 0]
+    ct = tail[:, 2] - tail[:, 0]
+    rebalance = has_tail & (cf <= p.contrast_front_max)
+    comp = np.where(rebalance,
+                    p.contrast_front_weight * cf + p.contrast_tail_weight * np.minimum(ct, p.contrast_tail_cap),
+                    comp)
+
+    def labels(score: np.ndarray) -> np.ndarray:
+        return np.where(score >= p.pos_thr, POSITIVE, np.where(score <= p.neg_thr, NEGATIVE, NEUTRAL))
+
+    # Target bias applies to positive labels of non-toxic texts naming their target
+    label = labels(np.clip((comp + 1.0) / 2.0, 0.0, 1.0))
+    bias = (np.where(peer & (label == POSITIVE), p.peer_bias, 0.0)
+            + np.where(self_ & (label == POSITIVE), p.self_bias, 0.0))
+    comp = np.where(toxic, comp, comp + bias)
+    score = np.clip((comp + 1.0) / 2.0, 0.0, 1.0)
+    label = np.where(toxic, TOXIC, labels(score))
+    score = np.where(toxic, 0.0, score)
+
+    # Empty texts are neutral whatever the policy
+    label = np.where(has_text, label, NEUTRAL)
+    score = np.where(has_text, score, 0.5)
+    comp = np.where(has_text, comp, 0.0)
+    toxic &= has_text
+
+    # Disparity bands (NaN totals compare false)
+    low = (totals >= p.disparity_low[0]) & (totals <= p.disparity_low[1]) & (label == POSITIVE)
+    high = (totals >= p.disparity_high[0]) & (totals <= p.disparity_high[1]) & ((label == NEGATIVE) | (label == TOXIC))
+
+    # Sentence compounds: mean and min per item over the flattened sentence rows
+    avg_c = np.zeros(n)
+    min_c = np.zeros(n)
+    if sents:
+        sc = np.asarray(sents)
+        sc = sc[:, 2] - sc[:, 0]
+        starts = np.concatenate(([0], np.cumsum(sent_counts)[:-1]))
+        nonempty = sent_counts > 0
+        min_c[nonempty] = np.minimum.reduceat(sc, starts[nonempty])
+        # Summed left to right like finish_item, so the means match its output bit for bit
+        flat = sc.tolist()
+        for i in np.flatnonzero(nonempty):
+            a = int(starts[i])
+            avg_c[i] = sum(flat[a:a + int(sent_counts[i])]) / int(sent_counts[i])
+
+    results = []
+    for i, it in enumerate(items):
+        if settled[i]:
+            r = {"rescorable": False, "engine": it["engine"]}
+            if "id" in it:
+                r["id"] = it["id"]
+            results.append(r)
+            continue
+        lab = LABELS[label[i]]
+        reason = None
+        if low[i]:
+            reason = f"Total score {float(totals[i]):g} is low and the comment reads {lab}."
+        elif high[i]:
+            reason = f"Total score {float(totals[i]):g} is high and the comment reads {lab}."
+        r = {
+            "label": lab,
+            "score": float(score[i]),
+            "compound": float(comp[i]),
+            "toxic": bool(toxic[i]),
+            "sentences": {"count": int(sent_counts[i]), "avg_compound": float(avg_c[i]),
+                          "min_compound": float(min_c[i])},
+            "disparity": reason is not None, "disparity_reason": reason, "suggest_confirm": reason is not None,
+        }
+        if "id" in it:
+            r["id"] = it["id"]
+        results.append(r)
+    return results
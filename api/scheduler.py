@@ -0,0 +1,125 @@
+from __future__ import annotations
+from typing import Callable, Dict, List, Optional
+import asyncio
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+
+Probs = Dict[str, float]
+
+
+class MicroBatchScheduler:
+    """
+    Runs model inference on one dedicated thread, off the event loop.
+
+    Span lists submitted by concurrent requests are merged into a shared round
+    (a request queued alone is scored at once; requests that arrive together
+    wait up to `max_wait` seconds for more, or until `max_spans` spans), the
+    round is scored with a single `run_batch` call and every request gets back
+    exactly the probabilities for its own spans, in its own order.
+    """
+
+    def __init__(self, run_batch: Callable[[List[str]], List[Probs]],
+                 max_wait: float = 0.010, max_spans: int = 4096):
+        self.run_batch = run_batch
+        self.max_wait = max_wait
+        self.max_spans = max_spans
+        # (spans, future, loop); the loop is None for submit_sync's concurrent future
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.rounds = 0
+        self.requests = 0
+
+    def _ensure_started(self) -> None:
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="spe-inference", daemon=True)
+                self._thread.start()
+
+    async def submit(self, spans: List[str]) -> List[Probs]:
+        if not spans:
+            return []
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._queue.put((spans, fut, loop))
+        return await fut
+
+    def submit_sync(self, spans: List[str]) -> List[Probs]:
+        """submit() for plain threads (job workers, bulk): blocks until the round is scored."""
+        if not spans:
+            return []
+        self._ensure_started()
+        fut: "concurrent.futures.Future[List[Probs]]" = concurrent.futures.Future()
+        self._queue.put((spans, fut, None))
+        return fut.result()
+
+    def _collect(self):
+        """
+        Block for the first request, then take whatever else is already queued. A
+        lone request runs at once; once a second one has joined, gather more until
+        the deadline or span cap.
+        """
+        first = self._queue.get()
+        pending = [first]
+        n_spans = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while n_spans < self.max_spans:
+            try:
+                nxt = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if len(pending) == 1 or remaining <= 0:
+                    break
+                try:
+                    nxt = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            pending.append(nxt)
+            n_spans += len(nxt[0])
+        return pending
+
+    @staticmethod
+    def _deliver(loop, fut, result=None, error: Optional[BaseException] = None) -> None:
+        def _set():
+            if fut.done():
+                return
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)
+        # submit_sync futures have no loop and may be completed from this thread
+        if loop is None:
+            _set()
+        else:
+            loop.call_soon_threadsafe(_set)
+
+    def _run(self) -> None:
+        while True:
+            pending = self._collect()
+            merged = list(dict.fromkeys(s for spans, _, _ in pending for s in spans))
+            self.rounds += 1
+            self.requests += len(pending)
+            try:
+                scored = dict(zip(merged, self.run_batch(merged)))
+            except Exception as e:
+                logging.getLogger("uvicorn").error("Inference round failed (%s).", str(e))
+                if len(pending) == 1:
+                    self._deliver(pending[0][2], pending[0][1], error=e)
+                else:
+                    self._retry_alone(pending)
+                continue
+            for spans, fut, loop in pending:
+                self._deliver(loop, fut, [scored[s] for s in spans])
+
+    def _retry_alone(self, pending) -> None:
+        """After a merged round failed, score each request on its own so only the one at fault fails."""
+        for spans, fut, loop in pending:
+            self.rounds += 1
+            try:
+                self._deliver(loop, fut, self.run_batch(spans))
+            except Exception as e:
+                self._deliver(loop, fut, error=e)
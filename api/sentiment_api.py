@@ -1,15 +1,37 @@
 from __future__ import annotations
-from typing import Optional, Dict, List, Tuple
+from typing import Optional, Dict, List, Tuple, Iterable, Iterator, Union
+from bisect import bisect_left, bisect_right
 import os
+import copy
+import itertools
+from collections import defaultdict
 import re
 import json
 import logging
+import threading
+import time
 
 from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 
-from ca_helpers import verify_client_request, sign_response
+from ca_helpers import (SIG_MODE_RAW, SIG_MODES, ClientIdentity, verify_client_request, sign_response, server_cert_headers,
+                        sign_stream_chunk)
+from span_cache import SpanCache
+from backends import load_backend, probs_from_output
+from scheduler import MicroBatchScheduler
+import metrics
+import columnar
+from cascade import Cascade, parse_stages
+from neardup import NearDupIndex
+from jobs import JobStore, JobRunner, parse_priorities
+from gateway import Gateway, GatewayError
+from admission import AdmissionController, Admitted, Overloaded, estimate_tokens, parse_weights
+from rescore import Policy, as_vector, rescore
+from aggregate import aggregate
+from textnorm import normalize
 
 # Suppress HuggingFace warnings
 class _DropPoolerWarning(logging.Filter):
@@ -31,7 +53,15 @@ DISPARITY_HIGH_MAX = 25
 POS_THR = 0.62
 NEG_THR = 0.44
 
-NEG_WINDOW = 3
+# Contrast rebalance: a clearly negative front outweighs a positive tail
+CONTRAST_FRONT_MAX = -0.35
+CONTRAST_FRONT_WEIGHT = 0.70
+CONTRAST_TAIL_WEIGHT = 0.30
+CONTRAST_TAIL_CAP = 0.20
+
+# Target bias on positive labels of texts that name their target
+PEER_BIAS = -0.03
+SELF_BIAS = 0.02
 
 # HuggingFace model
 HF_MODEL_NAME = os.environ.get(
@@ -41,12 +71,95 @@ HF_MODEL_NAME = os.environ.get(
 HF_DEVICE = os.environ.get("SPE_HF_DEVICE", "cpu")        
 HF_MAX_LEN = int(os.environ.get("SPE_HF_MAXLEN", "256"))  
 
+# Inference backend: transformers (fp32 pipeline), onnx (ONNX Runtime export) or int8 (quantized torch)
+HF_BACKEND = os.environ.get("SPE_HF_BACKEND", "transformers").strip().lower()
+HF_ONNX_DIR = os.environ.get(
+    "SPE_HF_ONNX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx-model"),
+)
+
+# Run one inference right after loading so the first real request is not the slow one
+HF_WARMUP = os.environ.get("SPE_HF_WARMUP", "true").lower() == "true"
+
+# Inference batching: spans per forward pass and padded-token budget per batch
+HF_BATCH_SIZE = int(os.environ.get("SPE_HF_BATCH", "32"))
+HF_TOKEN_BUDGET = int(os.environ.get("SPE_HF_TOKEN_BUDGET", "8192"))
+
+# Span probability cache (empty SPE_CACHE_PATH keeps it in memory only)
+CACHE_PATH = os.environ.get(
+    "SPE_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "spe_span_cache.sqlite3"),
+)
+CACHE_MEM_ITEMS = int(os.environ.get("SPE_CACHE_MEM_ITEMS", "50000"))
+CACHE_DISK_ITEMS = int(os.environ.get("SPE_CACHE_DISK_ITEMS", "1000000"))
+
+# Cross-request micro-batching: how long a round waits for more requests, and its span cap
+SCHED_MAX_WAIT_MS = float(os.environ.get("SPE_SCHED_MAX_WAIT_MS", "10"))
+SCHED_MAX_SPANS = int(os.environ.get("SPE_SCHED_MAX_SPANS", "4096"))
+
+# Cascade: cheap stages that may settle an item before the model (off unless SPE_CASCADE is set)
+CASCADE_STAGES = parse_stages(os.environ.get("SPE_CASCADE", ""))
+CASCADE_PHRASE_MAX_WORDS = int(os.environ.get("SPE_CASCADE_PHRASE_MAX_WORDS", "8"))
+CASCADE_PHRASE_CONF = float(os.environ.get("SPE_CASCADE_PHRASE_CONF", "0.9"))
+CASCADE_AUDIT_RATE = float(os.environ.get("SPE_CASCADE_AUDIT", "0"))
+
+# Near-duplicate reuse: Jaccard similarity at which a templated comment borrows the scores of one
+# already scored (0 turns it off), shortest text considered, representatives kept, audit share
+NEARDUP_THRESHOLD = float(os.environ.get("SPE_NEARDUP_THRESHOLD", "0"))
+NEARDUP_MIN_WORDS = int(os.environ.get("SPE_NEARDUP_MIN_WORDS", "6"))
+NEARDUP_ITEMS = int(os.environ.get("SPE_NEARDUP_ITEMS", "20000"))
+NEARDUP_AUDIT_RATE = float(os.environ.get("SPE_NEARDUP_AUDIT", "0"))
+
+# Admission control per client certificate id: estimated tokens in flight (0 turns it off),
+# queued tokens, the longest a request may wait, and weights ("client-id:weight,...")
+ADMIT_TOKENS = int(os.environ.get("SPE_ADMIT_TOKENS", "131072"))
+ADMIT_QUEUE_TOKENS = int(os.environ.get("SPE_ADMIT_QUEUE_TOKENS", str(4 * ADMIT_TOKENS)))
+ADMIT_MAX_WAIT_S = float(os.environ.get("SPE_ADMIT_MAX_WAIT_S", "30"))
+ADMIT_WEIGHTS = parse_weights(os.environ.get("SPE_ADMIT_WEIGHTS", ""))
+
+# Gateway mode: shard /analyze batches across these backends ("http://host:port,...") instead
+# of loading a model; backend requests are signed with the gateway's own client identity
+GATEWAY_BACKENDS = [u.strip() for u in os.environ.get("SPE_GATEWAY_BACKENDS", "").split(",") if u.strip()]
+GATEWAY_SHARD = int(os.environ.get("SPE_GATEWAY_SHARD", "250"))
+GATEWAY_ATTEMPTS = int(os.environ.get("SPE_GATEWAY_ATTEMPTS", "3"))
+GATEWAY_POOL = int(os.environ.get("SPE_GATEWAY_POOL", "8"))
+GATEWAY_TIMEOUT = float(os.environ.get("SPE_GATEWAY_TIMEOUT", "60"))
+GATEWAY_CLIENT_CERT = os.environ.get("SPE_GATEWAY_CLIENT_CERT", "")
+GATEWAY_CLIENT_CERTSIG = os.environ.get("SPE_GATEWAY_CLIENT_CERTSIG", "")
+GATEWAY_CLIENT_PRIV = os.environ.get("SPE_GATEWAY_CLIENT_PRIV", "")
+GATEWAY_TOKEN = os.environ.get("SPE_GATEWAY_TOKEN", "").strip()
+
+# Asynchronous jobs (POST /jobs): SQLite store, worker threads, items per chunk,
+# per-client priority ("client-id:priority,..."), and how long finished jobs are kept
+JOBS_PATH = os.environ.get(
+    "SPE_JOBS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "spe_jobs.sqlite3"),
+)
+JOB_WORKERS = int(os.environ.get("SPE_JOB_WORKERS", "1"))
+JOB_CHUNK = int(os.environ.get("SPE_JOB_CHUNK", "256"))
+JOB_PRIORITIES = parse_priorities(os.environ.get("SPE_JOB_PRIORITIES", ""))
+JOB_RETENTION_H = float(os.environ.get("SPE_JOB_RETENTION_H", "168"))
+
+# Re-labelling stored vectors (POST /rescore): items per request
+RESCORE_MAX_ITEMS = int(os.environ.get("SPE_RESCORE_MAX_ITEMS", "50000"))
+
+# Unit rollups (POST /aggregate): rating plus comment rows per request
+AGGREGATE_MAX_ROWS = int(os.environ.get("SPE_AGGREGATE_MAX_ROWS", "200000"))
+
+# Streaming mode: items per signed NDJSON chunk
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_CHUNK = int(os.environ.get("SPE_STREAM_CHUNK", "64"))
+
 # Configuration
 API_TOKEN = os.environ.get("sentiment_token", "").strip()
 BIND_HOST = os.environ.get("SPE_BIND", "127.0.0.1")
 PORT = int(os.environ.get("PORT", "8000"))
 RELOAD = os.environ.get("RELOAD", "").lower() == "true"
 
+# Pre-fork workers sharing one model (SPE_WORKERS > 1), and torch intra-op threads per worker
+WORKERS = int(os.environ.get("SPE_WORKERS", "1"))
+WORKER_THREADS = int(os.environ.get("SPE_WORKER_THREADS", "0")) or max(1, (os.cpu_count() or 1) // max(1, WORKERS))
+
 app = FastAPI(title="SPE Sentiment API (Ed25519-secured)", version="4.0.0")
 
 # CORS
@@ -58,127 +171,136 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Roberta model load
+# Request metrics; a request carrying "X-SPE-Timing: 1" gets its stage breakdown back in that header
+_CACHE_GAUGE = metrics.REGISTRY.gauge("spe_span_cache", "Span cache counters and sizes.")
+_SCHED_GAUGE = metrics.REGISTRY.gauge("spe_scheduler", "Micro-batching scheduler rounds and requests.")
+_MODEL_READY = metrics.REGISTRY.gauge("spe_model_ready", "1 once the model is loaded and warm.")
+
+@app.middleware("http")
+async def _request_metrics(request: Request, call_next):
+    timing = metrics.start_request_timing()
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    endpoint = getattr(route, "path", "other")
+    metrics.observe_stage("request", time.perf_counter() - t0)
+    metrics.REQUESTS.inc(labels={"endpoint": endpoint, "status": str(response.status_code)})
+    if request.headers.get("x-spe-timing", "").strip() in ("1", "true"):
+        response.headers["X-SPE-Timing"] = metrics.timing_header(timing)
+    return response
+
+# Span cache
+_span_cache = SpanCache(
+    CACHE_PATH or None,
+    namespace=f"{HF_MODEL_NAME}|{HF_MAX_LEN}|{HF_BACKEND}",
+    mem_items=CACHE_MEM_ITEMS,
+    disk_items=CACHE_DISK_ITEMS,
+)
+
+# Cascade stages and their counters
+_cascade = Cascade(CASCADE_STAGES, phrase_max_words=CASCADE_PHRASE_MAX_WORDS,
+                   phrase_confidence=CASCADE_PHRASE_CONF, audit_rate=CASCADE_AUDIT_RATE)
+_CASCADE_ITEMS = metrics.REGISTRY.counter(
+    "spe_cascade_items_total",
+    "Items by the stage that settled them "
+    "(model: the transformer, neardup: a near-duplicate's scores, empty: blank text).")
+_CASCADE_AUDIT = metrics.REGISTRY.counter(
+    "spe_cascade_audit_total", "Audited cascade items by stage and whether the model agreed on the label.")
+
+# Near-duplicate index and its counters
+_neardup = NearDupIndex(NEARDUP_THRESHOLD, min_words=NEARDUP_MIN_WORDS, capacity=NEARDUP_ITEMS,
+                        audit_rate=NEARDUP_AUDIT_RATE)
+_NEARDUP_GAUGE = metrics.REGISTRY.gauge(
+    "spe_neardup", "Near-duplicate items that reused scores, representatives scored, audited items, index size.")
+_NEARDUP_AUDIT = metrics.REGISTRY.counter(
+    "spe_neardup_audit_total", "Audited near-duplicate items by whether the model agreed on the label.")
+
+# Roberta model load (background thread at startup, so imports and restarts return at once)
 _roberta = None
+_tokenizer = None
 _roberta_labels = ["negative", "neutral", "positive"]
-try:
-    from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
-    import torch 
-
-    _tokenizer = AutoTokenizer.from_pretrained(HF_MODEL_NAME)
-    _model = AutoModelForSequenceClassification.from_pretrained(HF_MODEL_NAME)
-    _roberta = pipeline(
-        "sentiment-analysis",
-        model=_model,
-        tokenizer=_tokenizer,
-        device=0 if HF_DEVICE == "cuda" else -1,
-        truncation=True,
-        max_length=HF_MAX_LEN,
-        top_k=None,
-        return_all_scores=True,
-    )
-except Exception as e:
-    logging.getLogger("uvicorn").error("RoBERTa failed to load (%s).", str(e))
-    _roberta = None 
-
-# Phrase patterns
-PHRASE_PATTERNS: Dict[str, str] = {
-    r"\b(can\s+)?create\s+challenges\b": "create_challenges",
-    r"\b(dominate|dominates|dominating)\s+discussions?\b": "dominate_discussions",
-    r"\brush\s+through\s+tasks?\b": "rush_through_tasks",
-    r"\bminor\s+misunderstandings?\b": "minor_misunderstandings",
-    r"\b(in)?consistenc(y|ies)\b": "inconsistencies",
-    r"\bstrong\s+opinions\b": "strong_opinions",
-    r"\btime\s+management\s+could\s+improve\b": "time_mgmt_could_improve",
-    r"\bdelays?\s+in\s+completing\b": "delays_in_completing",
-    r"\baffect(s|ed)?\s+overall\s+progress\b": "affects_overall_progress",
-    r"\bneeds?\s+improvement\b": "needs_improvement",
-    r"\broom\s+for\s+improvement\b": "room_for_improvement",
-    r"\bdid\s+most\s+of\s+the\s+work(\s+(for|within)\s+(the\s+)?(team|group))?\b": "did_most_of_work",
-    r"\bi\s+did\s+a\s+lot\s+(for|of)\s+(the\s+)?team\b": "did_a_lot_for_team",
-    r"\bgood\s+job\b": "good_job",
-    r"\bdid\s+not\s+do\s+much(\s+at\s+all)?\b": "did_not_do_much",
-    r"\bdid\s+not\s+contribut(e|ed)\s+at\s+all\b": "did_not_contribute_at_all",
-    r"\b(does|did)\s+most\s+of\s+(?:the\s+)?project\b": "did_most_of_project",
-    r"\b(does|did)\s+most\s+of\s+(?:the\s+)?project\b.*\b(coding|code)\b": "did_most_of_project_coding",
-    r"\b(does|did)\s+most\s+of\s+(?:the\s+)?(?:(?:project|group)\s+)?(?:work|tasks?)\b": "did_most_of_work",
-    r"\b(does|did)\s+most\s+of\s+(?:the\s+)?job\b": "did_most_of_job",
-    r"\b(does|did)\s+most\s+of\s+(?:the\s+)?reports?\b": "did_most_of_reports",
-    r"\b(does|did)\s+most\s+of\s+(?:the\s+)?presentation\s+slides?\b": "did_most_of_slides",
-    r"\b(does|did)\s+only\s+(?:about\s+)?(\d{1,3})\s*%\s+(?:of\s+)?(?:the\s+)?(?:(?:project|group)\s+)?(?:work|tasks?)\b": "did_only_pct_work_\\2",
-    r"\bonly\s+(?:about\s+)?(\d{1,3})\s*%\s+(?:done|completed|work|project|tasks?)\b": "did_only_pct_work_\\1",
-    r"\b(does|did)\s+(?:about\s+)?(\d{1,3})\s*%\s+(?:of\s+)?(?:the\s+)?(?:(?:project|group)\s+)?(?:work|tasks?)\b": "did_pct_work_\\2",
-    r"\balways\s+not\s+available\b": "always_not_available",
-    r"\b(always\s+)?un(contactable|contactable)\b": "always_uncontactable",
-    r"\b(always\s+)?(unavailable|not\s+available)\b": "always_unavailable",
-    r"\b(absent|no[-\s]?show|no\s+shows?)\b": "absenteeism",
-    r"\bnon[-\s]?responsive\b": "unresponsive",
-    r"\b(always|often)\s+late\b": "often_late",
-    r"\bcontribut(?:ed|es|ing)?\s+in\s+(?:planning\s+)?meetings?\b": "contributed_in_meetings",
-}
-
-# Functions for dynamic percentage tokens
-def _apply_dynamic_pct_tokens(text: str) -> List[str]:
-    matched = []
-    for m in re.finditer(r"\bdid_only_pct_work_(\d{1,3})\b", text):
-        matched.append(m.group(0))
-    for m in re.finditer(r"\bdid_pct_work_(\d{1,3})\b", text):
-        matched.append(m.group(0))
-    return matched
-
-# Intensifier 
-INTENSIFIER_RE = re.compile(r"\b(very|extremely|super|really)\b", re.IGNORECASE)
-def cap_intensifier_runs(text: str, max_repeats: int = 2) -> str:
-    tokens = text.split()
-    out: List[str] = []
-    run = 0
-    last_int = False
-    for t in tokens:
-        if INTENSIFIER_RE.fullmatch(t):
-            run = run + 1 if last_int else 1
-            last_int = True
-            if run <= max_repeats:
-                out.append(t)
-        else:
-            last_int = False
-            run = 0
-            out.append(t)
-    return " ".join(out)
-
-# Negation scope widening
-NEGATORS = re.compile(r"^(?:not|never|no|rarely|hardly|seldom|scarcely|barely)$", re.IGNORECASE)
-def widen_negation_scope(text: str) -> str:
-    words = re.findall(r"\w+|\W+", text)
-    out: List[str] = []
-    i = 0
-    while i < len(words):
-        w = words[i]
-        if re.fullmatch(r"\w+", w) and NEGATORS.fullmatch(w):
-            out.append(w)
-            j, seen = i + 1, 0
-            while j < len(words) and seen < NEG_WINDOW:
-                if re.fullmatch(r"\w+", words[j]):
-                    words[j] = "NOT_" + words[j]
-                    seen += 1
-                j += 1
-            i += 1
-        else:
-            out.append(w); i += 1
-    return "".join(out)
-
-# Phrase preprocessing
-def preprocess_phrases(text: str) -> Tuple[str, List[str]]:
-    for pat, token in PHRASE_PATTERNS.items():
-        text = re.sub(pat, token, text, flags=re.IGNORECASE)
-    dyn = _apply_dynamic_pct_tokens(text)
-    return text, dyn
-
-# Toxic words
-TOXIC_RE = re.compile(
-    r"\b(dumbass|idiot|stupid|moron|useless|garbage|trash|loser|worthless|asshole|bitch|fuck|shit|hate|toxic|fucker)\b",
-    re.IGNORECASE)
-def is_toxic(text: str) -> bool:
-    return bool(TOXIC_RE.search(text or ""))
+_model_state: Dict[str, object] = {"state": "idle", "error": None, "load_ms": None, "warmup_ms": None}
+_model_lock = threading.Lock()
+
+def _load_model(warmup: bool = True) -> None:
+    global _roberta, _tokenizer
+    log = logging.getLogger("uvicorn")
+    t0 = time.perf_counter()
+    try:
+        backend = load_backend(HF_BACKEND, HF_MODEL_NAME, HF_DEVICE, HF_MAX_LEN, onnx_dir=HF_ONNX_DIR)
+    except Exception as e:
+        log.error("RoBERTa failed to load (%s).", str(e))
+        _model_state.update(state="failed", error=str(e))
+        return
+    _model_state.update(state="warming", load_ms=round((time.perf_counter() - t0) * 1000, 1))
+    _tokenizer = backend.tokenizer
+    _roberta = backend
+    if warmup:
+        _warm_up()
+
+def _warm_up() -> None:
+    log = logging.getLogger("uvicorn")
+    if HF_WARMUP:
+        t0 = time.perf_counter()
+        try:
+            _roberta(["Warm-up run.", "The team worked well, but the report was late."], batch_size=2)
+        except Exception as e:
+            log.warning("RoBERTa warm-up failed (%s).", str(e))
+        _model_state["warmup_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    _model_state["state"] = "ready"
+    log.info("RoBERTa ready (%s backend, load %sms, warm-up %sms).",
+             HF_BACKEND, _model_state["load_ms"], _model_state["warmup_ms"])
+
+def start_model_load() -> None:
+    """Start loading the model in the background; a no-op once started."""
+    with _model_lock:
+        if _model_state["state"] != "idle":
+            return
+        _model_state["state"] = "loading"
+    threading.Thread(target=_load_model, name="spe-model-load", daemon=True).start()
+
+# Pre-fork mode: the parent loads the weights once, workers share them copy-on-write
+def prefork_prepare() -> None:
+    """Parent side: load the model (no inference, so no thread pools exist yet) and share its tensors."""
+    if HF_BACKEND == "onnx" or GATEWAY_BACKENDS:
+        # Gateways load no model; ONNX Runtime thread pools do not survive fork,
+        # so each worker builds its own session
+        return
+    _model_state["state"] = "loading"
+    _load_model(warmup=False)
+    model = getattr(_roberta, "model", None)
+    if model is not None and hasattr(model, "share_memory"):
+        model.share_memory()
+
+def prefork_worker_init(index: int) -> None:
+    """Worker side: cap intra-op threads, reopen the span cache, warm up the inherited model."""
+    try:
+        import torch
+        torch.set_num_threads(WORKER_THREADS)
+    except ImportError:
+        pass
+    _span_cache.reopen()
+    _job_store.reopen()
+    if _roberta is not None:
+        _warm_up()
+
+@app.on_event("startup")
+async def _startup() -> None:
+    if _gateway is not None:
+        _model_state["state"] = "ready"
+    else:
+        start_model_load()
+    _job_runner.start()
+
+def _serving() -> bool:
+    """True once /analyze can answer: the model is loaded, or this process is a gateway."""
+    return _gateway is not None or _roberta is not None
+
+def _model_unavailable() -> HTTPException:
+    if _model_state["state"] in ("loading", "warming"):
+        return HTTPException(status_code=503, detail="RoBERTa model is still loading.",
+                             headers={"Retry-After": "5"})
+    return HTTPException(status_code=503, detail="RoBERTa model not available on server.")
 
 # Contrast handling
 CONTRAST_RE = re.compile(r"\b(but|however|although|though|yet|while|despite)\b", re.IGNORECASE)
@@ -190,58 +312,164 @@ def split_contrast(text: str):
 # Sentence splitting
 SPLIT_SENT = re.compile(r"(?<=[\.\?!])\s+")
 
+# A span the model scores: its text, or token ids cut from the item's single encoding
+Span = Union[str, Tuple[int, ...]]
+
 # Helpers
-def roberta_probs(text: str) -> Dict[str, float]:
-    """Return probabilities dict for negative/neutral/positive."""
-    if _roberta is None:
-        raise RuntimeError("RoBERTa model is not loaded.")
-    res = _roberta(text[:HF_MAX_LEN])[0]
-    probs = {r["label"].lower(): float(r["score"]) for r in res}
+def span_token_lengths(spans: List[Span]) -> List[int]:
+    """Token length of each span as the model will see it (falls back to a char estimate)."""
+    lengths = [0] * len(spans)
+    texts = [i for i, s in enumerate(spans) if isinstance(s, str)]
+    if texts and _tokenizer is not None:
+        enc = _tokenizer([spans[i] for i in texts], truncation=True, max_length=HF_MAX_LEN)
+        for i, ids in zip(texts, enc["input_ids"]):
+            lengths[i] = len(ids)
+    elif texts:
+        for i in texts:
+            lengths[i] = max(1, len(spans[i]) // 4)
+    for i, s in enumerate(spans):
+        if isinstance(s, tuple):
+            lengths[i] = len(s) + _tokenizer.num_special_tokens_to_add()
+    return lengths
+
+def plan_batches(spans: List[Span]) -> List[List[Span]]:
+    """
+    Group spans into padded batches: sorted by token length so each batch pads
+    to a similar width, capped at HF_BATCH_SIZE spans and HF_TOKEN_BUDGET padded tokens.
+    Text spans and token-id spans never share a batch.
+    """
+    if not spans:
+        return []
+    with metrics.stage("tokenize"):
+        lengths = span_token_lengths(spans)
+    metrics.TOKENS.inc(sum(lengths))
+    order = sorted(range(len(spans)), key=lambda i: (isinstance(spans[i], tuple), lengths[i]))
 
-    def _norm(lbl):
-        l = lbl.lower()
-        if "pos" in l or l.endswith("_2"): return "positive"
-        if "neg" in l or l.endswith("_0"): return "negative"
-        return "neutral"
+    batches: List[List[Span]] = []
+    cur: List[Span] = []
+    width = 0
+    for i in order:
+        w = max(width, lengths[i])
+        if cur and (len(cur) >= HF_BATCH_SIZE or w * (len(cur) + 1) > HF_TOKEN_BUDGET
+                    or type(cur[0]) is not type(spans[i])):
+            batches.append(cur)
+            cur, w = [], lengths[i]
+        cur.append(spans[i])
+        width = w
+    if cur:
+        batches.append(cur)
+    return batches
 
-    probs = {_norm(k): v for k, v in probs.items()}
-    for k in ("negative", "neutral", "positive"):
-        probs.setdefault(k, 0.0)
+def roberta_probs_batch(texts: List[Span]) -> List[Dict[str, float]]:
+    """
+    Probabilities for many spans: cached spans are served from the span cache,
+    the rest are scored once each, in length-sorted padded batches.
+    Token-id spans (see span_keys) go to the model as they are, without re-tokenizing.
+    """
+    if _roberta is None:
+        raise RuntimeError("RoBERTa model is not loaded.")
+    keys = [t if isinstance(t, tuple) else t[:HF_MAX_LEN] for t in texts]
+    uniq = list(dict.fromkeys(keys))
+    with metrics.stage("cache"):
+        scored = _span_cache.get_many(uniq)
+    fresh: Dict[Span, Dict[str, float]] = {}
+    for batch in plan_batches([k for k in uniq if k not in scored]):
+        metrics.BATCH_SPANS.observe(len(batch))
+        with metrics.stage("forward"):
+            if isinstance(batch[0], tuple):
+                res = _roberta.call_ids(batch)
+            else:
+                res = _roberta(batch, batch_size=len(batch))
+        for span, r in zip(batch, res):
+            fresh[span] = probs_from_output(r)
+    _span_cache.put_many(fresh)
+    scored.update(fresh)
+    return [scored[k] for k in keys]
 
-    s = sum(probs.values())
-    if s > 0:
-        for k in probs:
-            probs[k] /= s
-    return probs
+def roberta_probs(text: str) -> Dict[str, float]:
+    """Return probabilities dict for negative/neutral/positive."""
+    return roberta_probs_batch([text])[0]
 
-def roberta_compound(text: str) -> Tuple[float, str, Dict[str, float]]:
-    probs = roberta_probs(text)
+def compound_from_probs(probs: Dict[str, float]) -> Tuple[float, str, Dict[str, float]]:
     p_pos = probs.get("positive", 0.0)
     p_neg = probs.get("negative", 0.0)
     comp = p_pos - p_neg
     label = max(probs.items(), key=lambda kv: kv[1])[0]
     return comp, label, probs
 
-def roberta_sentence_scores(text: str) -> Tuple[List[float], float, float]:
-    parts = [p.strip() for p in SPLIT_SENT.split(text) if p.strip()]
+def roberta_compound(text: str) -> Tuple[float, str, Dict[str, float]]:
+    return compound_from_probs(roberta_probs(text))
+
+def split_sentences(text: str) -> List[str]:
+    return [p.strip() for p in SPLIT_SENT.split(text) if p.strip()]
+
+# The fast tokenizer keeps truncation/padding state in its Rust object and raises
+# "Already borrowed" when two threads use it at once; the scheduler thread keeps the
+# shared one, planning threads (request threadpool, jobs) each encode with a copy
+_planning = threading.local()
+
+def _planning_tokenizer():
+    if getattr(_planning, "source", None) is not _tokenizer:
+        _planning.source, _planning.tokenizer = _tokenizer, copy.deepcopy(_tokenizer)
+    return _planning.tokenizer
+
+def span_keys(text: str, ranges: List[Tuple[int, int]]) -> List[Span]:
+    """
+    Keys the model scores for `text` and its sub-spans text[a:b] (sentences,
+    contrast front/tail). With a fast tokenizer the text is encoded once and each
+    sub-span is the slice of tokens whose offsets fall inside it, truncated at a
+    token boundary; otherwise the keys are the texts themselves.
+
+    A slice keeps the tokens as they were encoded in context, so it can differ
+    from encoding text[a:b] alone at its first token: a sentence after a space
+    starts with the space-prefixed word piece ("Ġthe" rather than "the" with
+    RoBERTa's byte-level BPE), and a word split across a range edge is dropped.
+    """
+    if not getattr(_tokenizer, "is_fast", False):
+        return [text] + [text[a:b] for a, b in ranges]
+    tok = _planning_tokenizer()
+    with metrics.stage("tokenize"):
+        enc = tok(text, add_special_tokens=False, truncation=False, return_offsets_mapping=True)
+    ids = enc["input_ids"]
+    starts = [a for a, _ in enc["offset_mapping"]]
+    ends = [b for _, b in enc["offset_mapping"]]
+    limit = HF_MAX_LEN - tok.num_special_tokens_to_add()
+
+    keys: List[Span] = [tuple(ids[:limit])]
+    for a, b in ranges:
+        piece = ids[bisect_left(starts, a):bisect_right(ends, b)]
+        # A sub-span without a whole token of its own is scored from its text
+        keys.append(tuple(piece[:limit]) if piece and a < b else text[a:b])
+    return keys
+
+def sentence_ranges(text: str, sentences: List[str]) -> List[Tuple[int, int]]:
+    """Character range of each split_sentences piece inside text."""
+    out, pos = [], 0
+    for s in sentences:
+        a = text.find(s, pos)
+        out.append((a, a + len(s)))
+        pos = a + len(s)
+    return out
+
+def roberta_sentence_scores(parts: List[Span], scored: Dict[Span, Dict[str, float]]) -> Tuple[List[float], float, float]:
     if not parts:
         return [], 0.0, 0.0
     comps = []
     for p in parts:
-        c, _, _ = roberta_compound(p)
+        c, _, _ = compound_from_probs(scored[p])
         comps.append(c)
     avg_c = sum(comps) / len(comps)
     min_c = min(comps)
     return comps, avg_c, min_c
 
-def contrast_rebalance_roberta(text: str, base: float) -> float:
-    front, cue, tail = split_contrast(text)
+def contrast_rebalance_roberta(front: Span, tail: Optional[Span], base: float,
+                               scored: Dict[Span, Dict[str, float]]) -> float:
     if not tail:
         return base
-    cf, _, _ = roberta_compound(front)
-    ct, _, _ = roberta_compound(tail)
-    if cf <= -0.35:
-        return 0.70 * cf + 0.30 * min(ct, 0.20)
+    cf, _, _ = compound_from_probs(scored[front])
+    ct, _, _ = compound_from_probs(scored[tail])
+    if cf <= CONTRAST_FRONT_MAX:
+        return CONTRAST_FRONT_WEIGHT * cf + CONTRAST_TAIL_WEIGHT * min(ct, CONTRAST_TAIL_CAP)
     return base
 
 # Disparity evaluation
@@ -267,27 +495,98 @@ def label_from_score(score01: float) -> str:
     return "neutral"
 
 # Target bias adjustment
+def pronoun_flags(text: str) -> Tuple[bool, bool]:
+    """Whether the text refers to a peer (he, she, ...) and to the writer (I, my, me)."""
+    txt = text.lower() + " "
+    return (any(p in txt for p in (" he ", " she ", " they ", " him ", " her ")),
+            any(p in txt for p in (" i ", " my ", " me ")))
+
 def target_bias(label: str, text: str, target: Optional[str]) -> float:
     if not target: return 0.0
-    txt = text.lower() + " "
-    if target == "peer" and any(p in txt for p in (" he ", " she ", " they ", " him ", " her ")):
-        return -0.03 if label == "positive" else 0.0
-    if target == "self" and any(p in txt for p in (" i ", " my ", " me ")):
-        return +0.02 if label == "positive" else 0.0
+    peer, self_ = pronoun_flags(text)
+    if target == "peer" and peer:
+        return PEER_BIAS if label == "positive" else 0.0
+    if target == "self" and self_:
+        return SELF_BIAS if label == "positive" else 0.0
     return 0.0
 
-# Main function
-def analyze_text_full(text: str,
-                      score_total=None,
-                      score_min=None,
-                      score_max=None,
-                      target: Optional[str] = None):
-    if _roberta is None:
-        raise HTTPException(status_code=503, detail="RoBERTa model not available on server.")
+# The post-processing constants above as one policy; /rescore applies variations of it
+DEFAULT_POLICY = Policy(
+    pos_thr=POS_THR, neg_thr=NEG_THR,
+    contrast_front_max=CONTRAST_FRONT_MAX, contrast_front_weight=CONTRAST_FRONT_WEIGHT,
+    contrast_tail_weight=CONTRAST_TAIL_WEIGHT, contrast_tail_cap=CONTRAST_TAIL_CAP,
+    peer_bias=PEER_BIAS, self_bias=SELF_BIAS,
+    disparity_low=(DISPARITY_LOW_MIN, DISPARITY_LOW_MAX),
+    disparity_high=(DISPARITY_HIGH_MIN, DISPARITY_HIGH_MAX),
+)
 
+# Inference planning
+def plan_item(text) -> Dict[str, object]:
+    """Preprocess one item and list every span the model must score for it."""
     tx = (text or "").strip()
-    wc = len(re.findall(r"\b\w+\b", tx))
-    cc = len(tx)
+    norm = normalize(tx, max_repeats=2)
+    plan: Dict[str, object] = {
+        "tx": tx,
+        "wc": norm["word_count"],
+        "cc": norm["char_count"],
+        "spans": [],
+    }
+    if not tx:
+        return plan
+
+    tx2 = norm["tx2"]
+    sentences = split_sentences(tx2)
+    front, _, tail = split_contrast(tx2)
+    ranges = sentence_ranges(tx2, sentences)
+    if tail:
+        # front opens tx2 and tail closes it (both were stripped by split_contrast)
+        lead, end = len(tx2) - len(tx2.lstrip()), len(tx2.rstrip())
+        ranges += [(lead, lead + len(front)), (end - len(tail), end)]
+    keys = span_keys(tx2, ranges)
+    k_sentences = keys[1:1 + len(sentences)]
+    k_front, k_tail = (keys[-2], keys[-1]) if tail else (None, None)
+    spans = k_sentences + [keys[0]]
+    if tail:
+        spans += [k_front, k_tail]
+
+    plan.update(tx2=tx2, matched=norm["matched"], toxic=norm["toxic"],
+                negation_used=norm["negation_used"], sentences=sentences,
+                front=front, tail=tail, spans=spans,
+                k_sentences=k_sentences, k_whole=keys[0], k_front=k_front, k_tail=k_tail)
+
+    if _cascade.enabled:
+        settled = _cascade.settle(plan)
+        if settled is not None:
+            plan["cascade"] = settled
+            # Audited items are scored by the model too; the rest skip it
+            plan["audit"] = _cascade.sampled(tx)
+            if not plan["audit"]:
+                plan["spans"] = []
+    return plan
+
+def plan_batch(items: List[dict]) -> List[Dict[str, object]]:
+    """plan_item for every item, then near-duplicates of one another or of recent batches are marked for reuse."""
+    plans = [plan_item(it.get("text")) for it in items]
+    _neardup.assign(plans)
+    return plans
+
+def score_spans(plans: List[Dict[str, object]]) -> Dict[Span, Dict[str, float]]:
+    """Collect the spans of all plans, dedupe them and score them on the scheduler thread."""
+    spans = list(dict.fromkeys(s for p in plans for s in p["spans"]))
+    if not spans:
+        return {}
+    return dict(zip(spans, _scheduler.submit_sync(spans)))
+
+def finish_item(plan: Dict[str, object],
+                scored: Dict[str, Dict[str, float]],
+                score_total=None,
+                score_min=None,
+                score_max=None,
+                target: Optional[str] = None,
+                use_cascade: bool = True,
+                use_neardup: bool = True):
+    tx = plan["tx"]
+    wc, cc = plan["wc"], plan["cc"]
     smin = float(score_min or SCORE_MIN_DEFAULT)
     smax = float(score_max or SCORE_MAX_DEFAULT)
 
@@ -301,26 +600,35 @@ def analyze_text_full(text: str,
             "matched_tokens": [], "negation_used": False,
             "engine": "roberta_only",
             "roberta": {"compound": 0.0, "label": "neutral", "probs": {"negative":0.0,"neutral":1.0,"positive":0.0}},
-            "disparity": disp, "disparity_reason": reason, "suggest_confirm": confirm
+            "disparity": disp, "disparity_reason": reason, "suggest_confirm": confirm,
+            "vectors": None
         }
 
-    # Preprocess
-    tx2 = cap_intensifier_runs(tx, max_repeats=2)
-    tx2, dyn_tokens = preprocess_phrases(tx2)
-    tx2 = widen_negation_scope(tx2)
+    tx2 = plan["tx2"]
+
+    # Settled by a cascade stage: its probabilities stand in for every span
+    engine = "roberta_only"
+    if use_cascade and "cascade" in plan:
+        stage, probs = plan["cascade"]
+        scored = defaultdict(lambda: dict(probs))
+        engine = "cascade:" + stage
+    # Near-duplicate of a scored text: its probabilities, span for span
+    elif use_neardup and "neardup" in plan:
+        scored = plan["neardup"].scored_for(plan)
+        engine = "neardup"
 
     # Sentence scores
-    comps, avg_c, min_c = roberta_sentence_scores(tx2)
+    comps, avg_c, min_c = roberta_sentence_scores(plan["k_sentences"], scored)
 
     # Overall RoBERTa compound
-    comp, rob_label, rob_probs = roberta_compound(tx2)
-    comp = contrast_rebalance_roberta(tx2, comp)
+    comp, rob_label, rob_probs = compound_from_probs(scored[plan["k_whole"]])
+    comp = contrast_rebalance_roberta(plan["k_front"], plan["k_tail"], comp, scored)
 
     # Final score 
     score01 = max(0.0, min(1.0, (comp + 1.0) / 2.0))
 
     # Toxic override
-    toxic = is_toxic(tx)
+    toxic = plan["toxic"]
     label = label_from_score(score01)
     if toxic:
         label = "toxic"
@@ -332,12 +640,25 @@ def analyze_text_full(text: str,
         score01 = max(0.0, min(1.0, (comp + 1.0) / 2.0))
         label = label_from_score(score01)
 
-    matched = [t for t in set(list(PHRASE_PATTERNS.values()) + dyn_tokens) if t in tx2][:15]
-    negation_used = bool(re.search(r"\bNOT_\w+", tx2))
+    matched = plan["matched"][:15]
+    negation_used = plan["negation_used"]
 
     # Disparity logic 
     disp, reason, confirm = evaluate_disparity(label, comp, min_c, score_total, smin, smax)
 
+    # Span probabilities and text facts behind the label, for /rescore; none for a cascade
+    # stage, whose probabilities were set by a rule and must not be replayed as model output
+    vectors = None
+    if not engine.startswith("cascade:"):
+        peer, self_ = pronoun_flags(tx2)
+        vectors = {
+            "whole": as_vector(rob_probs),
+            "sentences": [as_vector(scored[k]) for k in plan["k_sentences"]],
+            "front": as_vector(scored[plan["k_front"]]) if plan["k_tail"] else None,
+            "tail": as_vector(scored[plan["k_tail"]]) if plan["k_tail"] else None,
+            "toxic": toxic, "peer_pronoun": peer, "self_pronoun": self_,
+        }
+
     return {
         "label": label,
         "score": score01,
@@ -346,76 +667,549 @@ def analyze_text_full(text: str,
         "word_count": wc, "char_count": cc,
         "sentences": {"count": len(comps), "avg_compound": avg_c, "min_compound": min_c},
         "matched_tokens": matched, "negation_used": negation_used,
-        "engine": "roberta_only",
+        "engine": engine,
         "roberta": {"compound": comp, "label": rob_label, "probs": rob_probs},
-        "disparity": disp, "disparity_reason": reason, "suggest_confirm": confirm
+        "disparity": disp, "disparity_reason": reason, "suggest_confirm": confirm,
+        "vectors": vectors
     }
 
+def _finish_all(items: List[dict], plans: List[Dict[str, object]],
+                scored: Dict[str, Dict[str, float]]) -> List[dict]:
+    _neardup.learn(plans, scored)
+    results = []
+    for it, plan in zip(items, plans):
+        args = (it.get("score_total"), it.get("score_min"), it.get("score_max"), it.get("target"))
+        r = finish_item(plan, scored, *args)
+        if "cascade" in plan:
+            stage = plan["cascade"][0]
+            if plan.get("audit"):
+                model = finish_item(plan, scored, *args, use_cascade=False)
+                _CASCADE_AUDIT.inc(labels={"stage": stage, "agree": str(model["label"] == r["label"]).lower()})
+        elif "neardup" in plan:
+            stage = "neardup"
+            if plan.get("audit"):
+                model = finish_item(plan, scored, *args, use_neardup=False)
+                _NEARDUP_AUDIT.inc(labels={"agree": str(model["label"] == r["label"]).lower()})
+        else:
+            stage = "model" if plan["spans"] else "empty"
+        _CASCADE_ITEMS.inc(labels={"stage": stage})
+        if "id" in it:
+            r["id"] = it["id"]
+        results.append(r)
+    return results
+
+# Main function
+def analyze_text_full(text: str,
+                      score_total=None,
+                      score_min=None,
+                      score_max=None,
+                      target: Optional[str] = None):
+    if not _serving():
+        raise _model_unavailable()
+    item = {"score_total": score_total, "score_min": score_min, "score_max": score_max, "target": target}
+    if _gateway is not None:
+        return _gateway.analyze([dict(item, text=text)])[0]
+    plans = plan_batch([dict(item, text=text)])
+    return _finish_all([item], plans, score_spans(plans))[0]
+
+def analyze_batch(items: List[dict]) -> List[dict]:
+    """
+    Analyze many items with one inference plan: every span of every item is
+    scored together, then the per-item results are assembled in input order.
+    """
+    if not _serving():
+        raise _model_unavailable()
+    if _gateway is not None:
+        return _gateway.analyze(items)
+    with metrics.stage("preprocess"):
+        plans = plan_batch(items)
+    metrics.ITEMS.inc(len(items))
+    metrics.SPANS.inc(len({s for p in plans for s in p["spans"]}))
+    with metrics.stage("inference"):
+        scored = score_spans(plans)
+    with metrics.stage("rebalance"):
+        return _finish_all(items, plans, scored)
+
+# Gateway mode (SPE_GATEWAY_BACKENDS): batches go to the backends, no model is loaded here
+_gateway = None
+if GATEWAY_BACKENDS:
+    _gateway = Gateway(
+        GATEWAY_BACKENDS,
+        ClientIdentity(GATEWAY_CLIENT_CERT, GATEWAY_CLIENT_CERTSIG, GATEWAY_CLIENT_PRIV),
+        api_token=GATEWAY_TOKEN,
+        shard_items=GATEWAY_SHARD,
+        attempts=GATEWAY_ATTEMPTS,
+        pool_size=GATEWAY_POOL,
+        timeout=GATEWAY_TIMEOUT,
+    )
+_GATEWAY_SHARDS = metrics.REGISTRY.gauge("spe_gateway", "Gateway shards sent, retried on another backend, and failed.")
+
+# Inference runs on the scheduler thread; concurrent requests and job workers share its rounds
+_scheduler = MicroBatchScheduler(
+    lambda spans: roberta_probs_batch(spans),
+    max_wait=SCHED_MAX_WAIT_MS / 1000.0,
+    max_spans=SCHED_MAX_SPANS,
+)
+
+# Admission control: one controller per process, shared by /analyze and streamed chunks
+_admission = AdmissionController(ADMIT_TOKENS, ADMIT_QUEUE_TOKENS, max_wait=ADMIT_MAX_WAIT_S,
+                                 weights=ADMIT_WEIGHTS)
+_ADMIT_GAUGE = metrics.REGISTRY.gauge(
+    "spe_admission", "Admission control per client: in-flight and queued requests, queued tokens.")
+_ADMIT_IN_FLIGHT = metrics.REGISTRY.gauge("spe_admission_tokens_in_flight", "Estimated tokens admitted and not yet done.")
+_ADMIT_REJECTED = metrics.REGISTRY.counter(
+    "spe_admission_rejected_total", "Requests answered 429, by client and reason (queue_full, timeout).")
+
+# Asynchronous jobs: chunks are claimed by background threads (in every pre-fork worker)
+_job_store = JobStore(JOBS_PATH or ":memory:", chunk_items=JOB_CHUNK)
+_job_runner = JobRunner(_job_store, analyze_batch, ready=_serving,
+                        workers=JOB_WORKERS, retention=JOB_RETENTION_H * 3600.0)
+_JOBS_GAUGE = metrics.REGISTRY.gauge("spe_jobs", "Asynchronous jobs in the store by state.")
+
+async def analyze_batch_async(items: List[dict]) -> List[dict]:
+    """Same as analyze_batch, but never blocks the event loop."""
+    if not _serving():
+        raise _model_unavailable()
+    if _gateway is not None:
+        try:
+            with metrics.stage("gateway"):
+                return await run_in_threadpool(_gateway.analyze, items)
+        except GatewayError as e:
+            raise HTTPException(status_code=502, detail=str(e))
+    with metrics.stage("preprocess"):
+        plans = await run_in_threadpool(plan_batch, items)
+    spans = list(dict.fromkeys(s for p in plans for s in p["spans"]))
+    metrics.ITEMS.inc(len(items))
+    metrics.SPANS.inc(len(spans))
+    with metrics.stage("inference"):
+        scored = dict(zip(spans, await _scheduler.submit(spans)))
+    with metrics.stage("rebalance"):
+        return await run_in_threadpool(_finish_all, items, plans, scored)
+
+# Response helpers
+def _verify_or_403(path: str, raw_body: bytes, cert: Optional[str], certsig: Optional[str],
+                   sig: Optional[str], sig_mode: Optional[str] = None) -> str:
+    """Verify the request; returns the negotiated signature mode for the response."""
+    try:
+        with metrics.stage("verify"):
+            return verify_client_request(path, raw_body, {
+                "X-SPE-Client-Cert":    cert or "",
+                "X-SPE-Client-CertSig": certsig or "",
+                "X-SPE-Client-Sig":     sig or "",
+                "X-SPE-Sig-Mode":       sig_mode or SIG_MODE_RAW,
+            })
+    except Exception as e:
+        raise HTTPException(status_code=403, detail=str(e))
+
+def _signed_json(path: str, body_out: dict, status_code: int = 200, sig_mode: str = SIG_MODE_RAW) -> Response:
+    with metrics.stage("serialize"):
+        body = json.dumps(body_out, separators=(',', ':'), ensure_ascii=False).encode()
+    with metrics.stage("sign"):
+        signed_headers = sign_response(path, body, sig_mode)
+    return Response(content=body, media_type="application/json",
+                    headers=signed_headers, status_code=status_code)
+
+def _signed_columnar(path: str, results: List[dict], sig_mode: str = SIG_MODE_RAW, version: int = 1) -> Response:
+    """Batch results in the columnar binary format (see columnar.py), signed like JSON bodies."""
+    with metrics.stage("serialize"):
+        body = columnar.encode_results(results, version=version)
+    with metrics.stage("sign"):
+        signed_headers = sign_response(path, body, sig_mode)
+    return Response(content=body, media_type=columnar.MEDIA_TYPE, headers=signed_headers)
+
+def _request_items(request: Request, raw_body: bytes) -> Iterable[dict]:
+    """Batch mode: {"items": [...]} or one item per line (application/x-ndjson, read lazily)."""
+    if (request.headers.get("content-type") or "").lower().startswith(NDJSON_MEDIA_TYPE):
+        return _iter_ndjson(raw_body)
+    try:
+        payload = json.loads(raw_body)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Request body is not valid JSON.")
+    if not (isinstance(payload, dict) and isinstance(payload.get("items"), list)):
+        raise HTTPException(status_code=422, detail="Batch mode only. Provide 'items': [{...}, ...].")
+    return payload["items"]
+
+def _client_id(cert: Optional[str]) -> str:
+    """The id of an already verified client certificate."""
+    try:
+        return str(json.loads(cert or "{}").get("id", "unknown"))
+    except (ValueError, AttributeError):
+        return "unknown"
+
+# Streaming helpers
+def _iter_ndjson(raw: bytes) -> Iterator[dict]:
+    """Yield one item per non-empty line without splitting the whole body up front."""
+    start, n = 0, len(raw)
+    while start < n:
+        end = raw.find(b"\n", start)
+        if end < 0:
+            end = n
+        line = raw[start:end].strip()
+        start = end + 1
+        if line:
+            yield json.loads(line)
+
+def _signed_line(path: str, prev_sig: str, obj: dict) -> Tuple[str, str]:
+    """Serialize one chunk and append its chained signature as the last key."""
+    with metrics.stage("serialize"):
+        chunk = json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+    with metrics.stage("sign"):
+        sig = sign_stream_chunk(path, prev_sig, chunk)
+    return chunk[:-1] + ',"sig":"' + sig + '"}\n', sig
+
+def _overloaded(path: str, client: str, e: Overloaded, sig_mode: str = SIG_MODE_RAW) -> Response:
+    """Signed 429 with Retry-After for a request the admission controller turned away."""
+    _ADMIT_REJECTED.inc(labels={"client": client, "reason": e.reason})
+    resp = _signed_json(path, {"ok": False, "error": "Server is over capacity; retry later.",
+                               "reason": e.reason, "retry_after": e.retry_after}, 429, sig_mode)
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp
+
+async def _stream_results(path: str, items: Iterable[dict], anchor: str, client: str):
+    """
+    Analyze items STREAM_CHUNK at a time and emit each chunk as soon as it is done.
+    The last line is always a signed {"done": true} trailer so truncation is detectable.
+    """
+    prev, seq, count = anchor, 0, 0
+    it = iter(items)
+    try:
+        while True:
+            chunk = list(itertools.islice(it, STREAM_CHUNK))
+            if not chunk:
+                break
+            # Each chunk is admitted on its own, so a long stream yields to other clients between chunks
+            async with Admitted(_admission, client, estimate_tokens(chunk)):
+                results = await analyze_batch_async(chunk)
+            line, prev = await run_in_threadpool(_signed_line, path, prev, {"seq": seq, "results": results})
+            yield line
+            seq += 1
+            count += len(results)
+        final = {"seq": seq, "done": True, "ok": True, "count": count}
+    except Overloaded as e:
+        _ADMIT_REJECTED.inc(labels={"client": client, "reason": e.reason})
+        final = {"seq": seq, "done": True, "ok": False, "count": count,
+                 "error": "Server is over capacity; retry later.", "retry_after": e.retry_after}
+    except Exception as e:
+        logging.getLogger("uvicorn").error("Streamed analysis failed (%s).", str(e))
+        final = {"seq": seq, "done": True, "ok": False, "count": count,
+                 "error": str(getattr(e, "detail", "") or e)}
+    line, _ = _signed_line(path, prev, final)
+    yield line
+
 # API Endpoint
 @app.post("/analyze")
 async def analyze_unified(
     request: Request,
-    payload: dict,
     x_api_token: Optional[str] = Header(default=None),
     x_spe_client_cert: Optional[str] = Header(default=None),
     x_spe_client_certsig: Optional[str] = Header(default=None),
     x_spe_client_sig: Optional[str] = Header(default=None),
+    x_spe_sig_mode: Optional[str] = Header(default=None),
 ):
     # Verify client request using Ed25519 certificate
-    raw_body = (await request.body()).decode()
-    try:
-        verify_client_request("/analyze", raw_body, {
-            "X-SPE-Client-Cert":    x_spe_client_cert or "",
-            "X-SPE-Client-CertSig": x_spe_client_certsig or "",
-            "X-SPE-Client-Sig":     x_spe_client_sig or "",
-        })
-    except Exception as e:
-        raise HTTPException(status_code=403, detail=str(e))
+    raw_body = await request.body()
+    sig_mode = _verify_or_403("/analyze", raw_body, x_spe_client_cert, x_spe_client_certsig,
+                              x_spe_client_sig, x_spe_sig_mode)
 
     # One time handshake
     if not getattr(app.state, "handshake_logged", False):
-        plugin_id = "unknown"
-        try:
-            if x_spe_client_cert:
-                plugin_id = json.loads(x_spe_client_cert).get("id", "unknown")
-        except Exception:
-            pass
         logging.getLogger("uvicorn").info(
-            "SPE Ed25519 handshake successful with plugin id=%s", plugin_id
+            "SPE Ed25519 handshake successful with plugin id=%s", _client_id(x_spe_client_cert)
         )
         app.state.handshake_logged = True
 
     # Token gate 
     if API_TOKEN and (x_api_token or "").strip() != API_TOKEN:
-        body_out = {"ok": False, "results": []}
-        body_str = json.dumps(body_out, separators=(',', ':'), ensure_ascii=False)
-        signed_headers = sign_response("/analyze", body_str)
-        return Response(content=body_str, media_type="application/json", headers=signed_headers)
-
-    # Batch mode
-    if "items" in payload and isinstance(payload["items"], list):
-        if _roberta is None:
-            raise HTTPException(status_code=503, detail="RoBERTa model not available on server.")
-        results = []
-        for it in payload["items"][:2000]:
-            r = analyze_text_full(
-                it.get("text"),
-                it.get("score_total"),
-                it.get("score_min"),
-                it.get("score_max"),
-                it.get("target"), 
-            )
-            if "id" in it:
-                r["id"] = it["id"]
-            results.append(r)
-
-        body_out = {"ok": True, "results": results}
-        body_str = json.dumps(body_out, separators=(',', ':'), ensure_ascii=False)
-        signed_headers = sign_response("/analyze", body_str)
-        return Response(content=body_str, media_type="application/json", headers=signed_headers)
-
-    raise HTTPException(status_code=422, detail="Batch mode only. Provide 'items': [{...}, ...].")
-
-# Run the app
+        return _signed_json("/analyze", {"ok": False, "results": []}, sig_mode=sig_mode)
+
+    items = _request_items(request, raw_body)
+    client = _client_id(x_spe_client_cert)
+
+    if not _serving():
+        raise _model_unavailable()
+
+    # Streaming mode (opt-in): signed NDJSON chunks, no item cap.
+    # Columnar mode (opt-in): one signed binary batch instead of JSON, same 2000-item cap.
+    accept = (request.headers.get("accept") or "").lower()
+    if NDJSON_MEDIA_TYPE in accept:
+        headers = server_cert_headers()
+        headers["X-SPE-Stream"] = "chained"
+        return StreamingResponse(_stream_results("/analyze", items, x_spe_client_sig or "", client),
+                                 media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+    try:
+        batch = list(itertools.islice(items, 2000))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Malformed NDJSON item line.")
+    metrics.REQUEST_ITEMS.observe(len(batch))
+    try:
+        async with Admitted(_admission, client, estimate_tokens(batch)):
+            results = await analyze_batch_async(batch)
+    except Overloaded as e:
+        return _overloaded("/analyze", client, e, sig_mode)
+    if columnar.MEDIA_TYPE in accept:
+        return await run_in_threadpool(_signed_columnar, "/analyze", results, sig_mode,
+                                       columnar.requested_version(accept))
+    return await run_in_threadpool(_signed_json, "/analyze", {"ok": True, "results": results}, 200, sig_mode)
+
+# Asynchronous jobs: submit any number of items, poll for progress and results, cancel
+def _job_view(job: Dict[str, object]) -> Dict[str, object]:
+    return {k: job[k] for k in ("id", "state", "priority", "total", "done", "created", "updated", "error")}
+
+def _signed_path(request: Request) -> str:
+    """Job requests sign the path with its query string, so result windows cannot be swapped."""
+    q = request.url.query
+    return request.url.path + ("?" + q if q else "")
+
+@app.post("/jobs")
+async def jobs_submit(
+    request: Request,
+    x_api_token: Optional[str] = Header(default=None),
+    x_spe_client_cert: Optional[str] = Header(default=None),
+    x_spe_client_certsig: Optional[str] = Header(default=None),
+    x_spe_client_sig: Optional[str] = Header(default=None),
+    x_spe_sig_mode: Optional[str] = Header(default=None),
+):
+    path = "/jobs"
+    raw_body = await request.body()
+    sig_mode = _verify_or_403(path, raw_body, x_spe_client_cert, x_spe_client_certsig,
+                              x_spe_client_sig, x_spe_sig_mode)
+
+    if API_TOKEN and (x_api_token or "").strip() != API_TOKEN:
+        return _signed_json(path, {"ok": False}, sig_mode=sig_mode)
+
+    try:
+        items = list(_request_items(request, raw_body))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Malformed NDJSON item line.")
+    if not all(isinstance(it, dict) for it in items):
+        raise HTTPException(status_code=422, detail="Every item must be an object.")
+
+    client = _client_id(x_spe_client_cert)
+    job = await run_in_threadpool(_job_store.create, client, JOB_PRIORITIES.get(client, 0), items)
+    return await run_in_threadpool(_signed_json, path, {"ok": True, "job": _job_view(job)}, 202, sig_mode)
+
+@app.get("/jobs/{job_id}")
+async def jobs_status(
+    job_id: str,
+    request: Request,
+    start: int = 0,
+    limit: int = 2000,
+    x_api_token: Optional[str] = Header(default=None),
+    x_spe_client_cert: Optional[str] = Header(default=None),
+    x_spe_client_certsig: Optional[str] = Header(default=None),
+    x_spe_client_sig: Optional[str] = Header(default=None),
+    x_spe_sig_mode: Optional[str] = Header(default=None),
+):
+    """Job progress plus the finished results from `start` (in item order), at most `limit` of them."""
+    path = _signed_path(request)
+    sig_mode = _verify_or_403(path, b"", x_spe_client_cert, x_spe_client_certsig,
+                              x_spe_client_sig, x_spe_sig_mode)
+
+    if API_TOKEN and (x_api_token or "").strip() != API_TOKEN:
+        return _signed_json(path, {"ok": False}, sig_mode=sig_mode)
+
+    job = await run_in_threadpool(_job_store.get, job_id)
+    if job is None or job["client"] != _client_id(x_spe_client_cert):
+        return _signed_json(path, {"ok": False, "error": "Unknown job."}, 404, sig_mode)
+
+    start = max(0, start)
+    results, nxt = await run_in_threadpool(_job_store.results, job_id, start, max(1, min(limit, 2000)))
+    body_out = {"ok": True, "job": _job_view(job), "start": start, "next": nxt, "results": results}
+    return await run_in_threadpool(_signed_json, path, body_out, 200, sig_mode)
+
+@app.delete("/jobs/{job_id}")
+async def jobs_cancel(
+    job_id: str,
+    request: Request,
+    x_api_token: Optional[str] = Header(default=None),
+    x_spe_client_cert: Optional[str] = Header(default=None),
+    x_spe_client_certsig: Optional[str] = Header(default=None),
+    x_spe_client_sig: Optional[str] = Header(default=None),
+    x_spe_sig_mode: Optional[str] = Header(default=None),
+):
+    path = _signed_path(request)
+    sig_mode = _verify_or_403(path, b"", x_spe_client_cert, x_spe_client_certsig,
+                              x_spe_client_sig, x_spe_sig_mode)
+
+    if API_TOKEN and (x_api_token or "").strip() != API_TOKEN:
+        return _signed_json(path, {"ok": False}, sig_mode=sig_mode)
+
+    job = await run_in_threadpool(_job_store.get, job_id)
+    if job is None or job["client"] != _client_id(x_spe_client_cert):
+        return _signed_json(path, {"ok": False, "error": "Unknown job."}, 404, sig_mode)
+    job = await run_in_threadpool(_job_store.cancel, job_id)
+    return _signed_json(path, {"ok": True, "job": _job_view(job)}, sig_mode=sig_mode)
+
+# Re-label stored results under another policy: no model involved, so it also works while loading
+@app.post("/rescore")
+async def rescore_stored(
+    request: Request,
+    x_api_token: Optional[str] = Header(default=None),
+    x_spe_client_cert: Optional[str] = Header(default=None),
+    x_spe_client_certsig: Optional[str] = Header(default=None),
+    x_spe_client_sig: Optional[str] = Header(default=None),
+    x_spe_sig_mode: Optional[str] = Header(default=None),
+):
+    """
+    Body: {"policy": {field: value, ...}, "items": [{"id", "vectors", "engine", "score_total", "target"}, ...]}
+    with "vectors" and "engine" as returned by /analyze; cascade-settled items are
+    answered {"id", "rescorable": false, "engine"}. Fields missing from "policy" keep the
+    server's values; the policy actually applied is echoed back.
+    """
+    path = "/rescore"
+    raw_body = await request.body()
+    sig_mode = _verify_or_403(path, raw_body, x_spe_client_cert, x_spe_client_certsig,
+                              x_spe_client_sig, x_spe_sig_mode)
+
+    if API_TOKEN and (x_api_token or "").strip() != API_TOKEN:
+        return _signed_json(path, {"ok": False, "results": []}, sig_mode=sig_mode)
+
+    try:
+        payload = json.loads(raw_body)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Request body is not valid JSON.")
+    if not (isinstance(payload, dict) and isinstance(payload.get("items"), list)):
+        raise HTTPException(status_code=422, detail="Provide 'items': [{...}, ...] and optionally 'policy'.")
+    items = payload["items"][:RESCORE_MAX_ITEMS]
+    try:
+        policy = DEFAULT_POLICY.replace(payload.get("policy"))
+        with metrics.stage("rescore"):
+            results = await run_in_threadpool(rescore, items, policy)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return await run_in_threadpool(
+        _signed_json, path, {"ok": True, "policy": policy.as_dict(), "results": results}, 200, sig_mode)
+
+# Pair, ratee and team rollups of a whole unit in one call; no model involved either
+@app.post("/aggregate")
+async def aggregate_unit(
+    request: Request,
+    x_api_token: Optional[str] = Header(default=None),
+    x_spe_client_cert: Optional[str] = Header(default=None),
+    x_spe_client_certsig: Optional[str] = Header(default=None),
+    x_spe_client_sig: Optional[str] = Header(default=None),
+    x_spe_sig_mode: Optional[str] = Header(default=None),
+):
+    """
+    Body: {"ratings": [{"rater", "ratee", "criterion", "score"}, ...],
+           "comments": [{"rater", "ratee", "compound", "label", "disparity"}, ...],
+           "teams": {name: [user ids]}}
+    Returns per-pair, per-ratee and per-team statistics (see aggregate.py).
+    Rows are never truncated: a unit over the row cap is refused.
+    """
+    path = "/aggregate"
+    raw_body = await request.body()
+    sig_mode = _verify_or_403(path, raw_body, x_spe_client_cert, x_spe_client_certsig,
+                              x_spe_client_sig, x_spe_sig_mode)
+
+    if API_TOKEN and (x_api_token or "").strip() != API_TOKEN:
+        return _signed_json(path, {"ok": False, "pairs": [], "ratees": [], "teams": []}, sig_mode=sig_mode)
+
+    try:
+        payload = json.loads(raw_body)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Request body is not valid JSON.")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=422, detail="Provide 'ratings', 'comments' and optionally 'teams'.")
+    ratings, comments = payload.get("ratings") or [], payload.get("comments") or []
+    if isinstance(ratings, list) and isinstance(comments, list) and len(ratings) + len(comments) > AGGREGATE_MAX_ROWS:
+        raise HTTPException(status_code=422,
+                            detail=f"At most {AGGREGATE_MAX_ROWS} rating and comment rows per request.")
+    try:
+        with metrics.stage("aggregate"):
+            stats = await run_in_threadpool(aggregate, ratings, comments, payload.get("teams"))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return await run_in_threadpool(_signed_json, path, dict(ok=True, **stats), 200, sig_mode)
+
+# Metrics: Prometheus text format, unauthenticated like the probes below
+@app.get("/metrics")
+def metrics_endpoint():
+    stats = _span_cache.stats()
+    for k in ("mem_hits", "disk_hits", "misses", "evictions", "mem_items", "disk_items"):
+        _CACHE_GAUGE.set(stats[k], {"kind": k})
+    _SCHED_GAUGE.set(_scheduler.rounds, {"kind": "rounds"})
+    _SCHED_GAUGE.set(_scheduler.requests, {"kind": "requests"})
+    _MODEL_READY.set(1 if _model_state["state"] == "ready" else 0, {"backend": HF_BACKEND})
+    for client, depth in _admission.snapshot().items():
+        for kind, n in depth.items():
+            _ADMIT_GAUGE.set(n, {"client": client, "kind": kind})
+    _ADMIT_IN_FLIGHT.set(_admission.in_flight)
+    if _gateway is not None:
+        for kind, n in _gateway.counters.items():
+            _GATEWAY_SHARDS.set(n, {"kind": kind})
+    for state, n in _job_store.counts().items():
+        _JOBS_GAUGE.set(n, {"state": state})
+    for kind, n in _neardup.stats().items():
+        _NEARDUP_GAUGE.set(n, {"kind": kind})
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+# Probes: unauthenticated, unsigned and constant-time
+@app.get("/healthz")
+def healthz(response: Response):
+    # Signature modes requests may use, so clients can pick one before signing
+    response.headers["X-SPE-Sig-Mode"] = ", ".join(SIG_MODES)
+    return {"ok": True, "state": _model_state["state"]}
+
+@app.get("/readyz")
+def readyz(response: Response):
+    ready = _model_state["state"] == "ready"
+    if not ready:
+        response.status_code = 503
+    return {
+        "ok": ready,
+        "state": _model_state["state"],
+        "backend": "gateway" if _gateway is not None else HF_BACKEND,
+        "load_ms": _model_state["load_ms"],
+        "warmup_ms": _model_state["warmup_ms"],
+        "error": _model_state["error"],
+    }
+
+# Admin: drop every cached span probability (e.g. after swapping model weights in place)
+@app.post("/admin/cache/invalidate")
+async def admin_cache_invalidate(
+    request: Request,
+    x_api_token: Optional[str] = Header(default=None),
+    x_spe_client_cert: Optional[str] = Header(default=None),
+    x_spe_client_certsig: Optional[str] = Header(default=None),
+    x_spe_client_sig: Optional[str] = Header(default=None),
+    x_spe_sig_mode: Optional[str] = Header(default=None),
+):
+    path = "/admin/cache/invalidate"
+    raw_body = await request.body()
+    sig_mode = _verify_or_403(path, raw_body, x_spe_client_cert, x_spe_client_certsig,
+                              x_spe_client_sig, x_spe_sig_mode)
+
+    if API_TOKEN and (x_api_token or "").strip() != API_TOKEN:
+        return _signed_json(path, {"ok": False}, sig_mode=sig_mode)
+
+    stats = _span_cache.stats()
+    removed = _span_cache.invalidate()
+    # Near-duplicate representatives hold probabilities from the same model; unlike the span
+    # cache (whose other workers see the new generation), only this worker's index is cleared
+    neardup_removed = _neardup.clear()
+    return _signed_json(path, {"ok": True, "removed": removed, "neardup_removed": neardup_removed,
+                               "stats": stats}, sig_mode=sig_mode)
+
+# Run the app (default), or score a JSONL file offline: python -m sentiment_api batch in.jsonl out.jsonl
 if __name__ == "__main__":
-    uvicorn.run("sentiment_api:app", host=BIND_HOST, port=PORT, reload=RELOAD, access_log=False)
+    import argparse
+    import sys
+    import bulk
+
+    ap = argparse.ArgumentParser(prog="python -m sentiment_api")
+    sub = ap.add_subparsers(dest="command")
+    sub.add_parser("serve", help="run the HTTP API (the default)")
+    bulk.add_parser(sub)
+    cli = ap.parse_args()
+    if cli.command == "batch":
+        # This module is __main__ here: hand it over rather than have bulk import a second copy
+        raise SystemExit(bulk.main(cli, sys.modules[__name__]))
+
+    if WORKERS > 1 and not RELOAD:
+        from prefork import PreforkServer
+        prefork_prepare()
+        PreforkServer(app, BIND_HOST, PORT, WORKERS, after_fork=prefork_worker_init).run()
+    else:
+        uvicorn.run("sentiment_api:app", host=BIND_HOST, port=PORT, reload=RELOAD, access_log=False)
@@ -0,0 +1,209 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple, Union
+from collections import OrderedDict
+import hashlib
+import json
+import sqlite3
+import struct
+import threading
+import time
+import unicodedata
+
+# Disk eviction frees this share of disk_items at a time, so a full cache is not trimmed on every put
+EVICT_SLACK = 0.05
+# Puts between resyncs of the disk row count (other workers insert into the same file)
+RESYNC_PUTS = 1000
+
+
+def normalize_span(text: str) -> str:
+    """Canonical form of a span for cache keys (NFC, collapsed whitespace)."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class SpanCache:
+    """
+    Two-tier cache of model probabilities per span.
+
+    Tier 1 is an in-process LRU, tier 2 an SQLite file shared by restarts and
+    workers. Keys are sha256(namespace + normalized span, or its token ids);
+    the namespace holds the model name, max length and backend so a model
+    change never reuses old scores.
+
+    invalidate() bumps a generation number stored next to the rows; every
+    process sharing the file notices it on its next lookup and drops its LRU.
+    """
+
+    def __init__(self, path: Optional[str], namespace: str,
+                 mem_items: int = 50000, disk_items: int = 1000000):
+        self.namespace = namespace
+        self.mem_items = mem_items
+        self.disk_items = disk_items
+        self._mem: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        # Rows on disk as far as this process knows: an upper bound, since replaced keys count as new
+        self._disk_rows = 0
+        self._puts = 0
+        self._generation = 0
+        self.counters = {"mem_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        self.path = path
+        if path:
+            self._connect()
+
+    def _connect(self) -> None:
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS span_probs ("
+            " key TEXT PRIMARY KEY, probs TEXT NOT NULL, atime INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS span_probs_atime ON span_probs(atime)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS span_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._db.execute("INSERT OR IGNORE INTO span_meta (name, value) VALUES ('generation', 0)")
+        (self._disk_rows,) = self._db.execute("SELECT COUNT(*) FROM span_probs").fetchone()
+        self._generation = self._disk_generation()
+
+    def _disk_generation(self) -> int:
+        (gen,) = self._db.execute("SELECT value FROM span_meta WHERE name = 'generation'").fetchone()
+        return gen
+
+    def _sync_generation(self) -> None:
+        """Drop the LRU if another process invalidated the shared file since we last looked."""
+        gen = self._disk_generation()
+        if gen != self._generation:
+            self._mem.clear()
+            self._generation = gen
+
+    def reopen(self) -> None:
+        """Open a fresh SQLite connection, e.g. in a forked worker (connections must not cross fork)."""
+        self._lock = threading.Lock()
+        if self.path:
+            self._connect()
+
+    def key(self, span: Union[str, Tuple[int, ...]]) -> str:
+        """A span is its text, or the token ids cut from the item's encoding."""
+        h = hashlib.sha256()
+        h.update(self.namespace.encode())
+        if isinstance(span, tuple):
+            h.update(b"\0ids\0")
+            h.update(struct.pack(f"<{len(span)}I", *span))
+        else:
+            h.update(b"\0")
+            h.update(normalize_span(span).encode())
+        return h.hexdigest()
+
+    def _remember(self, key: str, probs: Dict[str, float]) -> None:
+        self._mem[key] = probs
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.mem_items:
+            self._mem.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def get_many(self, spans: List[str]) -> Dict[str, Dict[str, float]]:
+        """Return cached probabilities for the spans that are known; misses are left out."""
+        found: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            if self._db is not None:
+                self._sync_generation()
+            pending: Dict[str, str] = {}
+            for span in spans:
+                k = self.key(span)
+                probs = self._mem.get(k)
+                if probs is not None:
+                    self._mem.move_to_end(k)
+                    found[span] = probs
+                    self.counters["mem_hits"] += 1
+                else:
+                    pending[k] = span
+
+            if pending and self._db is not None:
+                keys = list(pending)
+                now = int(time.time())
+                for i in range(0, len(keys), 500):
+                    chunk = keys[i:i + 500]
+                    marks = ",".join("?" * len(chunk))
+                    rows = self._db.execute(
+                        f"SELECT key, probs FROM span_probs WHERE key IN ({marks})", chunk
+                    ).fetchall()
+                    for k, blob in rows:
+                        probs = json.loads(blob)
+                        found[pending.pop(k)] = probs
+                        self._remember(k, probs)
+                        self.counters["disk_hits"] += 1
+                    if rows:
+                        self._db.execute(
+                            f"UPDATE span_probs SET atime = ? WHERE key IN ({marks})", [now] + chunk
+                        )
+
+            self.counters["misses"] += len(pending)
+        return found
+
+    def put_many(self, scored: Dict[str, Dict[str, float]]) -> None:
+        if not scored:
+            return
+        with self._lock:
+            rows = []
+            now = int(time.time())
+            for span, probs in scored.items():
+                k = self.key(span)
+                self._remember(k, probs)
+                rows.append((k, json.dumps(probs, separators=(',', ':')), now))
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO span_probs (key, probs, atime) VALUES (?, ?, ?)", rows
+                )
+                self._disk_rows += len(rows)
+                self._puts += 1
+                if self._disk_rows > self.disk_items or self._puts >= RESYNC_PUTS:
+                    self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        """Count the rows for real and, over the cap, drop the least recently used down to below it."""
+        (count,) = self._db.execute("SELECT COUNT(*) FROM span_probs").fetchone()
+        self._puts = 0
+        extra = count - self.disk_items
+        if extra > 0:
+            extra += int(self.disk_items * EVICT_SLACK)
+            self._db.execute(
+                "DELETE FROM span_probs WHERE key IN "
+                "(SELECT key FROM span_probs ORDER BY atime ASC LIMIT ?)", (extra,)
+            )
+            self.counters["evictions"] += extra
+            count = max(0, count - extra)
+        self._disk_rows = count
+
+    def invalidate(self) -> int:
+        """
+        Drop every entry from both tiers; returns how many disk rows were removed.
+        Other processes on the same file drop their LRU on their next lookup; a
+        memory-only cache (no path) is private to this process.
+        """
+        with self._lock:
+            self._mem.clear()
+            removed = 0
+            if self._db is not None:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    (removed,) = self._db.execute("SELECT COUNT(*) FROM span_probs").fetchone()
+                    self._db.execute("DELETE FROM span_probs")
+                    self._db.execute("UPDATE span_meta SET value = value + 1 WHERE name = 'generation'")
+                    self._generation = self._disk_generation()
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+            self._disk_rows = 0
+            return removed
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Counters and sizes; disk_items is this process's running row count
+        (resynced every RESYNC_PUTS puts), not a COUNT(*).
+        """
+        with self._lock:
+            out = dict(self.counters)
+            out["mem_items"] = len(self._mem)
+            out["disk_items"] = self._disk_rows if self._db is not None else 0
+            return out
@@ -0,0 +1,199 @@
+from __future__ import annotations
+from typing import Dict, List, Tuple
+import re
+
+from phrases import preprocess_phrases_spans
+
+NEG_WINDOW = 3
+
+# Intensifier
+INTENSIFIER_RE = re.compile(r"\b(very|extremely|super|really)\b", re.IGNORECASE)
+def cap_intensifier_runs(text: str, max_repeats: int = 2) -> str:
+    tokens = text.split()
+    out: List[str] = []
+    run = 0
+    last_int = False
+    for t in tokens:
+        if INTENSIFIER_RE.fullmatch(t):
+            run = run + 1 if last_int else 1
+            last_int = True
+            if run <= max_repeats:
+                out.append(t)
+        else:
+            last_int = False
+            run = 0
+            out.append(t)
+    return " ".join(out)
+
+# Negation scope widening
+NEGATORS = re.compile(r"^(?:not|never|no|rarely|hardly|seldom|scarcely|barely)$", re.IGNORECASE)
+def widen_negation_scope(text: str) -> str:
+    words = re.findall(r"\w+|\W+", text)
+    out: List[str] = []
+    i = 0
+    while i < len(words):
+        w = words[i]
+        if re.fullmatch(r"\w+", w) and NEGATORS.fullmatch(w):
+            out.append(w)
+            j, seen = i + 1, 0
+            while j < len(words) and seen < NEG_WINDOW:
+                if re.fullmatch(r"\w+", words[j]):
+                    words[j] = "NOT_" + words[j]
+                    seen += 1
+                j += 1
+            i += 1
+        else:
+            out.append(w); i += 1
+    return "".join(out)
+
+# Toxic words
+TOXIC_RE = re.compile(
+    r"\b(dumbass|idiot|stupid|moron|useless|garbage|trash|loser|worthless|asshole|bitch|fuck|shit|hate|toxic|fucker)\b",
+    re.IGNORECASE)
+def is_toxic(text: str) -> bool:
+    return bool(TOXIC_RE.search(text or ""))
+
+NEGATION_MARK_RE = re.compile(r"\bNOT_\w+")
+
+# Lexicons for the token stream (same words as the regexes above)
+INTENSIFIER_WORDS = frozenset(("very", "extremely", "super", "really"))
+NEGATOR_WORDS = frozenset(("not", "never", "no", "rarely", "hardly", "seldom", "scarcely", "barely"))
+TOXIC_WORDS = frozenset((
+    "dumbass", "idiot", "stupid", "moron", "useless", "garbage", "trash", "loser",
+    "worthless", "asshole", "bitch", "fuck", "shit", "hate", "toxic", "fucker",
+))
+
+# Word runs, whitespace runs and punctuation runs; joined back they give the input verbatim
+TOKEN_RE = re.compile(r"(\w+)|(\s+)|([^\w\s]+)")
+WORD, SPACE, PUNCT = 1, 2, 3
+
+def tokenize(text: str) -> List[Tuple[int, str]]:
+    """Split text into (kind, token) pairs, kind being WORD, SPACE or PUNCT."""
+    return [(m.lastindex, m.group()) for m in TOKEN_RE.finditer(text)]
+
+def _in_lexicon(word: str, words: frozenset, regex: "re.Pattern[str]") -> bool:
+    # Unicode case-insensitive matching is wider than str.lower(); keep the regex for non-ASCII words
+    if word.isascii():
+        return word.lower() in words
+    return regex.fullmatch(word) is not None
+
+
+def normalize(tx: str, max_repeats: int = 2, neg_window: int = NEG_WINDOW) -> Dict[str, object]:
+    """
+    Normalize one stripped text in a single pass over one token stream.
+
+    Stages, in order: word/char counts and toxic lexicon lookup over the input
+    words; intensifier capping (runs of whitespace-separated intensifiers are
+    cut to `max_repeats` and whitespace collapses to single spaces); phrase
+    rewriting, spliced back into the stream; negation scoping with NOT_ marking.
+    Produces exactly what cap_intensifier_runs -> preprocess_phrases ->
+    widen_negation_scope, is_toxic and the word-count regex produced separately.
+    """
+    tokens = tokenize(tx)
+
+    # Counts, toxic lookup and intensifier capping
+    wc = 0
+    toxic = False
+    capped: List[Tuple[int, str]] = []
+    run = 0
+    i, n = 0, len(tokens)
+    while i < n:
+        if tokens[i][0] == SPACE:
+            i += 1
+            continue
+        j = i
+        while j < n and tokens[j][0] != SPACE:
+            kind, t = tokens[j]
+            if kind == WORD:
+                wc += 1
+                if not toxic and _in_lexicon(t, TOXIC_WORDS, TOXIC_RE):
+                    toxic = True
+            j += 1
+
+        chunk = tokens[i:j]
+        if len(chunk) == 1 and chunk[0][0] == WORD and _in_lexicon(chunk[0][1], INTENSIFIER_WORDS, INTENSIFIER_RE):
+            run += 1
+            keep = run <= max_repeats
+        else:
+            run = 0
+            keep = True
+        if keep:
+            if capped:
+                capped.append((SPACE, " "))
+            capped.extend(chunk)
+        i = j
+
+    # Phrase rewriting, spliced into the stream
+    capped_text = "".join(t for _, t in capped)
+    rewritten, matched, spans = preprocess_phrases_spans(capped_text)
+    stream = _splice(capped, spans) if spans else capped
+    if stream is None:
+        stream = tokenize(rewritten)
+
+    # Negation scoping and NOT_ marking
+    out: List[str] = []
+    negation_used = False
+    pending = 0
+    for kind, t in stream:
+        if kind == WORD:
+            if pending:
+                t = "NOT_" + t
+                pending -= 1
+            elif _in_lexicon(t, NEGATOR_WORDS, NEGATORS):
+                pending = neg_window
+            if not negation_used and t.startswith("NOT_") and len(t) > 4:
+                negation_used = NEGATION_MARK_RE.match(t) is not None
+        out.append(t)
+
+    tx2 = "".join(out)
+    return {
+        "tx2": tx2,
+        # NOT_ marking can split token-like text the input already contained (e.g. "x_\\2")
+        "matched": [t for t in matched if t in tx2],
+        "word_count": wc,
+        "char_count": len(tx),
+        "toxic": toxic,
+        "negation_used": negation_used,
+    }
+
+def _splice(tokens: List[Tuple[int, str]], spans: List[Tuple[int, int, str]]):
+    """
+    Replace the tokens covered by each (start, end, token) span with the token.
+    Returns None if a span does not start and end on token boundaries.
+    """
+    out: List[Tuple[int, str]] = []
+    pos = 0
+    k = 0
+    for kind, t in tokens:
+        end = pos + len(t)
+        if k < len(spans) and end > spans[k][0]:
+            start, stop, token = spans[k]
+            if pos == start:
+                out.extend(tokenize(token))
+            elif pos < start:
+                return None
+            if end >= stop:
+                if end != stop:
+                    return None
+                k += 1
+        else:
+            out.append((kind, t))
+        pos = end
+    return out if k == len(spans) else None
+
+
+# Reference pipeline: the separate passes normalize() replaces
+def normalize_reference(tx: str, max_repeats: int = 2) -> Dict[str, object]:
+    from phrases import preprocess_phrases_sequential, matched_tokens_sequential
+
+    tx2 = cap_intensifier_runs(tx, max_repeats=max_repeats)
+    tx2, dyn = preprocess_phrases_sequential(tx2)
+    tx2 = widen_negation_scope(tx2)
+    return {
+        "tx2": tx2,
+        "matched": matched_tokens_sequential(tx2, dyn),
+        "word_count": len(re.findall(r"\b\w+\b", tx)),
+        "char_count": len(tx),
+        "toxic": is_toxic(tx),
+        "negation_used": bool(re.search(r"\bNOT_\w+", tx2)),
+    }
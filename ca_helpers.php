@@ -34,8 +34,33 @@ function spe_normalize_path($path)
     return $path === '/' ? '/' : rtrim($path, '/');
 }
 
+// Signed message. 'raw' signs "path\nbody"; 'sha512' signs "path\n" + SHA-512(body),
+// so signing and verifying cost the same for any body size (sent as X-SPE-Sig-Mode).
+function spe_ca_signed_message(string $path, string $body, string $mode = 'raw'): string 
+{
+    if ($mode === 'sha512') 
+    {
+        return $path . "\n" . hash('sha512', $body, true);
+    }
+    if ($mode !== 'raw') 
+    {
+        throw new moodle_exception('Unsupported signature mode.');
+    }
+    return $path . "\n" . $body;
+}
+
+// Signature mode for requests to a server whose /healthz answered with $headers: sha512 when
+// it lists it in X-SPE-Sig-Mode, raw otherwise (older builds only check raw signatures)
+function spe_ca_pick_sig_mode(array $headers): string 
+{
+    $headers = spe_lower_header_keys($headers);
+    $modes   = $headers['x-spe-sig-mode'][0] ?? $headers['x-spe-sig-mode'] ?? '';
+    $modes   = array_map('trim', explode(',', strtolower((string)$modes)));
+    return in_array('sha512', $modes, true) ? 'sha512' : 'raw';
+}
+
 // Client request headers
-function spe_ca_build_request_headers(string $path, string $body): array 
+function spe_ca_build_request_headers(string $path, string $body, string $mode = 'raw'): array 
 {
     $path = spe_normalize_path($path);
 
@@ -65,47 +90,55 @@ function spe_ca_build_request_headers(string $path, string $body): array
     }
     $secret_key = $priv_seed . $pub_raw;
 
-    $msg = $path . "\n" . $body;
-    $sig = sodium_crypto_sign_detached($msg, $secret_key);
+    $sig = sodium_crypto_sign_detached(spe_ca_signed_message($path, $body, $mode), $secret_key);
 
-    return 
+    $out = 
     [
         'X-SPE-Client-Cert'    => SPE_CLIENT_CERT_JSON,
         'X-SPE-Client-CertSig' => SPE_CLIENT_CERT_SIG,
         'X-SPE-Client-Sig'     => spe_b64u_encode($sig),
     ];
+    if ($mode !== 'raw') 
+    {
+        $out['X-SPE-Sig-Mode'] = $mode;
+    }
+    return $out;
 }
 
-// Verify server response
-function spe_ca_verify_server_response(string $path, string $body, array $headers): void 
+// Verify server certificate headers, returns the server public key
+function spe_ca_verify_server_cert(array $headers): string 
 {
-    $path    = spe_normalize_path($path);
-    $headers = spe_lower_header_keys($headers);
-
     $cert_json = $headers['x-spe-server-cert'][0]    ?? $headers['x-spe-server-cert']    ?? '';
     $cert_sig  = $headers['x-spe-server-certsig'][0] ?? $headers['x-spe-server-certsig'] ?? '';
-    $srv_sig   = $headers['x-spe-server-sig'][0]     ?? $headers['x-spe-server-sig']     ?? '';
 
-    if (!$cert_json || !$cert_sig || !$srv_sig) 
+    if (!$cert_json || !$cert_sig) 
     {
         throw new moodle_exception('Missing server CA headers.');
     }
 
-    // Verify server certificate signature with CA public key
-    $ok = sodium_crypto_sign_verify_detached(
-        spe_b64u_decode($cert_sig),
-        $cert_json,
-        spe_b64u_decode(SPE_CA_PUB_B64)
-    );
-    if (!$ok) 
+    // Certificates already verified in this request skip the CA check; claims are still checked
+    static $verified = [];
+    $key  = $cert_json . "\n" . $cert_sig;
+    $cert = $verified[$key] ?? null;
+    if ($cert === null) 
     {
-        throw new moodle_exception('Invalid server certificate signature.');
-    }
+        // Verify server certificate signature with CA public key
+        $ok = sodium_crypto_sign_verify_detached(
+            spe_b64u_decode($cert_sig),
+            $cert_json,
+            spe_b64u_decode(SPE_CA_PUB_B64)
+        );
+        if (!$ok) 
+        {
+            throw new moodle_exception('Invalid server certificate signature.');
+        }
 
-    $cert = json_decode($cert_json, true);
-    if (!$cert || !isset($cert['pubkey'])) 
-    {
-        throw new moodle_exception('Malformed server certificate.');
+        $cert = json_decode($cert_json, true);
+        if (!$cert || !isset($cert['pubkey'])) 
+        {
+            throw new moodle_exception('Malformed server certificate.');
+        }
+        $verified[$key] = $cert;
     }
     if (($cert['exp'] ?? 0) < time()) 
     {
@@ -120,15 +153,98 @@ function spe_ca_verify_server_response(string $path, string $body, array $header
         throw new moodle_exception('Unexpected server certificate id.');
     }
 
+    return spe_b64u_decode($cert['pubkey']);
+}
+
+// Verify server response
+function spe_ca_verify_server_response(string $path, string $body, array $headers, string $anchor = ''): void 
+{
+    $path    = spe_normalize_path($path);
+    $headers = spe_lower_header_keys($headers);
+
+    // Streamed responses carry one chained signature per line instead of a header
+    if (!empty($headers['x-spe-stream'])) 
+    {
+        spe_ca_verify_server_stream($path, $body, $headers, $anchor);
+        return;
+    }
+
+    $srv_sig = $headers['x-spe-server-sig'][0] ?? $headers['x-spe-server-sig'] ?? '';
+    if (!$srv_sig) 
+    {
+        throw new moodle_exception('Missing server CA headers.');
+    }
+    $pubkey = spe_ca_verify_server_cert($headers);
+    $mode   = strtolower($headers['x-spe-sig-mode'][0] ?? $headers['x-spe-sig-mode'] ?? 'raw');
+
     // Verify response signature 
-    $msg = $path . "\n" . $body;
+    $msg = spe_ca_signed_message($path, $body, $mode);
     $ok = sodium_crypto_sign_verify_detached(
         spe_b64u_decode($srv_sig),
         $msg,
-        spe_b64u_decode($cert['pubkey'])
+        $pubkey
     );
     if (!$ok) 
     {
         throw new moodle_exception('Invalid server response signature.');
     }
 }
+
+// Verify a streamed (NDJSON) server response, returns the decoded chunks in order.
+// Each line is signed over "path\nprevsig\nchunk"; the first chunk chains to $anchor,
+// the X-SPE-Client-Sig we sent with the request.
+function spe_ca_verify_server_stream(string $path, string $body, array $headers, string $anchor): array 
+{
+    $path    = spe_normalize_path($path);
+    $headers = spe_lower_header_keys($headers);
+    $pubkey  = spe_ca_verify_server_cert($headers);
+
+    $prev   = $anchor;
+    $chunks = [];
+    $done   = false;
+    foreach (explode("\n", $body) as $line) 
+    {
+        $line = rtrim($line, "\r");
+        if ($line === '') 
+        {
+            continue;
+        }
+        if ($done) 
+        {
+            throw new moodle_exception('Unexpected data after the final stream chunk.');
+        }
+
+        $pos = strrpos($line, ',"sig":"');
+        if ($pos === false || substr($line, -2) !== '"}') 
+        {
+            throw new moodle_exception('Unsigned server stream chunk.');
+        }
+        $chunk = substr($line, 0, $pos) . '}';
+        $sig   = substr($line, $pos + 8, -2);
+
+        $ok = sodium_crypto_sign_verify_detached(
+            spe_b64u_decode($sig),
+            $path . "\n" . $prev . "\n" . $chunk,
+            $pubkey
+        );
+        if (!$ok) 
+        {
+            throw new moodle_exception('Invalid server stream signature.');
+        }
+
+        $obj = json_decode($chunk);
+        if (!is_object($obj) || (int)($obj->seq ?? -1) !== count($chunks)) 
+        {
+            throw new moodle_exception('Out-of-order server stream chunk.');
+        }
+        $chunks[] = $obj;
+        $prev     = $sig;
+        $done     = !empty($obj->done);
+    }
+
+    if (!$done) 
+    {
+        throw new moodle_exception('Truncated server stream.');
+    }
+    return $chunks;
+}
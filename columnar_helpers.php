@@ -0,0 +1,172 @@
+<?php
+defined('MOODLE_INTERNAL') || die();
+
+// Columnar binary batch format of the Sentiment API (api/columnar.py has the layout)
+define('SPE_COLUMNAR_MEDIA_TYPE', 'application/vnd.spe.columnar');
+define('SPE_COLUMNAR_NONE',       0xFFFFFFFF);
+
+// Read $k little-endian values of $size bytes each at $pos, advancing $pos
+function spe_columnar_take(string $bin, int &$pos, string $fmt, int $size, int $k): array
+{
+    if ($k === 0)
+    {
+        return [];
+    }
+    if ($pos + $size * $k > strlen($bin))
+    {
+        throw new moodle_exception('Truncated columnar response.');
+    }
+    $vals = array_values(unpack($fmt . $k, $bin, $pos));
+    $pos += $size * $k;
+    return $vals;
+}
+
+// Decode a columnar response into the same shape json_decode gives for the JSON response:
+// (object)['ok' => bool, 'results' => [stdClass, ...]]
+function spe_columnar_decode(string $bin): stdClass
+{
+    if (strlen($bin) < 14 || substr($bin, 0, 4) !== 'SPC1')
+    {
+        throw new moodle_exception('Malformed columnar response.');
+    }
+    $head = unpack('Cversion/Cok/Vn', $bin, 4);
+    $version = (int)$head['version'];
+    if ($version !== 1 && $version !== 2)
+    {
+        throw new moodle_exception('Unsupported columnar response version.');
+    }
+    $n   = (int)$head['n'];
+    $pos = 10;
+
+    // String table
+    [$count] = spe_columnar_take($bin, $pos, 'V', 4, 1);
+    $strings = [];
+    for ($i = 0; $i < $count; $i++)
+    {
+        [$len] = spe_columnar_take($bin, $pos, 'V', 4, 1);
+        if ($pos + $len > strlen($bin))
+        {
+            throw new moodle_exception('Truncated columnar response.');
+        }
+        $strings[] = substr($bin, $pos, $len);
+        $pos += $len;
+    }
+
+    // Columns
+    $ids      = spe_columnar_take($bin, $pos, 'V', 4, $n);
+    $labels   = spe_columnar_take($bin, $pos, 'C', 1, $n);
+    $rlabels  = spe_columnar_take($bin, $pos, 'C', 1, $n);
+    $flags    = spe_columnar_take($bin, $pos, 'C', 1, $n);
+    $engines  = spe_columnar_take($bin, $pos, 'V', 4, $n);
+    $reasons  = spe_columnar_take($bin, $pos, 'V', 4, $n);
+    $wcs      = spe_columnar_take($bin, $pos, 'V', 4, $n);
+    $ccs      = spe_columnar_take($bin, $pos, 'V', 4, $n);
+    $scs      = spe_columnar_take($bin, $pos, 'V', 4, $n);
+    $score    = spe_columnar_take($bin, $pos, 'e', 8, $n);
+    $compound = spe_columnar_take($bin, $pos, 'e', 8, $n);
+    $avgc     = spe_columnar_take($bin, $pos, 'e', 8, $n);
+    $minc     = spe_columnar_take($bin, $pos, 'e', 8, $n);
+    $robc     = spe_columnar_take($bin, $pos, 'e', 8, $n);
+    $probs    = spe_columnar_take($bin, $pos, 'e', 8, 3 * $n);
+    $mcounts  = spe_columnar_take($bin, $pos, 'v', 2, $n);
+    $matched  = spe_columnar_take($bin, $pos, 'V', 4, (int)array_sum($mcounts));
+
+    // Version 2: span probabilities (vflags bit 0 present, 1 contrast split, 2 peer pronoun, 3 self pronoun)
+    $vflags = [];
+    $contrast = [];
+    $sentvecs = [];
+    if ($version === 2)
+    {
+        $vflags = spe_columnar_take($bin, $pos, 'C', 1, $n);
+        $ncontrast = 0;
+        $nsentences = 0;
+        for ($i = 0; $i < $n; $i++)
+        {
+            $ncontrast  += ($vflags[$i] & 2) ? 1 : 0;
+            $nsentences += ($vflags[$i] & 1) ? $scs[$i] : 0;
+        }
+        $contrast = spe_columnar_take($bin, $pos, 'e', 8, 6 * $ncontrast);
+        $sentvecs = spe_columnar_take($bin, $pos, 'e', 8, 3 * $nsentences);
+    }
+    if ($pos !== strlen($bin))
+    {
+        throw new moodle_exception('Malformed columnar response.');
+    }
+
+    $labelnames = ['negative', 'neutral', 'positive', 'toxic'];
+    $results = [];
+    $m = 0;
+    $c = 0;
+    $v = 0;
+    for ($i = 0; $i < $n; $i++)
+    {
+        $f = $flags[$i];
+        $tokens = [];
+        for ($j = 0; $j < $mcounts[$i]; $j++)
+        {
+            $tokens[] = $strings[$matched[$m + $j]];
+        }
+        $m += $mcounts[$i];
+
+        $res = (object)
+        [
+            'label'            => $labelnames[$labels[$i]] ?? 'neutral',
+            'score'            => $score[$i],
+            'compound'         => $compound[$i],
+            'toxic'            => (bool)($f & 1),
+            'word_count'       => $wcs[$i],
+            'char_count'       => $ccs[$i],
+            'sentences'        => (object)['count' => $scs[$i], 'avg_compound' => $avgc[$i], 'min_compound' => $minc[$i]],
+            'matched_tokens'   => $tokens,
+            'negation_used'    => (bool)($f & 2),
+            'engine'           => $strings[$engines[$i]] ?? '',
+            'roberta'          => (object)
+            [
+                'compound' => $robc[$i],
+                'label'    => $labelnames[$rlabels[$i]] ?? 'neutral',
+                'probs'    => (object)['negative' => $probs[3 * $i], 'neutral' => $probs[3 * $i + 1], 'positive' => $probs[3 * $i + 2]],
+            ],
+            'disparity'        => (bool)($f & 4),
+            'disparity_reason' => $reasons[$i] === SPE_COLUMNAR_NONE ? null : ($strings[$reasons[$i]] ?? null),
+            'suggest_confirm'  => (bool)($f & 8),
+        ];
+        if ($version === 2)
+        {
+            $res->vectors = null;
+            if ($vflags[$i] & 1)
+            {
+                $front = null;
+                $tail  = null;
+                if ($vflags[$i] & 2)
+                {
+                    $front = array_slice($contrast, $c, 3);
+                    $tail  = array_slice($contrast, $c + 3, 3);
+                    $c += 6;
+                }
+                $rows = [];
+                for ($j = 0; $j < $scs[$i]; $j++)
+                {
+                    $rows[] = array_slice($sentvecs, $v + 3 * $j, 3);
+                }
+                $v += 3 * $scs[$i];
+                $res->vectors = (object)
+                [
+                    'whole'        => [$probs[3 * $i], $probs[3 * $i + 1], $probs[3 * $i + 2]],
+                    'sentences'    => $rows,
+                    'front'        => $front,
+                    'tail'         => $tail,
+                    'toxic'        => (bool)($f & 1),
+                    'peer_pronoun' => (bool)($vflags[$i] & 4),
+                    'self_pronoun' => (bool)($vflags[$i] & 8),
+                ];
+            }
+        }
+        if ($ids[$i] !== SPE_COLUMNAR_NONE)
+        {
+            $res->id = $strings[$ids[$i]];
+        }
+        $results[] = $res;
+    }
+
+    return (object)['ok' => (bool)$head['ok'], 'results' => $results];
+}
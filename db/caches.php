@@ -0,0 +1,16 @@
+<?php
+defined('MOODLE_INTERNAL') || die();
+
+$definitions = 
+[
+
+    // Sentiment API /aggregate result per activity (keyed by spe id), so report pages do not
+    // call the API on every view; cleared when analysis results are pushed or a submission is reset
+    'aggregate' => 
+    [
+        'mode'       => cache_store::MODE_APPLICATION,
+        'simplekeys' => true,
+        'simpledata' => false,
+        'ttl'        => 300
+    ]
+];
@@ -183,5 +183,18 @@ function xmldb_spe_upgrade(int $oldversion)
         upgrade_mod_savepoint(true, 2025111100, 'spe');
     }
 
+    // === STEP 3: Keep the API's span probabilities so results can be re-labelled via /rescore ===
+    if ($oldversion < 2025111500) 
+    {
+        $table = new xmldb_table('spe_sentiment');
+        $field = new xmldb_field('vectors', XMLDB_TYPE_TEXT, null, null, null, null, null, 'label');
+        if ($dbman->table_exists($table) && !$dbman->field_exists($table, $field)) 
+        {
+            $dbman->add_field($table, $field);
+        }
+
+        upgrade_mod_savepoint(true, 2025111500, 'spe');
+    }
+
     return true;
 }
@@ -139,6 +139,41 @@ if ($mgr->table_exists('spe_disparity'))
     }
 }
 
+// Peer comment sentiment per ratee: one /aggregate call to the Sentiment API for the whole
+// activity (cached for a few minutes), or a single grouped query when the API is not
+// configured or unavailable
+require_once(__DIR__ . '/aggregate_helpers.php');
+$peersent = [];
+$agg = spe_aggregate_fetch((int)$cm->instance);
+if ($agg !== null) 
+{
+    foreach ($agg->ratees as $st) 
+    {
+        if (isset($st->peer->compound_mean)) 
+        {
+            $peersent[(int)$st->ratee] = (float)$st->peer->compound_mean;
+        }
+    }
+} 
+elseif ($mgr->table_exists('spe_sentiment')) 
+{
+    $srows = $DB->get_records_sql("
+        SELECT s.rateeid, AVG(s.sentiment) AS avgsent
+          FROM {spe_sentiment} s
+         WHERE s.speid = :speid
+           AND s.type  = 'peer_comment'
+           AND s.raterid <> s.rateeid
+      GROUP BY s.rateeid
+    ", $params);
+    foreach ($srows as $sr) 
+    {
+        if ($sr->avgsent !== null) 
+        {
+            $peersent[(int)$sr->rateeid] = (float)$sr->avgsent;
+        }
+    }
+}
+
 // Search bar
 $searchurl = new moodle_url('/mod/spe/gradebook.php', ['id' => $cm->id]);
 echo html_writer::start_div('', ['style' => 'display:flex; justify-content:flex-end; margin-bottom:8px;']);
@@ -250,19 +285,7 @@ foreach ($users as $uid => $u)
     }
 
     // Sentiment
-    $avgnorm = $DB->get_field_sql("
-        SELECT AVG(s.sentiment)
-          FROM {spe_sentiment} s
-         WHERE s.speid   = :speid
-           AND s.rateeid = :uid
-           AND s.type    = 'peer_comment'
-    ", ['speid' => $cm->instance, 'uid' => $uid]);
-
-    if ($avgnorm === false || $avgnorm === null) 
-    { 
-        $avgnorm = 0.5; 
-    }
-    $avgnorm = (float)$avgnorm;
+    $avgnorm = array_key_exists($uid, $peersent) ? (float)$peersent[$uid] : 0.5;
     if ($avgnorm < 0) $avgnorm = 0.0;
     if ($avgnorm > 1) $avgnorm = 1.0;
 
@@ -14,6 +14,7 @@ $string['spe:viewreports'] = 'View SPE reports';
 $string['spe:manage']      = 'Manage SPE settings';
 $string['sentiment_url'] = 'Sentiment API URL';
 $string['sentiment_token'] = 'Sentiment API token';
+$string['cachedef_aggregate'] = 'Sentiment API statistics per activity';
 $string['analysisreport'] = 'Sentiment Analysis Report';
 $string['analysisreportdesc']   = 'See labels, scores, and excerpts for all queued reflections and peer comments.';
 $string['instructordashboard']  = 'Instructor Dashboard';
@@ -36,6 +36,9 @@ $DB->delete_records('spe_sentiment',
     'raterid' => $userid
 ]);
 
+require_once(__DIR__ . '/aggregate_helpers.php');
+spe_aggregate_invalidate((int)$cm->instance);
+
 // Remove disparity
 $manager = $DB->get_manager();
 if ($manager->table_exists('spe_disparity')) 
@@ -2,7 +2,7 @@
 defined('MOODLE_INTERNAL') || die();
 
 $plugin->component = 'mod_spe';       // Full name of the plugin.
-$plugin->version   = 2025111400;     // YYYYMMDDHH 
+$plugin->version   = 2025111600;     // YYYYMMDDHH 
 $plugin->requires  = 2022041900;      // Moodle version 
 $plugin->maturity  = MATURITY_ALPHA; 
 $plugin->release   = 'v0.1';         